@@ -0,0 +1,74 @@
+"""scaling benchmark of the sharded backfill against a local mock server
+
+It backfills the same manifest, a few instruments of M1 candle sticks
+over some weeks, on an increasing number of processes and reports the
+throughput and the speedup over a single process. The mock server
+runs in this process and its latency stands for the network, so that
+the curve shows how decoding and writing, which are CPU bound, spread
+over cores. Results are written as JSON.
+
+Usage: python benchmarks/backfill_bench.py [-P 1 2 4 8] [-i 8] [-d 28] [--latency 0.05] [-f csv] [-o results.json]
+"""
+import argparse, json, os, platform, sys, tempfile, time
+from datetime import date, timedelta, datetime, timezone
+
+import context
+from mock_server import MockServer
+from oandata.backfill import backfill
+from oandata.fetcher import Job
+from oandata.storage import FORMATS
+
+FROM_DATE=date(2020, 1, 6) # a Monday
+INSTRUMENTS=('EUR_USD', 'GBP_USD', 'USD_JPY', 'AUD_USD', 'USD_CAD', 'USD_CHF', 'NZD_USD', 'EUR_GBP',
+             'EUR_JPY', 'GBP_JPY', 'EUR_CHF', 'AUD_JPY', 'EUR_AUD', 'CAD_JPY', 'GBP_CHF', 'EUR_CAD')
+
+def main():
+    parser=argparse.ArgumentParser(description='Benchmark the scaling of the sharded backfill.')
+    parser.add_argument('--processes', '-P', type=int, nargs='+', default=[1, 2, 4, os.cpu_count()])
+    parser.add_argument('--instruments', '-i', type=int, default=8)
+    parser.add_argument('--days', '-d', type=int, default=28)
+    parser.add_argument('--shard-days', type=int, default=7)
+    parser.add_argument('--latency', type=float, default=0.05, help='the seconds the server waits per request')
+    parser.add_argument('--format', '-f', choices=FORMATS, default='csv')
+    parser.add_argument('--output', '-o', type=str, default=None, help='the JSON file results are written to, printed if not given')
+    args=parser.parse_args()
+
+    jobs=[Job(instrument, FROM_DATE, FROM_DATE + timedelta(days=args.days - 1), 'M1', 'BA', None)
+          for instrument in INSTRUMENTS[:args.instruments]]
+    results=[]
+    with MockServer(latency=args.latency) as server:
+        for processes in sorted(set(args.processes)):
+            with tempfile.TemporaryDirectory() as d:
+                start=time.perf_counter()
+                index=backfill(server.config(), jobs, d, processes=processes, fmt=args.format, shard_days=args.shard_days, rate=0)
+                seconds=time.perf_counter() - start
+            candles=sum(e['rows'] for e in index['shards'])
+            result={
+                'processes': processes,
+                'shards': len(index['shards']),
+                'candles': candles,
+                'seconds': seconds,
+                'candles_per_second': candles / seconds,
+                'speedup': results[0]['seconds'] / seconds if results else 1.0,
+            }
+            print('{processes:>3} processes: {shards} shards, {candles} candles in {seconds:.2f} s, '
+                  '{candles_per_second:>9.0f} candles/s, speedup {speedup:.2f}'.format(**result), file=sys.stderr)
+            results.append(result)
+
+    report={
+        'meta': {
+            'time': datetime.now(timezone.utc).isoformat(),
+            'python': platform.python_version(),
+            'cores': os.cpu_count(),
+            'args': vars(args),
+        },
+        'results': results,
+    }
+    if args.output is None:
+        print(json.dumps(report, indent=2))
+    else:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+if __name__ == '__main__':
+    main()
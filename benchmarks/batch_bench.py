@@ -0,0 +1,36 @@
+"""benchmark of per-process overhead removed by batch fetching
+
+Wrapping `fetch_oandata` in a shell loop starts one interpreter per
+instrument, each importing pandas and creating its own v20 context.
+This script measures that overhead for N instruments against running
+them in one process, which pays it once. No request is sent.
+
+Usage: python benchmarks/batch_bench.py [instruments]
+"""
+import os, sys, subprocess, time
+
+ROOT=os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+SETUP=('from oandata.factory import Factory\n'
+       'import oandata.fetcher\n'
+       "Factory({'hostname': 'api-fxpractice.oanda.com', 'token': 'x'}).createContext()\n")
+
+def main():
+    n=int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    env=dict(os.environ, PYTHONPATH=ROOT)
+
+    start=time.perf_counter()
+    for _ in range(n):
+        subprocess.run([sys.executable, '-c', SETUP], check=True, env=env)
+    per_process=time.perf_counter() - start
+
+    start=time.perf_counter()
+    subprocess.run([sys.executable, '-c', SETUP], check=True, env=env)
+    batch=time.perf_counter() - start
+
+    print('instruments: {}'.format(n))
+    print('one process per instrument: {:.2f} s'.format(per_process))
+    print('one process in total:       {:.2f} s'.format(batch))
+    print('saved:                      {:.2f} s'.format(per_process - batch))
+
+if __name__ == '__main__':
+    main()
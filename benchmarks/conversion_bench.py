@@ -0,0 +1,57 @@
+"""micro-benchmark of converting candle sticks to a dataframe
+
+It compares `candlesToDataFrame` against the former implementation of
+`Instrument._getCandles`, which walks the candle sticks once per
+column and builds a `pd.Timestamp` per candle stick.
+
+Usage: python benchmarks/conversion_bench.py [candles] [repeat]
+"""
+import sys, timeit
+from datetime import datetime, timedelta, timezone
+import pandas as pd
+
+from context import instrument as ins
+from fake_context import makeCandle
+
+def legacyCandlesToDataFrame(candleSticks):
+    indexes=[pd.Timestamp(cs.time) for cs in candleSticks]
+    candleSticksDataFrame={}
+    if candleSticks[0].bid is not None:
+        candleSticksDataFrame['Open']=[cs.bid.o for cs in candleSticks]
+        candleSticksDataFrame['Close']=[cs.bid.c for cs in candleSticks]
+        candleSticksDataFrame['Low']=[cs.bid.l for cs in candleSticks]
+        candleSticksDataFrame['High']=[cs.bid.h for cs in candleSticks]
+
+    if candleSticks[0].ask is not None:
+        candleSticksDataFrame['Open']=[cs.ask.o for cs in candleSticks]
+        candleSticksDataFrame['Close']=[cs.ask.c for cs in candleSticks]
+        candleSticksDataFrame['Low']=[cs.ask.l for cs in candleSticks]
+        candleSticksDataFrame['High']=[cs.ask.h for cs in candleSticks]
+
+    if candleSticks[0].mid is not None:
+        candleSticksDataFrame['Open']=[cs.mid.o for cs in candleSticks]
+        candleSticksDataFrame['Close']=[cs.mid.c for cs in candleSticks]
+        candleSticksDataFrame['Low']=[cs.mid.l for cs in candleSticks]
+        candleSticksDataFrame['High']=[cs.mid.h for cs in candleSticks]
+    candleSticksDataFrame['Volume']=[cs.volume for cs in candleSticks]
+    candleSticksDataFrame['Complete']=[cs.complete for cs in candleSticks]
+    return pd.DataFrame(candleSticksDataFrame, index=indexes)
+
+def main():
+    n=int(sys.argv[1]) if len(sys.argv) > 1 else ins.Constants.MAX_CANDLE_STICKS
+    repeat=int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    start=datetime(2020, 1, 1, tzinfo=timezone.utc)
+    candles=[makeCandle(start + timedelta(seconds=5 * i)) for i in range(n)]
+
+    if not legacyCandlesToDataFrame(candles).equals(ins.candlesToDataFrame(candles)):
+        print('warning: outputs differ')
+
+    legacy=min(timeit.repeat(lambda: legacyCandlesToDataFrame(candles), number=1, repeat=repeat))
+    current=min(timeit.repeat(lambda: ins.candlesToDataFrame(candles), number=1, repeat=repeat))
+    print('candles: {}'.format(n))
+    print('legacy:  {:.3f} ms'.format(legacy * 1e3))
+    print('current: {:.3f} ms'.format(current * 1e3))
+    print('speedup: {:.1f}x'.format(legacy / current))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,43 @@
+"""micro-benchmark of decoding a candles response
+
+It compares parsing a response body into v20 objects and converting
+them by `candlesToDataFrame` against decoding it straight into
+columns by `candleDictsToDataFrame`, as done when the context is a
+v20.Context.
+
+Usage: python benchmarks/decode_bench.py [candles] [repeat]
+"""
+import sys, json, timeit
+from datetime import datetime, timedelta, timezone
+import v20
+from v20.instrument import Candlestick
+
+from context import instrument as ins
+from mock_server import candleDict
+
+def main():
+    n=int(sys.argv[1]) if len(sys.argv) > 1 else ins.Constants.MAX_CANDLE_STICKS
+    repeat=int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    start=datetime(2020, 1, 1, tzinfo=timezone.utc)
+    body=json.dumps({'instrument': 'EUR_USD', 'granularity': 'S5',
+                     'candles': [candleDict(start + timedelta(seconds=5 * i), 'BA') for i in range(n)]})
+    ctx=v20.Context('localhost')
+
+    def objects():
+        return ins.candlesToDataFrame([Candlestick.from_dict(d, ctx) for d in json.loads(body)['candles']])
+
+    def columns():
+        return ins.candleDictsToDataFrame(ins.json.loads(body)['candles'])
+
+    if not objects().equals(columns()):
+        print('warning: outputs differ')
+
+    v20_path=min(timeit.repeat(objects, number=1, repeat=repeat))
+    fast_path=min(timeit.repeat(columns, number=1, repeat=repeat))
+    print('candles:      {}'.format(n))
+    print('v20 objects:  {:.3f} ms'.format(v20_path * 1e3))
+    print('fast decoder: {:.3f} ms'.format(fast_path * 1e3))
+    print('speedup:      {:.1f}x'.format(v20_path / fast_path))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+"""end-to-end benchmark of the fetch path against a local mock server
+
+For each granularity and range length, it measures `getCandles`
+throughput through a real v20 context talking to `MockServer`, the
+cost of converting v20 candle sticks to a dataframe per candle stick,
+the memory peak of fetching and the time of writing the result in
+csv. Results are written as JSON, so that runs can be compared to
+catch regressions.
+
+Usage: python benchmarks/fetch_bench.py [-g S5 M1 H1] [-d 1 7] [--latency 0.01] [-o results.json]
+"""
+import argparse, json, os, platform, sys, tempfile, time, timeit, tracemalloc
+from datetime import date, datetime, timedelta, timezone
+import numpy as np
+import pandas as pd
+import v20
+from v20.instrument import Candlestick
+
+from context import instrument as ins
+from mock_server import MockServer, candleDict
+from oandata.storage import CsvSink
+from oandata.retry import RetryPolicy
+
+FROM_DATE=date(2020, 1, 6) # a Monday
+
+def conversionCost(granularity, repeat):
+    """measures the seconds of converting a page of v20 candle sticks, per candle stick
+    """
+    ctx=v20.Context('localhost')
+    step=timedelta(seconds=ins.getGranularityInSec(granularity))
+    start=datetime(2020, 1, 6, tzinfo=timezone.utc)
+    candles=[Candlestick.from_dict(candleDict(start + i * step), ctx) for i in range(ins.Constants.MAX_CANDLE_STICKS)]
+    return min(timeit.repeat(lambda: ins.candlesToDataFrame(candles), number=1, repeat=repeat)) / len(candles)
+
+def run(server, granularity, days, workers, repeat):
+    to_date=FROM_DATE + timedelta(days=days - 1)
+    instrument=ins.Instrument.fromConfigDict(server.config(), retry_policy=RetryPolicy(base_delay=0.01))
+
+    def fetch():
+        return instrument.getCandles('EUR_USD', FROM_DATE, to_date, granularity=granularity, workers=workers, retry=10)
+
+    timings=[]
+    for _ in range(repeat):
+        requests=len(server.requests)
+        start=time.perf_counter()
+        df=fetch()
+        timings.append(time.perf_counter() - start)
+        requests=len(server.requests) - requests
+
+    # memory is traced in a separate run, since tracing slows it down
+    tracemalloc.start()
+    fetch()
+    peak=tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    with tempfile.TemporaryDirectory() as d:
+        start=time.perf_counter()
+        sink=CsvSink(os.path.join(d, 'out.csv'))
+        sink.write(df)
+        sink.close()
+        csv_seconds=time.perf_counter() - start
+
+    fetch_seconds=min(timings)
+    return {
+        'granularity': granularity,
+        'days': days,
+        'candles': len(df),
+        'requests': requests,
+        'fetch_seconds': fetch_seconds,
+        'candles_per_second': len(df) / fetch_seconds,
+        'conversion_us_per_candle': conversionCost(granularity, repeat) * 1e6,
+        'memory_peak_bytes': peak,
+        'csv_write_seconds': csv_seconds,
+    }
+
+def main():
+    parser=argparse.ArgumentParser(description='Benchmark the fetch path against a local mock server.')
+    parser.add_argument('--granularities', '-g', nargs='+', choices=ins.GRANULARITY, default=['S5', 'M1', 'H1'])
+    parser.add_argument('--days', '-d', nargs='+', type=int, default=[1, 7])
+    parser.add_argument('--workers', '-w', type=int, default=1)
+    parser.add_argument('--latency', type=float, default=0, help='the seconds the server waits per request')
+    parser.add_argument('--error-rate', type=float, default=0, help='the probability of server errors')
+    parser.add_argument('--throttle-rate', type=float, default=0, help='the probability of too many requests')
+    parser.add_argument('--repeat', '-r', type=int, default=3)
+    parser.add_argument('--output', '-o', type=str, default=None, help='the JSON file results are written to, printed if not given')
+    args=parser.parse_args()
+
+    results=[]
+    with MockServer(latency=args.latency, error_rate=args.error_rate, throttle_rate=args.throttle_rate, retry_after=0.01, seed=0) as server:
+        for granularity in args.granularities:
+            for days in args.days:
+                result=run(server, granularity, days, args.workers, args.repeat)
+                print('{granularity:>4} {days:>3} days: {candles:>7} candles, {candles_per_second:>9.0f} candles/s, '
+                      '{conversion_us_per_candle:.2f} us/candle, peak {memory_peak_bytes} B, csv {csv_write_seconds:.3f} s'.format(**result),
+                      file=sys.stderr)
+                results.append(result)
+
+    report={
+        'meta': {
+            'time': datetime.now(timezone.utc).isoformat(),
+            'python': platform.python_version(),
+            'pandas': pd.__version__,
+            'numpy': np.__version__,
+            'args': vars(args),
+        },
+        'results': results,
+    }
+    if args.output is None:
+        print(json.dumps(report, indent=2))
+    else:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+"""benchmark of reading price data back in each output format
+
+It writes the same price data in every format supported by
+`oandata.storage` and compares the size on disk and the time it takes
+to load it with `loadPriceData` against csv. For npy, the time to map
+the columns without copying (`oandata.columnar.openColumns`) is
+reported as well. Formats requiring pyarrow are skipped if it is
+not installed.
+
+Usage: python benchmarks/formats_bench.py [rows] [dtype]
+"""
+import os, sys, tempfile, time
+import numpy as np
+import pandas as pd
+
+import context
+from oandata import storage, columnar
+
+def makeFrame(n):
+    rng=np.random.default_rng(0)
+    close=1.1 + np.cumsum(rng.normal(0, 1e-4, n)).round(5)
+    return pd.DataFrame({
+        'Open': close + 1e-5,
+        'Close': close,
+        'Low': close - 2e-5,
+        'High': close + 2e-5,
+        'Volume': rng.integers(1, 100, n),
+        'Complete': np.ones(n, dtype=bool),
+        }, index=pd.date_range('2015-01-01', periods=n, freq='5s', tz='UTC'))
+
+def size(path):
+    if os.path.isdir(path):
+        return sum(os.path.getsize(os.path.join(path, f)) for f in os.listdir(path))
+    return os.path.getsize(path)
+
+def timed(f):
+    start=time.perf_counter()
+    f()
+    return time.perf_counter() - start
+
+def main():
+    n=int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    dtype=sys.argv[2] if len(sys.argv) > 2 else None
+    df=makeFrame(n)
+    with tempfile.TemporaryDirectory() as tmp:
+        results={}
+        for fmt, name in (('csv', 'out.csv'), ('parquet', 'out.parquet'), ('feather', 'out.feather'), ('npy', 'out')):
+            path=os.path.join(tmp, name)
+            try:
+                sink=storage.createSink(path, fmt=fmt, dtype=dtype)
+            except ValueError as exp:
+                print('{:8} skipped: {}'.format(fmt, exp))
+                continue
+            for i in range(0, n, 2500):
+                sink.write(df.iloc[i:i + 2500])
+            sink.close()
+            results[fmt]=(size(path), timed(lambda: storage.loadPriceData(path)))
+            if fmt == 'npy':
+                results['npy-mmap']=(size(path), timed(lambda: columnar.openColumns(path)))
+
+    print('rows: {}, dtype: {}'.format(n, dtype or 'as fetched'))
+    csv_time=results['csv'][1]
+    for fmt, (nbytes, t) in results.items():
+        print('{:8} {:8.1f} MB  load {:8.3f} s  ({:.1f}x faster than csv)'.format(fmt, nbytes / 2**20, t, csv_time / t))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+"""benchmark of the memory held by price data in each layout
+
+It decodes a day of S5 candle sticks (17280 of them) as sent by the
+v20 REST server, once with prices as floats and once as strings
+(`decimal_number_as_float=False`), and reports the bytes taken by the
+resulting dataframe against each compact layout of `oandata.compact`,
+with the time of converting into it and whether converting back is
+exact. It then extrapolates to a year of S5 data for 50 instruments.
+
+Usage: python benchmarks/memory_bench.py [price] [candles]
+"""
+import sys, time
+from datetime import datetime, timedelta, timezone
+import numpy as np
+
+from context import instrument as ins
+from mock_server import candleDict
+from oandata.compact import LAYOUTS, compactFrame, expandFrame
+
+YEAR_OF_S5=260 * 24 * 3600 // 5 # candle sticks of S5 on the trading days of a year
+INSTRUMENTS=50
+
+def sizeOf(df):
+    return int(df.memory_usage(index=True, deep=True).sum())
+
+def main():
+    price=sys.argv[1] if len(sys.argv) > 1 else 'M'
+    n=int(sys.argv[2]) if len(sys.argv) > 2 else 24 * 3600 // 5
+    start=datetime(2020, 1, 6, tzinfo=timezone.utc)
+    candles=[candleDict(start + timedelta(seconds=5 * i), price) for i in range(n)]
+
+    df=ins.candleDictsToDataFrame(candles)
+    strings=ins.candleDictsToDataFrame(candles, as_float=False)
+    baseline=sizeOf(df)
+    print('candles: {}, price: {}'.format(n, price))
+    print('{:<16} {:>12} {:>10} {:>10} {:>12} {:>8}'.format('layout', 'bytes', 'B/candle', 'ratio', 'convert (ms)', 'exact'))
+    print('{:<16} {:>12} {:>10.1f} {:>10.2f} {:>12} {:>8}'.format('default (str)', sizeOf(strings), sizeOf(strings) / n, sizeOf(strings) / baseline, '-', '-'))
+    print('{:<16} {:>12} {:>10.1f} {:>10.2f} {:>12} {:>8}'.format('default (float)', baseline, baseline / n, 1.0, '-', '-'))
+    for layout in LAYOUTS:
+        t=time.perf_counter()
+        compact=compactFrame(df, layout)
+        seconds=time.perf_counter() - t
+        expanded=expandFrame(compact)
+        if layout == 'float32':
+            # the precision contract: rounding to the quoted decimals gives back the quoted prices
+            exact=np.array_equal(expanded.round(5).to_numpy(), df.to_numpy())
+        else:
+            exact=expanded.equals(df)
+        size=sizeOf(compact)
+        print('{:<16} {:>12} {:>10.1f} {:>10.2f} {:>12.3f} {:>8}'.format(layout, size, size / n, size / baseline, seconds * 1e3, str(exact)))
+        if layout == 'float32':
+            float32=size
+
+    print('a year of S5 for {} instruments: {:.1f} GiB by default, {:.1f} GiB as float32'.format(
+        INSTRUMENTS, baseline / n * YEAR_OF_S5 * INSTRUMENTS / 2**30, float32 / n * YEAR_OF_S5 * INSTRUMENTS / 2**30))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,50 @@
+"""benchmark of merging overlapping pages
+
+It cuts a frame of S5 candle sticks into pages of 2500 rows, each
+overlapping the previous one by a candle stick, and merges them once
+by `oandata.merge.mergePages` and once by concatenating them and then
+dropping duplicates and sorting, as done before the merge stage.
+
+Usage: python benchmarks/merge_bench.py [rows]
+"""
+import sys, time
+import numpy as np
+import pandas as pd
+
+import context
+from oandata.merge import mergePages
+
+PAGE=2500
+
+def makeFrame(n):
+    rng=np.random.default_rng(0)
+    close=1.1 + np.cumsum(rng.normal(0, 1e-4, n)).round(5)
+    return pd.DataFrame({
+        'Open': close + 1e-5,
+        'Close': close,
+        'Low': close - 2e-5,
+        'High': close + 2e-5,
+        'Volume': rng.integers(1, 100, n),
+        'Complete': np.ones(n, dtype=bool),
+        }, index=pd.date_range('2015-01-01', periods=n, freq='5s', tz='UTC'))
+
+def dedupeAndSort(pages):
+    df=pd.concat(pages)
+    return df[~df.index.duplicated(keep='first')].sort_index()
+
+def main():
+    n=int(sys.argv[1]) if len(sys.argv) > 1 else 2000000
+    df=makeFrame(n)
+    pages=[df[max(0, i - 1):i + PAGE] for i in range(0, n, PAGE)]
+    print('rows: {}, pages: {}'.format(n, len(pages)))
+    results=[]
+    for name, merge in (('dedupe+sort', dedupeAndSort), ('merge', lambda p: mergePages(p, 'S5')[0])):
+        start=time.perf_counter()
+        merged=merge(pages)
+        seconds=time.perf_counter() - start
+        assert merged.equals(df)
+        results.append(seconds)
+        print('{:<12} {:>10.3f} s {:>8.1f}x'.format(name, seconds, results[0] / seconds))
+
+if __name__ == '__main__':
+    main()
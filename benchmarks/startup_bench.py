@@ -0,0 +1,74 @@
+"""benchmark of the startup time of the command line tools
+
+It runs short invocations of the fetcher and the batch fetcher in
+fresh interpreters, e.g. `fetch_oandata -h`, and reports their median
+wall time above that of a bare interpreter, i.e. the time spent in
+importing oandata and parsing arguments. The time of importing the
+heavy dependencies (pandas and v20) is reported for comparison.
+
+It exits with status 1 if an invocation takes longer than the
+threshold, so that it can guard against regressions, e.g. a module
+importing pandas at the top again.
+
+Usage: python benchmarks/startup_bench.py [--repeat 15] [--threshold 0.1] [-o results.json]
+"""
+import argparse, json, os, platform, statistics, subprocess, sys, time
+from datetime import datetime, timezone
+
+ROOT=os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+# the invocations, as python code run in a fresh interpreter
+INVOCATIONS = {
+    'fetcher -h': 'import sys; sys.argv=["fetch_oandata", "-h"]\nfrom oandata import fetcher\ntry: fetcher.main()\nexcept SystemExit: pass',
+    'batch -h': 'import sys; sys.argv=["fetch_oandata_batch", "-h"]\nfrom oandata import batch\ntry: batch.main()\nexcept SystemExit: pass',
+    'fetcher parse': 'from oandata import fetcher\nfetcher.ArgumentWrapper(fetcher.createParser().parse_args(["EUR_USD", "2020-01-01", "2020-03-31", "-g", "M1", "-o", "out.csv"])).getJobs()',
+    'import pandas+v20': 'import pandas, v20',
+}
+
+def measure(code, repeat):
+    timings=[]
+    for _ in range(repeat):
+        start=time.perf_counter()
+        subprocess.run([sys.executable, '-c', code], cwd=ROOT, check=True, stdout=subprocess.DEVNULL)
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+def main():
+    parser=argparse.ArgumentParser(description='Benchmark the startup time of the command line tools.')
+    parser.add_argument('--repeat', '-r', type=int, default=15)
+    parser.add_argument('--threshold', '-t', type=float, default=0.1, help='the maximum seconds an invocation of the tools may take above a bare interpreter')
+    parser.add_argument('--output', '-o', type=str, default=None, help='the JSON file results are written to, printed if not given')
+    args=parser.parse_args()
+
+    baseline=measure('pass', args.repeat)
+    print('{:<20} {:>8.1f} ms'.format('bare interpreter', baseline * 1e3), file=sys.stderr)
+    results={}
+    regressions=[]
+    for name, code in INVOCATIONS.items():
+        overhead=measure(code, args.repeat) - baseline
+        results[name]=overhead
+        print('{:<20} {:>8.1f} ms'.format(name, overhead * 1e3), file=sys.stderr)
+        if not name.startswith('import') and overhead > args.threshold:
+            regressions.append(name)
+
+    report={
+        'meta': {
+            'time': datetime.now(timezone.utc).isoformat(),
+            'python': platform.python_version(),
+            'args': vars(args),
+        },
+        'baseline_seconds': baseline,
+        'overhead_seconds': results,
+        'regressions': regressions,
+    }
+    if args.output is None:
+        print(json.dumps(report, indent=2))
+    else:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    if regressions:
+        print('startup regression: {} took longer than {} s'.format(', '.join(regressions), args.threshold), file=sys.stderr)
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
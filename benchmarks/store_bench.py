@@ -0,0 +1,78 @@
+"""benchmark of reading many small windows of the same price data
+
+It stores a year of M1 candle sticks once in a `oandata.store.CandleStore`
+and once as csv, then reads the same random windows of a few days
+from each: by binary search over the memory mapped store, by
+reparsing the csv and slicing it, and by reading the columnar files
+and masking them, which is what the cache did before. The mean time
+per window is reported.
+
+Usage: python benchmarks/store_bench.py [windows] [days]
+"""
+import os, sys, tempfile, time
+from datetime import date, timedelta
+import numpy as np
+import pandas as pd
+
+import context
+from oandata import storage, columnar
+from oandata.store import CandleStore
+
+FROM_DATE=date(2019, 1, 1)
+TO_DATE=date(2019, 12, 31)
+
+def makeFrame():
+    index=pd.date_range(str(FROM_DATE), str(TO_DATE + timedelta(days=1)), freq='1min', tz='UTC', inclusive='left')
+    rng=np.random.default_rng(0)
+    close=1.1 + np.cumsum(rng.normal(0, 1e-4, len(index))).round(5)
+    return pd.DataFrame({
+        'Open': close + 1e-5,
+        'Close': close,
+        'Low': close - 2e-5,
+        'High': close + 2e-5,
+        'Volume': rng.integers(1, 100, len(index)),
+        'Complete': np.ones(len(index), dtype=bool),
+        }, index=index)
+
+def timed(read, windows):
+    start=time.perf_counter()
+    for s, e in windows:
+        read(s, e)
+    return (time.perf_counter() - start) / len(windows)
+
+def main():
+    n=int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    days=int(sys.argv[2]) if len(sys.argv) > 2 else 3
+    rng=np.random.default_rng(1)
+    starts=rng.integers(0, (TO_DATE - FROM_DATE).days - days, n)
+    windows=[(FROM_DATE + timedelta(days=int(d)), FROM_DATE + timedelta(days=int(d) + days - 1)) for d in starts]
+
+    df=makeFrame()
+    with tempfile.TemporaryDirectory() as d:
+        store=CandleStore(d)
+        store.write('EUR_USD', 'M1', 'M', FROM_DATE, TO_DATE, df)
+        csv=os.path.join(d, 'EUR_USD.csv')
+        storage.createSink(csv).write(df)
+        path=os.path.join(d, 'EUR_USD', 'M1', 'M')
+
+        def readCsv(s, e):
+            return storage.loadPriceData(csv)[str(s):str(e)]
+
+        def readMasked(s, e):
+            frame=columnar.readColumns(path)
+            index=frame.index
+            return frame[(index >= pd.Timestamp(s, tz='UTC')) & (index < pd.Timestamp(e + timedelta(days=1), tz='UTC'))]
+
+        def readStore(s, e):
+            return store.load('EUR_USD', 'M1', 'M', s, e)
+
+        print('rows: {}, windows: {} of {} days'.format(len(df), n, days))
+        print('{:<12} {:>14} {:>10}'.format('reader', 'ms/window', 'speedup'))
+        results=[]
+        for name, read, count in (('csv', readCsv, max(1, n // 20)), ('mask', readMasked, n), ('store', readStore, n)):
+            seconds=timed(read, windows[:count])
+            results.append((name, seconds))
+            print('{:<12} {:>14.3f} {:>10.1f}'.format(name, seconds * 1e3, results[0][1] / seconds))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,426 @@
+import asyncio, logging, ssl as _ssl, time
+from urllib.parse import urlencode, quote
+import pandas as pd
+from requests.structures import CaseInsensitiveDict
+from v20.response import Response
+from v20.errors import ResponseUnexpectedStatus, V20ConnectionError, V20Timeout
+
+from oandata.factory import Factory
+from oandata.instrument import (Constants, CANDLES_PARAMS, Pager, checkArguments, getSplitIntervals,
+                                candleDictsToDataFrame, json)
+from oandata.ratelimit import getRateLimiter
+from oandata.retry import RetryPolicy, FetchError, isRetryable, statusOf
+from oandata.metrics import getMetrics
+from oandata.merge import PageMerger
+
+DEFAULT_CONNECTIONS=10 # the default maximum number of connections kept to the server
+READ_SIZE=65536        # the maximum number of bytes of a body read at once
+
+## Non-blocking HTTP/1.1 client of the v20 REST server
+#
+# It is built on asyncio streams, so it needs no third-party package.
+# Connections are kept alive and reused, at most `connections` of them
+# at the same time. It sends the same headers as v20.Context. The poll
+# timeout bounds each read, so a large response arriving steadily is
+# not cut off.
+class AsyncClient:
+    def __init__(self, hostname, token, port=443, ssl=True, application='', datetime_format='RFC3339',
+                 poll_timeout=2, decimal_number_as_float=True, connections=DEFAULT_CONNECTIONS, **kwargs):
+        """create an instance of AsyncClient
+
+        The parameters are those of v20.Context, see `Factory`. The
+        others, e.g. of streaming, are ignored.
+
+        :param connections: the maximum number of connections
+        :type connections: int
+        """
+        self.hostname=hostname
+        self.decimal_number_as_float=decimal_number_as_float
+        self._port=port
+        self._ssl=_ssl.create_default_context() if ssl else None
+        self._base_url='{}://{}:{}'.format('https' if ssl else 'http', hostname, port)
+        self._timeout=poll_timeout
+        self._headers={
+            'Host': hostname if port in (80, 443) else '{}:{}'.format(hostname, port),
+            'Content-Type': 'application/json',
+            'OANDA-Agent': 'v20-python/3.0.25' + (' ({})'.format(application) if application else ''),
+            'Authorization': 'Bearer {}'.format(token),
+            'Accept-Datetime-Format': datetime_format,
+            'Connection': 'keep-alive',
+        }
+        self._idle=[] # connections ready to be reused
+        self._slots=asyncio.Semaphore(connections)
+
+    async def _connect(self, reuse=True):
+        if reuse and self._idle:
+            return self._idle.pop(), True
+        return await self._wait(asyncio.open_connection(self.hostname, self._port, ssl=self._ssl)), False
+
+    async def _wait(self, awaitable):
+        # a single read or write, bounded by the poll timeout
+        return await asyncio.wait_for(awaitable, self._timeout)
+
+    async def _readHeaders(self, readline):
+        # header lines up to the empty line, also used for the trailers of chunked bodies
+        headers=CaseInsensitiveDict()
+        while True:
+            line=(await readline()).decode('latin-1').rstrip('\r\n')
+            if not line:
+                return headers
+            if ':' in line: # malformed lines are ignored
+                name, value=line.split(':', 1)
+                headers[name.strip()]=value.strip()
+
+    async def _readResponse(self, reader):
+        """reads a response of HTTP/1.1 or HTTP/1.0
+
+        Interim responses (1xx) are skipped, the reason phrase may be
+        missing and the trailers of a chunked body are read and ignored.
+
+        :return: the status, the reason phrase, the headers and the body
+        :rtype: tuple
+        """
+        readline=lambda: self._wait(reader.readline())
+        while True:
+            status_line=await readline()
+            if not status_line:
+                raise ConnectionError('connection closed by the server')
+            fields=status_line.decode('latin-1').rstrip('\r\n').split(' ', 2)
+            if len(fields) < 2 or not fields[0].startswith('HTTP/'):
+                raise ValueError('invalid status line: {!r}'.format(status_line))
+            version, status, reason=fields[0], int(fields[1]), fields[2] if len(fields) == 3 else ''
+            headers=await self._readHeaders(readline)
+            if not 100 <= status < 200:
+                break
+        if version == 'HTTP/1.0' and headers.get('Connection', '').lower() != 'keep-alive':
+            headers['Connection']='close'
+        if status in (204, 304):
+            body=b''
+        elif headers.get('Transfer-Encoding', '').lower() == 'chunked':
+            chunks=[]
+            while True:
+                size=int((await readline()).split(b';')[0], 16)
+                if size == 0:
+                    await self._readHeaders(readline) # the trailers
+                    break
+                chunks.append(await self._wait(reader.readexactly(size)))
+                await readline()
+            body=b''.join(chunks)
+        else:
+            # the body is read as it arrives, so that the timeout applies to each read
+            length=int(headers['Content-Length']) if 'Content-Length' in headers else None
+            chunks=[]
+            received=0
+            while length is None or received < length:
+                chunk=await self._wait(reader.read(READ_SIZE if length is None else min(READ_SIZE, length - received)))
+                if not chunk:
+                    if length is not None:
+                        raise asyncio.IncompleteReadError(b''.join(chunks), length)
+                    break
+                chunks.append(chunk)
+                received+=len(chunk)
+            body=b''.join(chunks)
+            if length is None:
+                headers['Connection']='close'
+        return status, reason, headers, body
+
+    async def get(self, path, params):
+        """sends a GET request
+
+        :param path: the path of the endpoint
+        :param params: the query parameters, those being None are skipped
+        :type path: str
+        :type params: dict
+        :return: the response, with the body in `raw_body`
+        :rtype: v20.response.Response
+        :raise: V20Timeout or V20ConnectionError if the request failed
+        """
+        query=urlencode([(k, str(v)) for k, v in params.items() if v is not None])
+        target=path + ('?' + query if query else '')
+        url=self._base_url + target
+        request='GET {} HTTP/1.1\r\n{}\r\n'.format(target, ''.join('{}: {}\r\n'.format(k, v) for k, v in self._headers.items()))
+        async with self._slots:
+            reuse=True
+            while True:
+                connection=None
+                reused=False
+                try:
+                    connection, reused=await self._connect(reuse)
+                    reader, writer=connection
+                    writer.write(request.encode('latin-1'))
+                    await self._wait(writer.drain())
+                    status, reason, headers, body=await self._readResponse(reader)
+                except asyncio.TimeoutError:
+                    self._discard(connection)
+                    raise V20Timeout(url, 'read')
+                except (OSError, ConnectionError, asyncio.IncompleteReadError, ValueError) as exp:
+                    self._discard(connection)
+                    if reused and not isinstance(exp, ValueError):
+                        # the server closed the idle connection, a new one is opened at once
+                        reuse=False
+                        continue
+                    raise V20ConnectionError(url)
+                except BaseException:
+                    # e.g. cancelled, the connection is in an unknown state
+                    self._discard(connection)
+                    raise
+                break
+            if headers.get('Connection', '').lower() == 'close':
+                self._discard(connection)
+            else:
+                self._idle.append(connection)
+        response=Response(None, 'GET', url, status, reason, headers)
+        response.set_raw_body(body.decode('utf-8'))
+        return response
+
+    def _discard(self, connection):
+        if connection is not None:
+            connection[1].close()
+
+    async def close(self):
+        """closes the connections kept alive
+        """
+        idle, self._idle=self._idle, []
+        for reader, writer in idle:
+            writer.close()
+        for reader, writer in idle:
+            try:
+                await writer.wait_closed()
+            except OSError:
+                pass
+
+## Price data of instruments fetched without blocking the event loop
+#
+# It mirrors `oandata.instrument.Instrument`: arguments are verified,
+# the period is split and each split is fetched page by page the same
+# way, with the same retry policy and per-host rate limit. Up to
+# `workers` splits are fetched concurrently. Cancelling a call, or
+# closing its iterator, cancels all requests still running.
+class AsyncInstrument:
+    def __init__(self, client, retry_policy=None, metrics=None):
+        """create an instance of AsyncInstrument
+
+        :param client: the client requests are sent through
+        :param retry_policy: the backoff between retries of a failed
+        request. If not given, the default `RetryPolicy` is used.
+        :param metrics: the metrics timings and counters are recorded
+        in. If not given, the process-wide metrics are used.
+        :type client: AsyncClient
+        :type retry_policy: oandata.retry.RetryPolicy
+        :type metrics: oandata.metrics.Metrics
+        """
+        self._client=client
+        self._retry_policy=retry_policy if retry_policy is not None else RetryPolicy()
+        self._metrics=metrics if metrics is not None else getMetrics()
+        self._limiter=getRateLimiter(client.hostname, Constants.MAX_REQUESTS_PER_SEC)
+
+    @classmethod
+    def fromConfigFile(cls, config_file, retry_policy=None, metrics=None):
+        factory=Factory.fromConfigFile(config_file)
+        return cls(factory.createAsyncClient(), retry_policy=retry_policy, metrics=metrics)
+
+    @classmethod
+    def fromConfigDict(cls, config_dict, retry_policy=None, metrics=None):
+        factory=Factory(config_dict)
+        return cls(factory.createAsyncClient(), retry_policy=retry_policy, metrics=metrics)
+
+    async def close(self):
+        """closes the connections of the client
+        """
+        await self._client.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        await self.close()
+
+    async def _getCandles(self, instrument, **kwargs):
+        """the counterpart of `Instrument._getCandles`
+        """
+        wait=self._limiter.reserve()
+        if wait > 0:
+            await asyncio.sleep(wait)
+        metrics=self._metrics
+        metrics.increment('requests')
+        start=time.perf_counter()
+        resp=await self._client.get('/v3/instruments/{}/candles'.format(quote(instrument)),
+                                    {param: kwargs.get(arg) for param, arg in CANDLES_PARAMS})
+        metrics.observe('http', time.perf_counter() - start)
+        metrics.increment('bytes_received', len(resp.raw_body))
+        if resp.status != 200:
+            raise ResponseUnexpectedStatus(resp, 200)
+        candleSticks=json.loads(resp.raw_body).get('candles')
+        metrics.observe('request', time.perf_counter() - start)
+        if candleSticks is None or not isinstance(candleSticks, list) or len(candleSticks)==0:
+            logging.warning("No result was found or it is invalid")
+            return None
+        metrics.increment('candles', len(candleSticks))
+        with metrics.timer('dataframe'):
+            return candleDictsToDataFrame(candleSticks, self._client.decimal_number_as_float)
+
+    async def _fetchPage(self, instrument, retry, **kwargs):
+        """the counterpart of `Instrument._fetchPage`
+        """
+        exception=None
+        for attempt in range(retry):
+            try:
+                return await self._getCandles(instrument, **kwargs)
+            except Exception as exp:
+                if not isRetryable(exp):
+                    raise
+                exception=exp
+                if attempt + 1 == retry:
+                    break
+                self._metrics.increment('retries')
+                delay=self._retry_policy.delay(attempt, exp)
+                logging.warning('Failed ({0}), retry in {1:.2f} seconds ...'.format(exp, delay))
+                if statusOf(exp) == 429:
+                    self._limiter.pause(delay) # slows down every request sent to the host
+                else:
+                    await asyncio.sleep(delay)
+        self._metrics.increment('failures')
+        logging.error('Fetching data from \'{0}\' failed, aborting...'.format(kwargs['fromTime']))
+        raise FetchError(str(exception), [])
+
+    async def _iterSplit(self, instrument, start, end, granularity, price, retry):
+        """the counterpart of `Instrument._iterSplit`
+        """
+        logging.info('Fetching data from \'{0}\' to \'{1}\' ...'.format(start, end))
+        pager=Pager(start, end, granularity, price)
+        while True:
+            kwargs=pager.request()
+            if kwargs is None:
+                return
+            try:
+                df=await self._fetchPage(instrument, retry, **kwargs)
+            except FetchError as exp:
+                raise FetchError(str(exp), [pager.remaining()])
+            page=pager.advance(df)
+            if page is not None:
+                yield page
+
+    async def _iterRange(self, instrument, from_date, to_date, granularity, price, split, retry, workers):
+        """the counterpart of `Instrument._iterRange`
+        """
+        split_intervals=getSplitIntervals(from_date, to_date, split, workers)
+        failed=[]
+        if workers == 1 or len(split_intervals) == 1:
+            for s,e in split_intervals:
+                try:
+                    async for df in self._iterSplit(instrument, s, e, granularity, price, retry):
+                        yield df
+                except FetchError as exp:
+                    failed+=exp.failed_ranges
+        else:
+            active=asyncio.Semaphore(workers)
+            async def fetch(s, e, pages):
+                # the split ends with None or the exception it failed with
+                async with active:
+                    try:
+                        async for df in self._iterSplit(instrument, s, e, granularity, price, retry):
+                            await pages.put(df)
+                    except Exception as exp:
+                        await pages.put(exp)
+                        return
+                    await pages.put(None)
+
+            splits=[]
+            for s,e in split_intervals:
+                pages=asyncio.Queue(maxsize=Constants.PAGE_BUFFER)
+                splits.append((pages, asyncio.ensure_future(fetch(s, e, pages))))
+            try:
+                for pages, task in splits:
+                    while True:
+                        df=await pages.get()
+                        if df is None:
+                            break
+                        if isinstance(df, FetchError):
+                            failed+=df.failed_ranges
+                            break
+                        if isinstance(df, Exception):
+                            raise df
+                        yield df
+            finally:
+                # stops the splits still running, e.g. if cancelled. A
+                # cancellation may be swallowed, e.g. by wait_for before
+                # Python 3.12, so splits are cancelled until they end.
+                tasks=[task for pages, task in splits]
+                pending=tasks
+                while pending:
+                    for task in pending:
+                        task.cancel()
+                    _, pending=await asyncio.wait(pending, timeout=0.1)
+                await asyncio.gather(*tasks, return_exceptions=True)
+        if failed:
+            raise FetchError('Fetching {} range(s) failed after retries'.format(len(failed)), failed)
+
+    def iterCandles(self, instrument, from_date, to_date,
+                    granularity=Constants.DEFAULT_GRANULARITY,
+                    price=Constants.DEFAULT_PRICE,
+                    split=None, # let the number of splits equal the number of workers
+                    retry=Constants.DEFAULT_RETRY,
+                    workers=Constants.DEFAULT_WORKERS, merger=None):
+        """fetch candle data from OANDA page by page
+
+        The parameters are those of `Instrument.getCandles`. They are
+        verified when this method is called. Pages are stitched as by
+        `Instrument.iterCandles`.
+
+        :return: an asynchronous generator yielding non-empty dataframes of candle sticks in time order
+        :raise: ValueError if an argument is not valid. While
+        iterating, FetchError after all pages that could be fetched
+        are yielded, if some ranges failed after retries.
+        """
+        from_date, to_date=checkArguments(from_date, to_date, granularity, price, split, retry, workers)
+        pages=self._iterRange(instrument, from_date, to_date, granularity, price, split, retry, workers)
+        return self._mergePages(pages, PageMerger(granularity) if merger is None else merger)
+
+    async def _mergePages(self, pages, merger):
+        duplicates=merger.duplicates
+        try:
+            async for df in pages:
+                df=merger.add(df)
+                if df is not None and len(df) > 0:
+                    yield df
+        except Exception:
+            df=merger.finish()
+            if df is not None:
+                yield df
+            raise
+        finally:
+            await pages.aclose()
+            self._metrics.increment('duplicates', merger.duplicates - duplicates)
+        df=merger.finish()
+        if df is not None:
+            yield df
+
+    async def getCandles(self, instrument, from_date, to_date,
+                         granularity=Constants.DEFAULT_GRANULARITY,
+                         price=Constants.DEFAULT_PRICE,
+                         split=None, # let the number of splits equal the number of workers
+                         retry=Constants.DEFAULT_RETRY,
+                         workers=Constants.DEFAULT_WORKERS, merger=None):
+        """fetch candle data from OANDA
+
+        The parameters and the result are those of `Instrument.getCandles`.
+
+        :rtype: pandas.DataFrame
+        :raise: ValueError if an argument is not valid, FetchError if
+        some ranges failed after retries, holding the price data that
+        was fetched in `data`, ResponseUnexpectedStatus if the request
+        to v20 REST server is not valid.
+        """
+        df_list=[]
+        pages=self.iterCandles(instrument, from_date, to_date, granularity=granularity,
+                               price=price, split=split, retry=retry, workers=workers, merger=merger)
+        try:
+            async for df in pages:
+                df_list.append(df)
+        except FetchError as exp:
+            exp.data=pd.DataFrame() if len(df_list) == 0 else pd.concat(df_list)
+            raise
+        finally:
+            await pages.aclose()
+        with self._metrics.timer('concat'):
+            return pd.DataFrame() if len(df_list) == 0 else pd.concat(df_list)
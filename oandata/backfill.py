@@ -0,0 +1,279 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os, json, shutil, argparse, logging
+from datetime import date, timedelta
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from oandata.instrument import Instrument, Constants
+from oandata.factory import Factory
+from oandata.storage import FORMATS, DTYPES, createSink
+from oandata.ratelimit import SharedRateLimiter, setRateLimiter
+from oandata.retry import FetchError
+from oandata.checkpoint import CHECKPOINT_CANDLES, getCheckpoints
+from oandata.batch import readManifest
+
+INDEX='index.json'             # the name of the index of shards in the output directory
+FAILED_MANIFEST='failed.csv'   # the name of the manifest of failed ranges in the output directory
+
+# the extension of shard files of each format
+EXTENSIONS = {
+    'csv': '.csv',
+    'parquet': '.parquet',
+    'feather': '.feather',
+    'npy': '',
+}
+
+## creates a parser
+#
+def createParser():
+    parser = argparse.ArgumentParser(description='Backfill historical price data from oanda on several processes, one shard file per instrument, granularity and time range.')
+    parser.add_argument('manifest', type=argparse.FileType('r'), help='the path to the manifest file, in the format of fetch_oandata_batch, e.g. "EUR_USD,M1,2010-01-01,2019-12-31,B".')
+    parser.add_argument('--output', '-o', type=str, required=True, help='the directory shard files and their index ({}) are written to. Shards listed in an existing index are not fetched again.'.format(INDEX))
+    parser.add_argument('--config_file', '-c', type=argparse.FileType('r'), default=None, help='the path to the config file. Giving a proper config file is mandatory.')
+    parser.add_argument('--processes', '-P', type=int, default=os.cpu_count(), help='the number of processes shards are fetched on (default the number of cores).')
+    parser.add_argument('--shard-days', type=int, default=None, help='the number of days of each shard. If not given, each shard holds about {} candle sticks.'.format(CHECKPOINT_CANDLES))
+    parser.add_argument('--rate', type=float, default=Constants.MAX_REQUESTS_PER_SEC, help='the maximum number of requests per second of all processes together, per token if the config file has several, unless a token sets its own rate (default {}).'.format(Constants.MAX_REQUESTS_PER_SEC))
+    parser.add_argument('--retry', '-r', type=int, default=Constants.DEFAULT_RETRY, help='the number of retries, when a fetch request failed (default {}).'.format(Constants.DEFAULT_RETRY))
+    parser.add_argument('--format', '-f', choices=FORMATS, default='csv', help='the format of shard files (default csv).')
+    parser.add_argument('--dtype', choices=DTYPES, default=None, help='the dtype of prices in shard files. If not given, prices are stored as fetched.')
+    return parser
+
+class Shard:
+    """the price data of an instrument within a time range, stored in its own file
+
+    :ivar instrument: the name of instrument
+    :ivar granularity: the frequency of price data
+    :ivar price: indicates which of bid, ask or mid price is recorded
+    :ivar start: the first date of the range
+    :ivar end: the last date of the range
+    :ivar filename: the name of the shard file, relative to the output directory
+    """
+    def __init__(self, instrument, granularity, price, start, end, filename):
+        self.instrument=instrument
+        self.granularity=granularity
+        self.price=price
+        self.start=start
+        self.end=end
+        self.filename=filename
+
+    def key(self):
+        return (self.instrument, self.granularity, self.price, self.start.isoformat(), self.end.isoformat())
+
+def getShards(jobs, fmt, shard_days=None):
+    """splits jobs into shards
+
+    :param jobs: the jobs of the backfill
+    :param fmt: the format of shard files, one of `FORMATS`
+    :param shard_days: the number of days of each shard. If not given,
+    the ranges of `oandata.checkpoint.getCheckpoints` are used.
+    :type jobs: list of oandata.fetcher.Job
+    :type fmt: str
+    :type shard_days: positive int
+    :rtype: list of Shard
+    """
+    shards=[]
+    for job in jobs:
+        ranges=[]
+        # only the ranges of a job are fetched if it has some, see `oandata.fetcher.Job`
+        for start, end in (job.ranges if job.ranges is not None else [(job.from_date, job.to_date)]):
+            if shard_days is None:
+                ranges+=getCheckpoints(start, end, job.granularity)
+                continue
+            s=start
+            while s <= end:
+                e=min(end, s + timedelta(days=shard_days - 1))
+                ranges.append((s, e))
+                s=e + timedelta(days=1)
+        for s,e in ranges:
+            filename='{}_{}_{}_{}_{}{}'.format(job.instrument, job.granularity, job.price, s, e, EXTENSIONS[fmt])
+            shards.append(Shard(job.instrument, job.granularity, job.price, s, e, filename))
+    return shards
+
+# the state of a worker process, set by `_initWorker`
+_worker={}
+
+def _initWorker(factory, limiters, output, fmt, dtype, kwargs):
+    for name, limiter in limiters.items():
+        setRateLimiter(factory.limiterKey(name), limiter)
+    _worker['instrument']=Instrument(factory.createTokenPool())
+    _worker['output']=output
+    _worker['fmt']=fmt
+    _worker['dtype']=dtype
+    _worker['kwargs']=kwargs
+
+def _removeFile(filename):
+    if os.path.isdir(filename):
+        shutil.rmtree(filename)
+    elif os.path.exists(filename):
+        os.remove(filename)
+
+def fetchShard(shard):
+    """fetches a shard in a worker process and writes its file
+
+    The file is written under a temporary name and renamed once
+    complete, so that a shard file is either complete or missing.
+
+    :type shard: Shard
+    :return: the index entry of the shard, holding the number of rows
+    and the times of the first and last rows. Its 'filename' is None if
+    the range holds no price data, and its 'failed' lists the ranges
+    that failed after retries, if any.
+    :rtype: dict
+    """
+    entry={'instrument': shard.instrument, 'granularity': shard.granularity, 'price': shard.price,
+           'start': shard.start.isoformat(), 'end': shard.end.isoformat(), 'filename': None,
+           'rows': 0, 'first': None, 'last': None, 'failed': []}
+    filename=os.path.join(_worker['output'], shard.filename)
+    tmp=filename + '.tmp'
+    _removeFile(tmp)
+    kwargs=dict(_worker['kwargs'], granularity=shard.granularity, price=shard.price)
+    sink=None
+    try:
+        for df in _worker['instrument'].iterCandles(shard.instrument, shard.start, shard.end, **kwargs):
+            if sink is None:
+                sink=createSink(tmp, fmt=_worker['fmt'], dtype=_worker['dtype'])
+                entry['first']=df.index[0].isoformat()
+            sink.write(df)
+            entry['rows']+=len(df)
+            entry['last']=df.index[-1].isoformat()
+    except FetchError as exp:
+        entry['failed']=[(s.isoformat(), e.isoformat()) for s,e in exp.failed_ranges]
+    finally:
+        if sink is not None:
+            sink.close()
+    if entry['failed']:
+        _removeFile(tmp)
+        entry['rows']=0
+        entry['first']=entry['last']=None
+    elif sink is not None:
+        _removeFile(filename)
+        os.replace(tmp, filename)
+        entry['filename']=shard.filename
+    return entry
+
+def loadIndex(output):
+    """loads the index of shards in an output directory
+
+    :param output: the output directory
+    :type output: str
+    :return: the index, with key 'shards' listing the entry of each
+    completed shard, see `fetchShard`, or None if there is no index
+    :rtype: dict
+    """
+    filename=os.path.join(output, INDEX)
+    if not os.path.isfile(filename):
+        return None
+    with open(filename) as f:
+        return json.load(f)
+
+def _writeIndex(output, entries, failed):
+    index={'shards': sorted(entries, key=lambda e: (e['instrument'], e['granularity'], e['price'], e['start'])),
+           'failed': failed}
+    filename=os.path.join(output, INDEX)
+    with open(filename + '.tmp', 'w') as f:
+        json.dump(index, f, indent=1)
+    os.replace(filename + '.tmp', filename)
+    return index
+
+def backfill(config, jobs, output, processes=None, fmt='csv', dtype=None, shard_days=None,
+             rate=Constants.MAX_REQUESTS_PER_SEC, kwargs=None, mp_context=None):
+    """fetches price data of jobs into shard files on a process pool
+
+    Each job is split into shards, see `getShards`, which are fetched
+    on `processes` processes. All processes share one rate budget of
+    `rate` requests per second per token, or the 'rate' of the token
+    if it is configured. Each shard is written into its own
+    file in `output`, and the index of all shards is written into
+    `output/index.json`. Shards listed in an existing index are
+    skipped, so running a backfill again fetches only what is missing.
+    Ranges that failed are also listed in `output/failed.csv`, in the
+    manifest format of the batch fetcher.
+
+    :param config: the configuration of the v20 context, or a
+    factory whose tokens requests are spread across, see `oandata.factory.Factory`
+    :param jobs: the jobs of the backfill, their output is ignored
+    :param output: the output directory
+    :param processes: the number of processes, the number of cores if not given
+    :param fmt: the format of shard files, one of `FORMATS`
+    :param dtype: the dtype of prices in shard files
+    :param shard_days: the number of days of each shard, see `getShards`
+    :param rate: the maximum number of requests per second of all processes per token
+    :param kwargs: keyworded arguments passed to `Instrument.iterCandles`, e.g. retry
+    :param mp_context: the multiprocessing context of the pool
+    :type config: dict or oandata.factory.Factory
+    :type jobs: list of oandata.fetcher.Job
+    :type output: str
+    :type processes: positive int
+    :type fmt: str
+    :type dtype: str
+    :type shard_days: positive int
+    :type rate: float
+    :type kwargs: dict
+    :return: the index
+    :rtype: dict
+    :raise: FetchError after all shards are run, if some ranges failed after retries
+    """
+    if fmt not in FORMATS:
+        raise ValueError('Given format \'{}\' is not supported.'.format(fmt))
+    os.makedirs(output, exist_ok=True)
+    kwargs=dict({'workers': 1}, **(kwargs or {}))
+    index=loadIndex(output)
+    done={}
+    if index is not None:
+        for entry in index['shards']:
+            if entry['filename'] is None or os.path.exists(os.path.join(output, entry['filename'])):
+                done[(entry['instrument'], entry['granularity'], entry['price'], entry['start'], entry['end'])]=entry
+    shards=[shard for shard in getShards(jobs, fmt, shard_days) if shard.key() not in done]
+    logging.info('Backfilling {} shard(s), {} already done'.format(len(shards), len(done)))
+
+    entries=list(done.values())
+    failed=[]
+    if shards:
+        factory=config if isinstance(config, Factory) else Factory(config)
+        limiters={name: SharedRateLimiter(token.get('rate', rate), mp_context) for name, token in factory.tokens.items()}
+        with ProcessPoolExecutor(max_workers=processes, mp_context=mp_context, initializer=_initWorker,
+                                 initargs=(factory, limiters, output, fmt, dtype, kwargs)) as executor:
+            futures={executor.submit(fetchShard, shard): shard for shard in shards}
+            for future in as_completed(futures):
+                shard=futures[future]
+                try:
+                    entry=future.result()
+                except Exception as exp:
+                    logging.error('Fetching {} failed, reason:\n{}'.format(shard.filename, exp))
+                    failed.append((shard.instrument, shard.granularity, shard.price, shard.start.isoformat(), shard.end.isoformat()))
+                    continue
+                if entry['failed']:
+                    failed+=[(shard.instrument, shard.granularity, shard.price, s, e) for s,e in entry['failed']]
+                else:
+                    del entry['failed']
+                    entries.append(entry)
+
+    failed.sort()
+    index=_writeIndex(output, entries, [list(f) for f in failed])
+    failed_manifest=os.path.join(output, FAILED_MANIFEST)
+    if failed:
+        with open(failed_manifest, 'w') as f:
+            for instrument, granularity, price, s, e in failed:
+                f.write('{},{},{},{},{}\n'.format(instrument, granularity, s, e, price))
+        logging.error('{} range(s) failed, they are listed in "{}"'.format(len(failed), failed_manifest))
+        raise FetchError('Fetching {} range(s) failed after retries'.format(len(failed)),
+                         [(date.fromisoformat(s), date.fromisoformat(e)) for _, _, _, s, e in failed])
+    if os.path.exists(failed_manifest):
+        os.remove(failed_manifest)
+    return index
+
+def main():
+    try:
+        args=createParser().parse_args()
+        if not args.config_file:
+            logging.error('Config file is missing or not readable.')
+            return 1
+        factory=Factory.fromConfigFile(args.config_file)
+        jobs=readManifest(args.manifest)
+        backfill(factory, jobs, args.output, processes=args.processes, fmt=args.format, dtype=args.dtype,
+                 shard_days=args.shard_days, rate=args.rate, kwargs={'retry': args.retry})
+        return 0
+    except Exception as exp:
+        logging.error('Error backfilling data from OANDA, reason:\n{}'.format(exp))
+        return 1
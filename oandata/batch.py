@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import csv, argparse, logging
+
+from oandata.constants import Constants, GRANULARITY, isoStrToDate, isValidPrice
+from oandata.fetcher import Job, addCommonArguments, fetchJobs
+
+DEFAULT_OUTPUT='{instrument}_{granularity}_{price}.csv'
+
+## creates a parser
+#
+def createParser():
+    parser = argparse.ArgumentParser(description='Fetch historical price data of several instruments from oanda in one process.')
+    parser.add_argument('manifest', type=argparse.FileType('r'), help='the path to the manifest file. Each line of the manifest holds comma separated instrument, granularity, from date, to date and optionally price, e.g. "EUR_USD,M1,2020-01-01,2020-03-31,B". A line may end with an output file after the price, which its range is then merged into, as in the manifests of failed ranges written by the fetcher. Empty lines and lines starting with # are skipped.')
+    parser.add_argument('--output', '-o', type=str, default=DEFAULT_OUTPUT, help='output filename of each line. "{{instrument}}", "{{granularity}}", "{{price}}", "{{from}}" and "{{to}}" are replaced by those of the line (default "{}"). Lines must not share an output file, so lines of the same instrument, granularity and price require "{{from}}" or "{{to}}".'.format(DEFAULT_OUTPUT))
+    addCommonArguments(parser)
+    return parser
+
+def readManifest(manifest, output=DEFAULT_OUTPUT):
+    """reads the jobs listed in a manifest
+
+    A line may end with an output file after the price, as in the
+    manifests of failed ranges written by the fetcher, see
+    `oandata.fetcher.writeFailedRanges`. Its range is then merged into
+    that file, and the lines of the same instrument, granularity,
+    price and output file make a single job.
+
+    :param manifest: the manifest file, which is an iterable yielding
+    unicode string, e.g. a file opened in text mode
+    :param output: the output filename, in which "{instrument}",
+    "{granularity}", "{price}", "{from}" and "{to}" are replaced by
+    those of each job
+    :type manifest: an iterable yielding unicode string
+    :type output: str
+    :return: the list of jobs
+    :rtype: list of Job
+    :raise ValueError: if a line is not valid
+    """
+    jobs=[]
+    merged={} # the jobs merging ranges into an output file, by instrument, granularity, price and output
+    lines=(line for line in manifest if line.strip() and not line.lstrip().startswith('#'))
+    for row in csv.reader(lines):
+        row=[field.strip() for field in row]
+        if len(row) not in (4, 5, 6):
+            raise ValueError('Invalid manifest line: "{}"'.format(','.join(row)))
+        instrument, granularity, from_date, to_date=row[:4]
+        price=row[4] if len(row) >= 5 and row[4] else Constants.DEFAULT_PRICE
+        if granularity not in GRANULARITY:
+            raise ValueError('Given granularity \'{}\' is not supported.'.format(granularity))
+        if not isValidPrice(price):
+            raise ValueError('Given price type \'{}\' is not supported.'.format(price))
+        from_date, to_date=isoStrToDate(from_date), isoStrToDate(to_date)
+        if len(row) < 6:
+            fields={'instrument': instrument, 'granularity': granularity, 'price': price, 'from': from_date, 'to': to_date}
+            jobs.append(Job(instrument, from_date, to_date, granularity, price, output.format(**fields)))
+            continue
+        key=(instrument, granularity, price, row[5])
+        if key not in merged:
+            merged[key]=Job(instrument, from_date, to_date, granularity, price, row[5], ranges=[])
+            jobs.append(merged[key])
+        job=merged[key]
+        job.ranges.append((from_date, to_date))
+        job.from_date=min(job.from_date, from_date)
+        job.to_date=max(job.to_date, to_date)
+    return jobs
+
+class ArgumentWrapper:
+    """a wrapper around arguments parsed from input
+
+    It provides the same interface as `oandata.fetcher.ArgumentWrapper`
+    for the arguments shared with the fetcher.
+    """
+    def __init__(self, args):
+        """initialize an instance of ArgumentWrapper
+
+        :param args: the arguments parsed by `argparse` parser
+        :type args: argparse.Namespace or something with the same structure
+        """
+        self.manifest=args.manifest
+        self.output=args.output
+        self.config_file=args.config_file
+        self.split=args.split
+        self.retry=args.retry
+        self.workers=args.workers
+        self.cache=args.cache
+        self.format=args.format
+        self.dtype=args.dtype
+        self.checkpoint=args.checkpoint
+        self.profile=args.profile
+        self.follow=args.follow or args.poll is not None
+        self.poll=args.poll
+        self.plan=args.plan
+        self.dry_run=args.dry_run
+        self.skip_closed=args.skip_closed
+
+    def getArgs(self):
+        """make a dictionary of arguments and their values
+
+        It makes a dictionary of arg_name: arg_val to be passed to
+        `Instrumnet.getCandle`. It only contains keyword arguments.
+        """
+        return {
+            'split':self.split,
+            'retry':self.retry,
+            'workers':self.workers,
+            }
+
+    def getJobs(self):
+        """reads the jobs from the manifest
+
+        :rtype: list of Job
+        """
+        return readManifest(self.manifest, self.output)
+
+def main():
+    try:
+        parser=createParser()
+        args=ArgumentWrapper(parser.parse_args())
+        fetchJobs(args, args.getJobs())
+        return 0
+    except Exception as exp:
+        logging.error('Error fetching data from OANDA, reason:\n{}'.format(exp))
+        return 1
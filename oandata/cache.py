@@ -0,0 +1,71 @@
+import logging
+from datetime import datetime, timedelta, timezone
+import numpy as np
+
+from oandata.store import CandleStore
+from oandata.storage import castPrices
+
+## Persistent on-disk cache of candle sticks
+#
+# Candle sticks are cached per (instrument, granularity, price) in a
+# directory of columnar files (see `oandata.columnar`). Alongside the
+# data, the cache records the days whose candle sticks are final,
+# i.e. all of them are complete and the day is in the past. Only
+# those days are served without asking the server again. The cache
+# is a `oandata.store.CandleStore`, whose coverage are the final days.
+class CandleCache(CandleStore):
+    def missingRanges(self, instrument, granularity, price, from_date, to_date):
+        """computes the ranges within [from_date, to_date] that must be fetched
+
+        :param from_date: the first day of the requested range
+        :param to_date: the last day of the requested range
+        :type from_date: datetime.date
+        :type to_date: datetime.date
+        :return: sorted list of (start, end) pairs of datetime.date, both inclusive
+        :rtype: list
+        """
+        missing=[]
+        d=from_date
+        for s, e in self.coverage(instrument, granularity, price):
+            if e < d:
+                continue
+            if s > to_date:
+                break
+            if s > d:
+                missing.append((d, s - timedelta(days=1)))
+            d=e + timedelta(days=1)
+        if d <= to_date:
+            missing.append((d, to_date))
+        return missing
+
+    def update(self, instrument, granularity, price, from_date, to_date, df):
+        """stores candle sticks fetched for [from_date, to_date]
+
+        Cached candle sticks within the range are replaced by the
+        complete ones in `df`, which are appended to the cached files
+        if the range is after the cached days. The days of the range
+        are marked final up to, but excluding, today and the day of
+        the first incomplete candle stick.
+
+        :param from_date: the first day of the fetched range
+        :param to_date: the last day of the fetched range
+        :param df: the fetched candle sticks, possibly empty
+        :type from_date: datetime.date
+        :type to_date: datetime.date
+        :type df: pandas.DataFrame
+        """
+        last_final=min(to_date, datetime.now(timezone.utc).date() - timedelta(days=1))
+
+        fetched=df
+        if len(df) > 0:
+            incomplete=~df['Complete'].to_numpy(dtype=bool)
+            if incomplete.any():
+                first_incomplete=df.index[np.argmax(incomplete)].date()
+                last_final=min(last_final, first_incomplete - timedelta(days=1))
+            # decimal numbers may be given as strings, they are stored as float
+            fetched=castPrices(df[~incomplete], None)
+        self._replace(instrument, granularity, price, from_date, to_date, fetched)
+
+        if last_final >= from_date:
+            logging.info('Caching candle sticks from \'{0}\' to \'{1}\' as final'.format(from_date, last_final))
+            self._cover(instrument, granularity, price, from_date, last_final)
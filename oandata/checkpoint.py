@@ -0,0 +1,198 @@
+import json, os, logging, shutil
+from datetime import date, timedelta
+
+from oandata.instrument import Constants, getGranularityInSec
+from oandata.storage import createSink, formatOf, loadPriceData
+from oandata.retry import FetchError
+
+CHECKPOINT_CANDLES=100 * Constants.MAX_CANDLE_STICKS # the approximate number of candle sticks per checkpoint
+
+def journalOf(output):
+    """gets the filename of the checkpoint journal of `output`
+
+    :param output: the output filename
+    :type output: str
+    :rtype: str
+    """
+    return output.rstrip(os.sep) + '.journal'
+
+def partsOf(output):
+    """gets the directory holding the finished parts of `output`
+
+    :param output: the output filename
+    :type output: str
+    :rtype: str
+    """
+    return output.rstrip(os.sep) + '.parts'
+
+def _checkpointDays(granularity):
+    return max(1, CHECKPOINT_CANDLES * getGranularityInSec(granularity) // (24 * 3600))
+
+def getCheckpoints(from_date, to_date, granularity):
+    """splits a period into intervals, each completed and recorded at once
+
+    Each interval spans whole days holding about `CHECKPOINT_CANDLES`
+    candle sticks, so that little work is lost if a run dies.
+
+    :param from_date: the first day of the period
+    :param to_date: the last day of the period
+    :param granularity: the frequency of price data
+    :type from_date: datetime.date
+    :type to_date: datetime.date
+    :type granularity: str
+    :return: the list of (start, end) pairs of datetime.date, both inclusive
+    :rtype: list
+    """
+    days=_checkpointDays(granularity)
+    intervals=[]
+    s=from_date
+    while s <= to_date:
+        e=min(to_date, s + timedelta(days=days - 1))
+        intervals.append((s, e))
+        s=e + timedelta(days=1)
+    return intervals
+
+## Append-only journal of completed intervals
+#
+# The first line describes the job, each following line records an
+# interval whose price data is persisted, together with the part
+# file holding it. Lines are JSON objects, written and synced one at
+# a time, so a run dying at any point leaves a valid journal, except
+# maybe a truncated last line, which is removed when resuming.
+class Journal:
+    def __init__(self, filename, job):
+        """opens the journal, starting a new one if it belongs to another job
+
+        :param filename: the journal filename
+        :param job: the description of the job, e.g. its instrument,
+        granularity, price and period
+        :type filename: str
+        :type job: dict
+        """
+        self._filename=filename
+        self.completed={} # maps (start, end) to the part file or None if it holds no price data
+        lines=[]
+        valid=0 # the offset of the end of the last valid line
+        if os.path.isfile(filename):
+            with open(filename, 'rb') as f:
+                for line in f:
+                    if not line.endswith(b'\n'):
+                        break
+                    try:
+                        lines.append(json.loads(line))
+                    except ValueError:
+                        break
+                    valid+=len(line)
+        if len(lines) > 0 and lines[0] == job:
+            for entry in lines[1:]:
+                self.completed[(date.fromisoformat(entry['start']), date.fromisoformat(entry['end']))]=entry['part']
+            logging.info('Resuming from "{}", {} interval(s) completed'.format(filename, len(self.completed)))
+            # a truncated last line is removed, so that records are appended after the valid ones
+            self._file=open(filename, 'r+')
+            self._file.truncate(valid)
+            self._file.seek(valid)
+        else:
+            if len(lines) > 0:
+                logging.warning('Journal "{}" belongs to another job, starting over'.format(filename))
+            self._file=open(filename, 'w')
+            self._append(job)
+
+    def _append(self, entry):
+        self._file.write(json.dumps(entry) + '\n')
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def record(self, start, end, part):
+        """records that an interval is completed
+
+        :param start: the first day of the interval
+        :param end: the last day of the interval
+        :param part: the file holding its price data, or None if there is none
+        :type start: datetime.date
+        :type end: datetime.date
+        :type part: str
+        """
+        self.completed[(start, end)]=part
+        self._append({'start': start.isoformat(), 'end': end.isoformat(), 'part': part})
+
+    def close(self):
+        self._file.close()
+
+def _fetchPart(ins, instrument, start, end, part, kwargs, fmt, dtype):
+    # the sink is created on the first page, so no empty part is written
+    sink=None
+    try:
+        for df in ins.iterCandles(instrument, start, end, **kwargs):
+            if sink is None:
+                sink=createSink(part, fmt=fmt, dtype=dtype)
+            sink.write(df)
+    finally:
+        if sink is not None:
+            sink.close()
+    return part if sink is not None else None
+
+def fetchWithCheckpoints(ins, instrument, from_date, to_date, output, kwargs, fmt=None, dtype=None):
+    """fetches price data into `output`, resuming a run that died
+
+    The period is fetched interval by interval, see `getCheckpoints`.
+    The price data of each interval is written into its own part file
+    and the interval is recorded in a journal next to `output`. Running
+    the same job again skips the recorded intervals. Once all intervals
+    are completed, the parts are merged into `output` and the journal
+    and parts are removed.
+
+    :param ins: the instrument used for fetching
+    :param instrument: the name of instrument
+    :param from_date: the first date on which price data is recorded
+    :param to_date: the last date on which price data is recorded
+    :param output: the output filename
+    :param kwargs: keyworded arguments passed to `Instrument.iterCandles`,
+    it must contain granularity and price
+    :param fmt: the format of the output file, see `oandata.storage.createSink`
+    :param dtype: the dtype of prices in the output file
+    :type ins: oandata.instrument.Instrument
+    :type instrument: str
+    :type from_date: datetime.date
+    :type to_date: datetime.date
+    :type output: str
+    :type kwargs: dict
+    :type fmt: str
+    :type dtype: str
+    :raise: FetchError if some intervals failed after retries, after
+    all others are completed. The output is not written then.
+    """
+    fmt=formatOf(output) if fmt is None else fmt
+    granularity=kwargs['granularity']
+    job={'instrument': instrument, 'granularity': granularity, 'price': kwargs['price'],
+         'from': from_date.isoformat(), 'to': to_date.isoformat(), 'format': fmt, 'dtype': dtype,
+         'days': _checkpointDays(granularity)}
+    parts=partsOf(output)
+    os.makedirs(parts, exist_ok=True)
+    journal=Journal(journalOf(output), job)
+    ext=os.path.splitext(output.rstrip(os.sep))[1]
+    failed=[]
+    try:
+        for s,e in getCheckpoints(from_date, to_date, granularity):
+            if (s, e) in journal.completed:
+                continue
+            part=os.path.join(parts, '{}_{}{}'.format(s, e, ext))
+            try:
+                journal.record(s, e, _fetchPart(ins, instrument, s, e, part, kwargs, fmt, dtype))
+            except FetchError as exp:
+                failed+=exp.failed_ranges
+    finally:
+        journal.close()
+    if failed:
+        raise FetchError('Fetching {} range(s) failed after retries'.format(len(failed)), failed)
+
+    # merging parts in order
+    sink=createSink(output, fmt=fmt, dtype=dtype)
+    try:
+        for key in sorted(journal.completed):
+            part=journal.completed[key]
+            if part is not None:
+                sink.write(loadPriceData(part, fmt))
+    finally:
+        sink.close()
+    os.remove(journalOf(output))
+    shutil.rmtree(parts)
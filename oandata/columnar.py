@@ -0,0 +1,216 @@
+import contextlib, io, json, os
+import numpy as np
+import pandas as pd
+
+## Columnar layout of price data on disk
+#
+# A dataframe is stored in a directory holding one NumPy `.npy` file
+# per column, plus `index.npy` with the time index as int64
+# nanoseconds since epoch (UTC) and `columns.json` listing the column
+# names in order. Each file can be memory mapped.
+
+INDEX_FILE='index.npy'
+COLUMNS_FILE='columns.json'
+
+def _save(path, array):
+    # write to a temporary file first, so that readers memory mapping
+    # the former file are not affected
+    with open(path + '.tmp', 'wb') as f:
+        np.save(f, array)
+    os.replace(path + '.tmp', path)
+
+def writeColumns(df, directory):
+    """writes `df` into `directory` in columnar layout
+
+    :param df: the dataframe to store. Its index must be a datetime
+    index and its columns must not be of object dtype.
+    :param directory: the directory to write to, it is created if it
+    does not exist
+    :type df: pandas.DataFrame
+    :type directory: str
+    """
+    os.makedirs(directory, exist_ok=True)
+    index=pd.DatetimeIndex(df.index)
+    if index.tz is not None:
+        index=index.tz_convert('UTC').tz_localize(None)
+    _save(os.path.join(directory, INDEX_FILE), index.as_unit('ns').asi8)
+    for column in df.columns:
+        _save(os.path.join(directory, column + '.npy'), df[column].to_numpy())
+    # the column list is written last, so that a directory without
+    # it never holds a complete frame
+    with open(os.path.join(directory, COLUMNS_FILE), 'w') as f:
+        json.dump(list(df.columns), f)
+
+def appendColumns(df, directory):
+    """appends `df` to the frame stored in `directory`, in place
+
+    The rows are written after the stored ones and the headers are
+    updated last, so the bytes of an interrupted append are ignored
+    and overwritten by the next one. Memory maps of the stored rows
+    stay valid.
+
+    :param df: the dataframe to append, indexed by time, with the
+    columns and dtypes of the stored frame
+    :param directory: the directory holding the frame
+    :type df: pandas.DataFrame
+    :type directory: str
+    :return: whether `df` is appended. It is not, if the columns or
+    dtypes differ or a file was not written with a header of
+    `HEADER_SIZE` bytes, e.g. by `np.save`; the frame must then be
+    written again.
+    :rtype: bool
+    """
+    with open(os.path.join(directory, COLUMNS_FILE)) as f:
+        columns=json.load(f)
+    if columns != list(df.columns):
+        return False
+    index=pd.DatetimeIndex(df.index)
+    if index.tz is not None:
+        index=index.tz_convert('UTC').tz_localize(None)
+    names=[INDEX_FILE] + [c + '.npy' for c in columns]
+    arrays=[index.as_unit('ns').asi8] + [df[c].to_numpy() for c in columns]
+    with contextlib.ExitStack() as stack:
+        stored=[] # the file, dtype and number of stored values of each column
+        for name, array in zip(names, arrays):
+            f=stack.enter_context(open(os.path.join(directory, name), 'r+b'))
+            if np.lib.format.read_magic(f) != (1, 0):
+                return False
+            shape, _, dtype=np.lib.format.read_array_header_1_0(f)
+            if f.tell() != HEADER_SIZE or len(shape) != 1 or dtype != array.dtype:
+                return False
+            stored.append((f, dtype, shape[0]))
+        # the rows stored in every file, see `_rows`
+        n=min(count for _, _, count in stored)
+        for (f, dtype, _), array in zip(stored, arrays):
+            f.seek(HEADER_SIZE + n * dtype.itemsize)
+            f.write(np.ascontiguousarray(array).tobytes())
+            f.flush()
+        for (f, dtype, _), array in zip(stored, arrays):
+            f.seek(0)
+            f.write(_header(dtype, n + len(array)))
+    return True
+
+def _rows(index, data):
+    # an interrupted append may leave some files longer than others, their extra rows are ignored
+    n=min([len(index)] + [len(values) for values in data.values()])
+    return index[:n], {column: values[:n] for column, values in data.items()}
+
+def hasColumns(directory):
+    """checks if `directory` holds a frame in columnar layout
+
+    :param directory: the directory to check
+    :type directory: str
+    :rtype: bool
+    """
+    return os.path.isfile(os.path.join(directory, COLUMNS_FILE))
+
+def _load(path, mmap_mode):
+    try:
+        return np.load(path, mmap_mode=mmap_mode)
+    except ValueError:
+        # empty arrays cannot be memory mapped
+        return np.load(path)
+
+def openColumns(directory):
+    """memory maps the columns stored by `writeColumns` without copying them
+
+    :param directory: the directory holding the frame
+    :type directory: str
+    :return: the time index as int64 nanoseconds since epoch (UTC)
+    and a dictionary mapping the name of each column to its values,
+    all being read-only memory mapped arrays
+    :rtype: tuple
+    """
+    with open(os.path.join(directory, COLUMNS_FILE)) as f:
+        columns=json.load(f)
+    index=_load(os.path.join(directory, INDEX_FILE), 'r')
+    return _rows(index, {column: _load(os.path.join(directory, column + '.npy'), 'r') for column in columns})
+
+def readColumns(directory, mmap=True):
+    """reads a dataframe stored by `writeColumns`
+
+    :param directory: the directory holding the frame
+    :param mmap: whether the files are memory mapped instead of read
+    :type directory: str
+    :type mmap: bool
+    :return: the stored frame indexed by time in UTC
+    :rtype: pandas.DataFrame
+    """
+    mmap_mode='r' if mmap else None
+    with open(os.path.join(directory, COLUMNS_FILE)) as f:
+        columns=json.load(f)
+    index=_load(os.path.join(directory, INDEX_FILE), mmap_mode)
+    index, data=_rows(index, {column: _load(os.path.join(directory, column + '.npy'), mmap_mode) for column in columns})
+    return pd.DataFrame(data, index=pd.to_datetime(index, unit='ns', utc=True), columns=columns)
+
+# the number of bytes reserved for the header of each file written
+# by ColumnsWriter, which fits the header of any one dimensional array
+HEADER_SIZE=128
+
+def _header(dtype, n):
+    buf=io.BytesIO()
+    np.lib.format.write_array_header_1_0(buf, {'descr': np.lib.format.dtype_to_descr(np.dtype(dtype)), 'fortran_order': False, 'shape': (n,)})
+    header=buf.getvalue()
+    if len(header) != HEADER_SIZE:
+        raise ValueError('Unexpected header size {} for {} of {} values'.format(len(header), dtype, n))
+    return header
+
+class ColumnsWriter:
+    """writes dataframes to a directory in columnar layout, one after another
+
+    Each frame is appended to the files of its columns, so the whole
+    data is never held in memory. The result can be read by
+    `readColumns` and `openColumns`. All frames must have the same
+    columns and dtypes.
+    """
+    def __init__(self, directory):
+        """initialize an instance of ColumnsWriter
+
+        :param directory: the directory to write to, it is created if
+        it does not exist. A frame already stored in it is replaced.
+        :type directory: str
+        """
+        os.makedirs(directory, exist_ok=True)
+        if hasColumns(directory):
+            os.remove(os.path.join(directory, COLUMNS_FILE))
+        self._directory=directory
+        self._files=None
+        self._columns=None
+        self._n=0
+
+    def _open(self, df):
+        self._columns=list(df.columns)
+        self._files=[]
+        for name, dtype in [(INDEX_FILE, np.int64)] + [(c + '.npy', df[c].dtype) for c in self._columns]:
+            f=open(os.path.join(self._directory, name), 'wb')
+            f.write(_header(dtype, 0))
+            self._files.append((f, dtype))
+
+    def append(self, df):
+        """appends `df` to the stored frame
+
+        :param df: the frame to append, indexed by time
+        :type df: pandas.DataFrame
+        """
+        if self._files is None:
+            self._open(df)
+        index=pd.DatetimeIndex(df.index)
+        if index.tz is not None:
+            index=index.tz_convert('UTC').tz_localize(None)
+        arrays=[index.as_unit('ns').asi8] + [df[c].to_numpy() for c in self._columns]
+        for (f, dtype), array in zip(self._files, arrays):
+            f.write(np.ascontiguousarray(array, dtype=dtype).tobytes())
+        self._n+=len(df)
+
+    def close(self):
+        """completes the headers of the files and closes them
+        """
+        if self._files is None:
+            return
+        for f, dtype in self._files:
+            f.seek(0)
+            f.write(_header(dtype, self._n))
+            f.close()
+        with open(os.path.join(self._directory, COLUMNS_FILE), 'w') as f:
+            json.dump(self._columns, f)
+        self._files=None
@@ -0,0 +1,111 @@
+import numpy as np
+import pandas as pd
+
+from oandata.storage import NON_PRICE_COLUMNS
+
+## Memory-compact candle frames
+#
+# By default each candle stick takes 32 bytes of float64 prices per
+# price type (far more if the context keeps prices as strings), 8
+# bytes of volume, 1 byte of completeness and 8 bytes of time. The
+# compact layouts below shrink it:
+#
+# * 'float32': prices in single precision, 16 bytes per price type.
+#   Single precision holds 24 significant bits, so the relative error
+#   of each price is at most 2**-24 (about 6e-8). Rounding a price to
+#   its quoted decimals gives back the quoted price as long as
+#   price * 10**decimals < 2**23, e.g. prices below 83.88 quoted with 5
+#   decimals (EUR_USD) or below 8388.6 quoted with 3 decimals (USD_JPY).
+#
+# * 'int32' and 'int64': prices as integers counting units of
+#   10**-decimals, e.g. pipettes of EUR_USD with the default of 5
+#   decimals. Prices with at most `decimals` decimals are held
+#   exactly; a price with more decimals, or too large for int32
+#   (price * 10**decimals >= 2**31), is refused. The number of decimals
+#   is kept in `df.attrs['price_decimals']` and `expandFrame` turns the
+#   prices back into the closest float64, i.e. the one v20 gives.
+#
+# In all layouts volume is stored as int32 (the volume of a candle
+# stick, i.e. its number of ticks, is far below 2**31), completeness
+# as bool and the time index as datetime64[ns] in UTC.
+
+# the compact layouts of candle frames
+LAYOUTS = (
+    'float32', # single precision prices
+    'int32',   # prices scaled to integers by 10**decimals, 4 bytes each
+    'int64',   # prices scaled to integers by 10**decimals, 8 bytes each
+)
+
+PRICE_DECIMALS=5 # the default number of decimals of scaled prices
+
+def _priceColumns(df):
+    return [c for c in df.columns if c not in NON_PRICE_COLUMNS]
+
+def compactFrame(df, layout='float32', decimals=PRICE_DECIMALS):
+    """converts price data to a compact layout
+
+    :param df: the price data as returned by `Instrument.getCandles`,
+    prices may be floats or decimal strings
+    :param layout: one of `LAYOUTS`
+    :param decimals: the number of decimals prices are scaled by in
+    the integer layouts
+    :type df: pandas.DataFrame
+    :type layout: str
+    :type decimals: non-negative int
+    :return: the price data in the compact layout
+    :rtype: pandas.DataFrame
+    :raise ValueError: if `layout` is not supported, or if a price has
+    more than `decimals` decimals or does not fit in an integer layout
+    """
+    if layout not in LAYOUTS:
+        raise ValueError('Given layout \'{}\' is not supported.'.format(layout))
+    columns={}
+    for column in df.columns:
+        values=df[column].to_numpy()
+        if column == 'Volume':
+            values=values.astype(np.int32)
+        elif column == 'Complete':
+            values=values.astype(bool)
+        elif layout == 'float32':
+            # strings are parsed in double precision first, so they are rounded once
+            values=values.astype(np.float64).astype(np.float32)
+        else:
+            prices=values.astype(np.float64) * 10.0 ** decimals
+            scaled=np.rint(prices)
+            if len(prices) > 0:
+                if np.max(np.abs(scaled - prices)) > 1e-3:
+                    raise ValueError('Prices have more than {} decimals.'.format(decimals))
+                if np.max(np.abs(scaled)) > np.iinfo(layout).max:
+                    raise ValueError('Prices with {} decimals do not fit in {}.'.format(decimals, layout))
+            values=scaled.astype(layout)
+        columns[column]=values
+    index=df.index
+    if isinstance(index, pd.DatetimeIndex):
+        index=(index.tz_localize('UTC') if index.tz is None else index.tz_convert('UTC')).as_unit('ns')
+    compact=pd.DataFrame(columns, index=index)
+    if layout != 'float32':
+        compact.attrs['price_decimals']=decimals
+    return compact
+
+def expandFrame(df, decimals=None):
+    """converts a compact frame back to the layout of `Instrument.getCandles`,
+    i.e. float64 prices and int64 volume
+
+    :param df: the price data in a compact layout
+    :param decimals: the number of decimals of scaled prices. If not
+    given, it is taken from `df.attrs`, and prices are taken as not
+    scaled if it is not there either.
+    :type df: pandas.DataFrame
+    :type decimals: int
+    :rtype: pandas.DataFrame
+    """
+    decimals=df.attrs.get('price_decimals') if decimals is None else decimals
+    expanded=df.copy()
+    for c in _priceColumns(df):
+        values=df[c].to_numpy().astype(np.float64)
+        # dividing rather than multiplying by 10**-decimals gives the closest double to the quoted price
+        expanded[c]=values if decimals is None else values / 10.0 ** decimals
+    if 'Volume' in df.columns:
+        expanded['Volume']=df['Volume'].to_numpy().astype(np.int64)
+    expanded.attrs.pop('price_decimals', None)
+    return expanded
@@ -0,0 +1,118 @@
+from datetime import date, datetime
+
+## Constants and argument checks shared by all modules
+#
+# This module only depends on the standard library, so that the
+# command line tools can parse and check their arguments before the
+# heavy dependencies (pandas, numpy and v20) are imported.
+
+# the set of valid granularities
+GRANULARITY = (
+    'S5', 'S10', 'S15', 'S30',                   # seconds e.g. S5 denotes 5 second granularity
+    'M1', 'M2', 'M4', 'M5', 'M10', 'M15', 'M30', # minutes e.g. M1 denotes one minute granularity
+    'H1', 'H2', 'H3', 'H4', 'H6', 'H8', 'H12',   # hours e.g. H1 denotes one hour granularity
+    'D',                                         # daily
+    'W',                                         # weekly
+    'M',                                         # montly
+)
+
+# the set of valid price types
+PRICE = (
+    'B',  # bid
+    'A',  # ask
+    'M',  # mid
+)
+
+class Constants:
+    DEFAULT_RETRY=3          # the default number of retries when a request fails
+    DEFAULT_GRANULARITY='D'  # the default price granularity
+    DEFAULT_PRICE='M'        # the
+    MAX_CANDLE_STICKS = 2500 # the maximum number of candle sticks allowed in each request
+    DEFAULT_WORKERS=1        # the default number of sub-intervals fetched concurrently
+    MAX_REQUESTS_PER_SEC=100 # the maximum number of requests per second sent to a host
+    PAGE_BUFFER=4            # the maximum number of pages buffered per split when fetching concurrently
+    POLL_DELAY=2             # the seconds polls wait after a candle boundary, so that the candle stick just ended is complete
+
+def isoStrToDate(d):
+    """converts date from iso format to datetime.date
+
+    :param d: date specified in iso format YYYY-MM-DD
+    :type d: str
+    :return: the coverted date object
+    :rtype: datetime.date
+    :raise: ValueError if `d` is not a valid date
+    """
+    try:
+        return date.fromisoformat(d)
+    except ValueError:
+        # e.g. months and days without leading zeros
+        return datetime.strptime(d, '%Y-%m-%d').date()
+
+def getGranularityInSec(granularity):
+    """gets the granularity in seconds
+
+    :param granularity: price granularity, which can be one of the
+    granularities defined in `GRANULARITY`
+
+    :type granularity: str
+    :return: the granularity in seconds
+    :rtype: int
+    :raise: ValueError
+    """
+    if granularity not in GRANULARITY:
+        raise ValueError('Unexpected granularity "{0}"'.format(granularity))
+
+    if granularity == 'M': # montly
+        return 60 * 60 * 24 * 30
+    elif granularity[0] == 'S':
+        return int(granularity[1:])
+    elif granularity[0] == 'M':
+        return int(granularity[1:]) * 60
+    elif granularity[0] == 'H':
+        return int(granularity[1:]) * 60 * 60
+    elif granularity[0] == 'D':
+        return 60 * 60 * 24
+    else: # it must be 'W'
+        return 60 * 60 * 24 * 7
+
+
+def isValidPrice(price):
+    """checks if `price` is a valid price type
+
+    A valid price type is one of `PRICE`, or a combination of them
+    such as 'BA' or 'MBA', each appearing at most once.
+
+    :param price: the price type
+    :type price: str
+    :rtype: bool
+    """
+    return isinstance(price, str) and len(price) > 0 and len(set(price)) == len(price) and all(p in PRICE for p in price)
+
+def canResample(from_granularity, to_granularity):
+    """checks if candle sticks of a granularity can be derived from finer ones
+
+    It holds if each coarse candle stick is made of whole fine candle sticks.
+
+    :param from_granularity: the granularity of fine candle sticks
+    :param to_granularity: the granularity of coarse candle sticks
+    :type from_granularity: str
+    :type to_granularity: str
+    :rtype: bool
+    """
+    if from_granularity not in GRANULARITY or to_granularity not in GRANULARITY:
+        return False
+    fine, coarse=getGranularityInSec(from_granularity), getGranularityInSec(to_granularity)
+    if to_granularity in ('W', 'M'):
+        return fine <= getGranularityInSec('D')
+    return fine <= coarse and coarse % fine == 0
+
+# the set of supported output formats
+FORMATS = (
+    'csv',     # comma separated text
+    'parquet', # Apache Parquet, requires pyarrow
+    'feather', # Feather v2, i.e. Arrow IPC file, requires pyarrow
+    'npy',     # a directory of memory-mappable NumPy files, one per column (see oandata.columnar)
+)
+
+# the set of supported dtypes of prices in output files
+DTYPES = ('float32', 'float64')
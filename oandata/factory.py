@@ -1,12 +1,298 @@
-import configparser
-import v20
+import configparser, threading, time, logging
+
+from oandata.constants import Constants
+from oandata.ratelimit import getRateLimiter
+
+_NO_DEFAULT_SECTION='\0' # a section name no configuration file has, so that [DEFAULT] is read as any other
+
+## Pool of v20 contexts
+#
+# Each v20 context holds an HTTP session, which keeps its connections
+# to the server alive. The pool shares contexts among all users of the
+# same configuration, so that once it is warm, no new TCP and TLS
+# handshakes are needed. A context is idle once no request has been
+# sent through it for the idle timeout, it is never closed while a
+# request is in flight. It is safe to use from several threads.
+class ContextPool:
+    DEFAULT_SIZE=1            # the default number of contexts per configuration
+    DEFAULT_CONNECTIONS=10    # the default number of connections kept alive per context
+    DEFAULT_IDLE_TIMEOUT=300  # the default number of seconds after which an unused context is closed
+
+    def __init__(self, size=DEFAULT_SIZE, connections=DEFAULT_CONNECTIONS, idle_timeout=DEFAULT_IDLE_TIMEOUT):
+        """create an instance of ContextPool
+
+        :param size: the number of contexts per configuration, handed out in turn
+        :param connections: the number of connections each context keeps alive
+        :param idle_timeout: the number of seconds after the last
+        request, or the last `get` if later, after which the contexts of
+        a configuration are closed. They are not closed if it is None.
+        :type size: positive int
+        :type connections: positive int
+        :type idle_timeout: float
+        """
+        self._size=size
+        self._connections=connections
+        self._idle_timeout=idle_timeout
+        self._entries={} # key -> [list of contexts, index of the next one, last use, requests in flight]
+        self._lock=threading.Lock()
+        self._hits=0
+        self._misses=0
+        self._evictions=0
+
+    def _createContext(self, config, entry):
+        import requests, v20 # imported here, since they are slow to import
+        context=v20.Context(**config)
+        adapter=requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=self._connections)
+        send=adapter.send
+        def tracked(request, **kwargs):
+            # each request marks the contexts of the entry as used
+            with self._lock:
+                entry[3]+=1
+            try:
+                return send(request, **kwargs)
+            finally:
+                with self._lock:
+                    entry[3]-=1
+                    entry[2]=time.monotonic()
+        adapter.send=tracked
+        context._session.mount('http://', adapter)
+        context._session.mount('https://', adapter)
+        return context
+
+    def get(self, config):
+        """gets a context of `config` from the pool, creating it if needed
+
+        :param config: the arguments of `v20.Context`
+        :type config: dict
+        :rtype: v20.Context
+        """
+        key=tuple(sorted(config.items()))
+        with self._lock:
+            self._evictIdle(time.monotonic())
+            entry=self._entries.get(key)
+            if entry is None:
+                entry=self._entries[key]=[[], 0, None, 0]
+            contexts=entry[0]
+            if len(contexts) < self._size:
+                contexts.append(self._createContext(config, entry))
+                self._misses+=1
+                context=contexts[-1]
+            else:
+                context=contexts[entry[1] % len(contexts)]
+                entry[1]+=1
+                self._hits+=1
+            entry[2]=time.monotonic()
+            return context
+
+    def _evictIdle(self, now):
+        if self._idle_timeout is None:
+            return
+        for key in [k for k, e in self._entries.items() if e[3] == 0 and now - e[2] > self._idle_timeout]:
+            for context in self._entries.pop(key)[0]:
+                context._session.close()
+                self._evictions+=1
+
+    def evictIdle(self):
+        """closes contexts that have not been used for the idle timeout
+        """
+        with self._lock:
+            self._evictIdle(time.monotonic())
+
+    def clear(self):
+        """closes all contexts of the pool
+        """
+        with self._lock:
+            for contexts, _, _, _ in self._entries.values():
+                for context in contexts:
+                    context._session.close()
+            self._entries.clear()
+
+    def stats(self):
+        """gets statistics of the pool
+
+        :return: a dictionary holding the number of pooled 'contexts',
+        the number of 'hits' and 'misses' of `get`, the number of
+        'evictions', the number of 'connections' opened, i.e.
+        handshakes, and the number of 'requests' sent through them
+        :rtype: dict
+        """
+        with self._lock:
+            connections, requests_sent=0, 0
+            for contexts, _, _, _ in self._entries.values():
+                for context in contexts:
+                    # the same adapter may be mounted for several prefixes
+                    for adapter in {id(a): a for a in context._session.adapters.values()}.values():
+                        pools=adapter.poolmanager.pools
+                        for pool_key in pools.keys():
+                            pool=pools[pool_key]
+                            connections+=pool.num_connections
+                            requests_sent+=pool.num_requests
+            return {
+                'contexts': sum(len(e[0]) for e in self._entries.values()),
+                'hits': self._hits,
+                'misses': self._misses,
+                'evictions': self._evictions,
+                'connections': connections,
+                'requests': requests_sent,
+                }
+
+# the process-wide pool of contexts
+_pool=ContextPool()
+
+def getContextPool():
+    """gets the process-wide pool of contexts
+
+    :rtype: ContextPool
+    """
+    return _pool
+
+def setContextPool(pool):
+    """replaces the process-wide pool of contexts, e.g. to configure its size
+
+    :type pool: ContextPool
+    """
+    global _pool
+    _pool=pool
+
+## A token of a pool
+#
+# It holds the context requests with the token are sent through, the
+# rate limiter of its budget and its health, i.e. the number of
+# consecutive failures and the time until which it is not used.
+class Token:
+    def __init__(self, name, context, limiter):
+        """create an instance of Token
+
+        :param name: the name of the token, e.g. its section in the configuration file
+        :param context: the v20 context sending requests with the token
+        :param limiter: the rate limiter of the token
+        :type name: str
+        :type context: v20.Context
+        :type limiter: oandata.ratelimit.RateLimiter
+        """
+        self.name=name
+        self.context=context
+        self.limiter=limiter
+        self.requests=0    # the number of requests sent
+        self.failures=0    # the number of consecutive failures
+        self.cooldowns=0   # the number of times it was taken out
+        self.until=0.0     # the monotonic time until which it is not used
+
+## Pool of tokens requests are spread across
+#
+# Each request goes with the healthy token whose rate budget frees
+# first, so that the pool sends as many requests per second as all
+# budgets together, but no token more than its own. A token failing
+# `max_failures` times in a row, or refused by the server, is not used
+# for `cooldown` seconds, unless all tokens are taken out. It is safe to use from several threads.
+class TokenPool:
+    DEFAULT_MAX_FAILURES=3  # the default number of consecutive failures taking a token out
+    DEFAULT_COOLDOWN=60     # the default number of seconds a failing token is not used
+
+    def __init__(self, tokens, max_failures=DEFAULT_MAX_FAILURES, cooldown=DEFAULT_COOLDOWN):
+        """create an instance of TokenPool
+
+        :param tokens: the tokens of the pool
+        :param max_failures: the number of consecutive failures taking a token out
+        :param cooldown: the number of seconds a token is taken out
+        :type tokens: list of Token
+        :type max_failures: positive int
+        :type cooldown: float
+        :raise ValueError: if no token is given
+        """
+        if len(tokens) == 0:
+            raise ValueError('A token pool requires at least one token.')
+        self._tokens=list(tokens)
+        self._max_failures=max_failures
+        self._cooldown=cooldown
+        self._next=0 # the first token looked at, so that tokens are taken in turn on ties
+        self._lock=threading.Lock()
+
+    @property
+    def tokens(self):
+        """the tokens of the pool
+        """
+        return self._tokens
+
+    def __len__(self):
+        return len(self._tokens)
+
+    def acquire(self):
+        """gets the token the next request is sent with
+
+        It blocks until the rate limiter of the token allows sending the request.
+
+        :rtype: Token
+        """
+        with self._lock:
+            now=time.monotonic()
+            n=len(self._tokens)
+            tokens=[self._tokens[(self._next + i) % n] for i in range(n)]
+            healthy=[token for token in tokens if token.until <= now]
+            if healthy:
+                token=min(healthy, key=lambda t: t.limiter.available())
+            else:
+                token=min(tokens, key=lambda t: t.until)
+            self._next=(self._tokens.index(token) + 1) % n
+            token.requests+=1
+            wait=token.limiter.reserve()
+        if wait > 0:
+            time.sleep(wait)
+        return token
+
+    def succeed(self, token):
+        """records a request sent with `token` that succeeded
+
+        :type token: Token
+        """
+        with self._lock:
+            token.failures=0
+
+    def fail(self, token, fatal=False):
+        """records a request sent with `token` that failed
+
+        The token is taken out for the cooldown once it failed
+        `max_failures` times in a row, or at once if the failure is
+        fatal, e.g. the token was refused. The only token of a pool is
+        never taken out.
+
+        :param token: the token
+        :param fatal: whether the token is taken out at once
+        :type token: Token
+        :type fatal: bool
+        """
+        with self._lock:
+            token.failures+=1
+            if (fatal or token.failures >= self._max_failures) and len(self._tokens) > 1:
+                logging.warning('Token "{}" failed {} times in a row, it is not used for {} seconds'.format(
+                    token.name, token.failures, self._cooldown))
+                token.failures=0
+                token.cooldowns+=1
+                token.until=time.monotonic() + self._cooldown
+
+    def stats(self):
+        """gets statistics of the tokens
+
+        :return: a dictionary mapping the name of each token to the
+        number of 'requests' sent with it, its consecutive 'failures',
+        the number of 'cooldowns' and whether it is 'healthy'
+        :rtype: dict
+        """
+        with self._lock:
+            now=time.monotonic()
+            return {token.name: {
+                'requests': token.requests,
+                'failures': token.failures,
+                'cooldowns': token.cooldowns,
+                'healthy': token.until <= now,
+                } for token in self._tokens}
 
 ## Factory for v20 context
 #
 # It creates v20 context from the configuration parameters read from a
 # file
 class Factory:
-    def __init__(self, config):
+    def __init__(self, config, tokens=None):
         """create an instance of a Factory
 
         :param config: the configuration dictionary that must contain
@@ -24,11 +310,21 @@ class Factory:
         * 'stream_timeout' -> int
         * 'datetime_format' -> str
         * 'poll_timeout' -> int
+        * 'stream_hostname' -> str
+
+        The value associated with 'stream_hostname' refers to the
+        hostname of v20 streaming server, see `createStreamContext`.
+        The value associated with 'rate' is the maximum number of
+        requests per second sent with the token, see `createTokenPool`.
 
+        :param tokens: the configurations of several tokens by name,
+        each like `config`. If not given, `config` is the only token.
         :type config: dict
+        :type tokens: dict
 
         """
         self._config=config
+        self._tokens=tokens if tokens is not None else {'DEFAULT': config}
 
     @classmethod
     def fromConfigFile(cls, config_file):
@@ -53,61 +349,207 @@ class Factory:
         	stream_timeout=10
 	        datetime_format="RFC3339"
         	poll_timeout=2
+		stream_hostname=stream-fxpractice.oanda.com
+		# the maximum number of requests per second sent with the token
+		rate=100
+
+        Several tokens are given in named sections, one per token,
+        which take the values they do not set from [DEFAULT]. Requests
+        are then spread across them, see `createTokenPool`. Sections
+        that do not set a token themselves, or set the token of a
+        previous section, are skipped. A token set in [DEFAULT] is a
+        token of its own, named 'DEFAULT', unless a section sets it::
+
+        	[DEFAULT]
+		hostname=api-fxpractice.oanda.com
+        	[research]
+	        token=xxxxxxxxxxx-xxxxxxxxxxxx
+        	[trading]
+	        token=yyyyyyyyyyy-yyyyyyyyyyyy
+		rate=20
 
         :type config_file: an iterable yielding unicode string
         :raise ValueError: if some configurations are missing
         :raise MissingSectionHeaderError: when config file contains no section headers
         """
+        lines=list(config_file)
         config_parser=configparser.ConfigParser()
-        config_parser.read_file(config_file)
+        config_parser.read_file(lines)
 
         if 'DEFAULT' not in config_parser:
             raise ValueError('Configuration file has no DEFAULT section.')
 
-        section_default=config_parser['DEFAULT']
-        if 'hostname' not in section_default or 'token' not in section_default:
+        # the options each section sets itself, as sections take those they do not set from [DEFAULT]
+        own_parser=configparser.ConfigParser(default_section=_NO_DEFAULT_SECTION, interpolation=None)
+        own_parser.read_file(lines)
+        def ownToken(name):
+            return own_parser.get(name, 'token', fallback=None) if own_parser.has_section(name) else None
+
+        tokens={}
+        for name in config_parser.sections():
+            token=ownToken(name)
+            if token is None:
+                logging.warning('Section [{}] sets no token, it is skipped'.format(name))
+                continue
+            duplicate=next((n for n, c in tokens.items() if c['token'] == config_parser[name]['token']), None)
+            if duplicate is not None:
+                logging.warning('Section [{}] has the token of [{}], it is skipped'.format(name, duplicate))
+                continue
+            tokens[name]=cls._readSection(config_parser[name])
+        if len(tokens) == 0:
+            return cls(cls._readSection(config_parser['DEFAULT']))
+        if ownToken('DEFAULT') is not None and all(c['token'] != config_parser['DEFAULT']['token'] for c in tokens.values()):
+            tokens=dict([('DEFAULT', cls._readSection(config_parser['DEFAULT']))] + list(tokens.items()))
+        return cls(next(iter(tokens.values())), tokens)
+
+    @staticmethod
+    def _readSection(section):
+        """reads the configuration of a token from a section of the configuration file
+
+        :type section: configparser.SectionProxy
+        :rtype: dict
+        :raise ValueError: if some configurations are missing
+        """
+        if 'hostname' not in section or 'token' not in section:
             raise ValueError('Required configuration is missing: hostname and token are required.')
 
         config={}
         # set hostname
-        config['hostname']=section_default['hostname']
+        config['hostname']=section['hostname']
 
         # set port number
-        if 'port' in section_default:
-            config['port']=section_default.getint('port')
+        if 'port' in section:
+            config['port']=section.getint('port')
 
         # set ssl
-        if 'ssl' in section_default:
-            config['ssl']=section_default.getboolean('ssl')
+        if 'ssl' in section:
+            config['ssl']=section.getboolean('ssl')
 
         # set application name
-        if 'application' in section_default:
-            config['application']=section_default['application']
+        if 'application' in section:
+            config['application']=section['application']
 
         # set token
-        config['token']=section_default['token']
+        config['token']=section['token']
 
         # decimal_number_as_float
-        if 'decimal_number_as_float' in section_default:
-            config['decimal_number_as_float']=section_default.getboolean('decimal_number_as_float')
+        if 'decimal_number_as_float' in section:
+            config['decimal_number_as_float']=section.getboolean('decimal_number_as_float')
 
         # set stream_chunk_size
-        if 'stream_chunk_size' in section_default:
-            config['stream_chunk_size']=section_default.getint('stream_chunk_size')
+        if 'stream_chunk_size' in section:
+            config['stream_chunk_size']=section.getint('stream_chunk_size')
 
         # set stream_timeout
-        if 'stream_timeout' in section_default:
-            config['stream_timeout']=section_default.getint('stream_timeout')
+        if 'stream_timeout' in section:
+            config['stream_timeout']=section.getint('stream_timeout')
 
         # set datetime_format
-        if 'datetime_format' in section_default:
-            config['datetime_format']=section_default['datetime_format']
+        if 'datetime_format' in section:
+            config['datetime_format']=section['datetime_format']
 
         # set poll_timeout
-        if 'poll_timeout' in section_default:
-            config['poll_timeout']=section_default.getint('poll_timeout')
+        if 'poll_timeout' in section:
+            config['poll_timeout']=section.getint('poll_timeout')
+
+        # set stream_hostname
+        if 'stream_hostname' in section:
+            config['stream_hostname']=section['stream_hostname']
+
+        # set the rate budget of the token
+        if 'rate' in section:
+            config['rate']=section.getfloat('rate')
 
-        return cls(config)
+        return config
+
+    @property
+    def config(self):
+        """the configuration dictionary of the factory
+        """
+        return self._config
+
+    @property
+    def tokens(self):
+        """the configuration dictionaries of the tokens by name
+        """
+        return self._tokens
+
+    def _contextConfig(self, config=None):
+        # the configuration passed to v20.Context
+        config=self._config if config is None else config
+        return {k: v for k, v in config.items() if k not in ('stream_hostname', 'rate')}
+
+    def limiterKey(self, name):
+        """gets the key of the rate limiter of a token, see `oandata.ratelimit.getRateLimiter`
+
+        A single token shares the limiter of its host, several tokens
+        have a limiter each.
+
+        :param name: the name of the token
+        :type name: str
+        :rtype: str
+        """
+        hostname=self._tokens[name]['hostname']
+        return hostname if len(self._tokens) == 1 else '{}#{}'.format(hostname, name)
+
+    def createTokenPool(self, max_failures=None, cooldown=None):
+        """creates a pool of all tokens, requests are spread across them
+
+        Each token gets a context from the process-wide pool of
+        contexts and the rate limiter given by `limiterKey`, allowing
+        its 'rate' requests per second, `Constants.MAX_REQUESTS_PER_SEC`
+        if not configured.
+
+        :param max_failures: see `TokenPool`
+        :param cooldown: see `TokenPool`
+        :type max_failures: int
+        :type cooldown: float
+        :rtype: TokenPool
+        """
+        tokens=[Token(name, getContextPool().get(self._contextConfig(config)),
+                      getRateLimiter(self.limiterKey(name), config.get('rate', Constants.MAX_REQUESTS_PER_SEC)))
+                for name, config in self._tokens.items()]
+        return TokenPool(tokens,
+                         TokenPool.DEFAULT_MAX_FAILURES if max_failures is None else max_failures,
+                         TokenPool.DEFAULT_COOLDOWN if cooldown is None else cooldown)
 
     def createContext(self):
-        return v20.Context(**self._config)
+        import v20
+        return v20.Context(**self._contextConfig())
+
+    def getContext(self):
+        """gets a context from the process-wide pool of contexts
+
+        Unlike `createContext`, contexts are shared among all
+        factories with the same configuration and their connections
+        are kept alive.
+
+        :rtype: v20.Context
+        """
+        return getContextPool().get(self._contextConfig())
+
+    def createStreamContext(self):
+        """creates a v20 context for the streaming server
+
+        :raise ValueError: if 'stream_hostname' is not configured
+        """
+        if 'stream_hostname' not in self._config:
+            raise ValueError('Required configuration is missing: stream_hostname is required for streaming.')
+        import v20
+        config=self._contextConfig()
+        config['hostname']=self._config['stream_hostname']
+        return v20.Context(**config)
+
+    def createAsyncClient(self, connections=None):
+        """creates a non-blocking client for the v20 REST server
+
+        :param connections: the maximum number of connections, the
+        default of `oandata.asyncinstrument.AsyncClient` if not given
+        :type connections: positive int
+        :rtype: oandata.asyncinstrument.AsyncClient
+        """
+        from oandata.asyncinstrument import AsyncClient # imported here, since it depends on this module
+        config=self._contextConfig()
+        if connections is not None:
+            config['connections']=connections
+        return AsyncClient(**config)
@@ -2,29 +2,79 @@
 # -*- coding: utf-8 -*-
 
 import sys, argparse, logging
-import pandas as pd
-from datetime import date
 
-from oandata.instrument import Instrument, Constants, PRICE, GRANULARITY, isoStrToDate
+# Only light modules are imported here, so that arguments are parsed
+# quickly. The heavy ones, depending on pandas and v20, are imported
+# when they are needed.
+from oandata.constants import Constants, GRANULARITY, FORMATS, DTYPES, isoStrToDate, isValidPrice, canResample
 
 ### configure logging
 logging.basicConfig(format='%(levelname)s: %(message)s', level=logging.INFO)
 
+## verifies a price type given as argument
+#
+def priceType(price):
+    if not isValidPrice(price):
+        raise argparse.ArgumentTypeError('invalid price type \'{}\', expected a combination of B, A and M'.format(price))
+    return price
+
+## adds the arguments shared by the fetcher and the batch fetcher
+#
+def addCommonArguments(parser):
+    parser.add_argument('--config_file', '-c', type=argparse.FileType('r'), default=None, help='the path to the config file. Giving a proper config file is mandatory.')
+    parser.add_argument('--split', '-s', type=int, default=None, help='if given, split the period into the given number of sub-intervals, each fetched page by page, but at most one per day. If not given, the period is split into as many sub-intervals as workers, or with --plan no more than needed for the number of pages.')
+    parser.add_argument('--retry', '-r', type=int, default=Constants.DEFAULT_RETRY, help='the number of retries, when a fetch request failed (default {}).'.format(Constants.DEFAULT_RETRY))
+    parser.add_argument('--format', '-f', choices=FORMATS, default=None, help='the format of output files. csv is human readable, parquet and feather (Arrow IPC) are compact binary formats requiring pyarrow and npy writes a directory of memory-mappable NumPy files, one per column. If not given, it is guessed from the output filename.')
+    parser.add_argument('--dtype', choices=DTYPES, default=None, help='the dtype of prices in output files. If not given, prices are stored as fetched.')
+    parser.add_argument('--cache', type=str, default=None, help='the directory in which price data is cached. If given, only price data missing from the cache is fetched.')
+    parser.add_argument('--checkpoint', action='store_true', help='record each completed interval in a journal next to the output file, so that running the same command again after a run died continues where it stopped.')
+    parser.add_argument('--profile', action='store_true', help='print the time spent in each stage of fetching and the counters of requests at the end.')
+    parser.add_argument('--workers', '-w', type=int, default=Constants.DEFAULT_WORKERS, help='the number of sub-intervals fetched concurrently, or the number of instruments fetched concurrently if several are given (default {}).'.format(Constants.DEFAULT_WORKERS))
+    parser.add_argument('--follow', action='store_true', help='keep existing output files up to date: only the candle sticks after the last complete one in each file are fetched and appended, replacing the incomplete ones stored before. The from date is only used for files holding no complete candle stick, and the to date is ignored.')
+    parser.add_argument('--plan', action='store_true', help='run the jobs as planned before sending any request: granularities that can be derived from a finer job of the same instrument, price and period are derived, days cached as final are skipped and periods are split into no more sub-intervals than needed for the number of pages.')
+    parser.add_argument('--dry-run', action='store_true', help='print the plan of --plan with the estimated number of requests and duration, without fetching anything.')
+    parser.add_argument('--skip-closed', action='store_true', help='with --plan, let no sub-interval fall into FX closed hours, from Friday to Sunday 5pm New York time. Only for instruments not traded then, closed hours are still fetched as part of a neighbouring sub-interval.')
+    parser.add_argument('--poll', type=float, nargs='?', const=0, default=None, metavar='SECONDS', help='implies --follow and keeps updating output files every SECONDS, at multiples of it since epoch plus {} seconds. Without a value, it is the granularity, e.g. a poll at each minute for M1.'.format(Constants.POLL_DELAY))
+
 ## creates a parser
 #
 def createParser():
     parser = argparse.ArgumentParser(description='Fetch historical price data from oanda.')
-    parser.add_argument('instrument', type=str, help='the name of instrument')
+    parser.add_argument('instrument', type=str, nargs='+', help='the name of instrument. If several instruments are given, they are fetched in one process and --output is required.')
     parser.add_argument('from_date', type=lambda d: isoStrToDate(d), help='from date in format YYYY-MM-DD')
     parser.add_argument('to_date', type=lambda d: isoStrToDate(d), help='to date in format YYYY-MM-DD')
-    parser.add_argument('--config_file', '-c', type=argparse.FileType('r'), default=None, help='the path to the config file. Giving a proper config file is mandatory.')
-    parser.add_argument('--output', '-o', type=str, help='csv output filename')
+    parser.add_argument('--output', '-o', type=str, help='output filename. Unless --format is given, price data is stored in parquet format if the filename ends with .parquet, in feather format if it ends with .feather or .arrow, as a directory of npy files if it ends with .npy or is an existing directory, and in csv format otherwise. For several instruments, it must contain "{instrument}", which is replaced by the name of each instrument.')
     parser.add_argument('--granularity', '-g', choices=GRANULARITY, default=Constants.DEFAULT_GRANULARITY, help='granularity of historical price')
-    parser.add_argument('--price', '-p', choices=PRICE, default=Constants.DEFAULT_PRICE, help='Bid, ask or mid prices. The default is mid.')
-    parser.add_argument('--split', '-s', type=int, default=None, help='if given, split the period into the given number of sub-intervals and fetch historical data over each sub-interval individually. If not given, the number of splits is comuputed according to the period length and granularity.')
-    parser.add_argument('--retry', '-r', type=int, default=Constants.DEFAULT_RETRY, help='the number of retries, when a fetch request failed (default {}).'.format(Constants.DEFAULT_RETRY))
+    parser.add_argument('--derive', '-d', choices=GRANULARITY, nargs='+', default=[], help='coarser granularities derived from the fetched one, instead of fetching them. The output filename must then contain "{granularity}", which is replaced by each granularity.')
+    parser.add_argument('--price', '-p', type=priceType, default=Constants.DEFAULT_PRICE, help='Bid (B), ask (A) or mid (M) prices, or a combination of them such as BA or MBA, which are fetched in one request. The default is mid.')
+    addCommonArguments(parser)
     return parser
 
+class Job:
+    """price data of an instrument to be fetched
+
+    :ivar instrument: the name of instrument
+    :ivar from_date: the first date on which price data is recorded
+    :ivar to_date: the last date on which price data is recorded
+    :ivar granularity: the frequency of price data
+    :ivar price: indicates which of bid, ask or mid price is recorded
+    :ivar output: the output filename, or None if price data is returned
+    :ivar derive: the list of (granularity, output filename) pairs of
+    price data derived from the fetched one
+    :ivar ranges: the list of (start, end) pairs of the days fetched and
+    merged into the existing output file, e.g. ranges that failed
+    before, or None if the whole period is written to a new output file
+    """
+    def __init__(self, instrument, from_date, to_date, granularity, price, output, derive=(), ranges=None):
+        self.instrument=instrument
+        self.from_date=from_date
+        self.to_date=to_date
+        self.granularity=granularity
+        self.price=price
+        self.output=output
+        self.derive=list(derive)
+        self.ranges=ranges
+
 class ArgumentWrapper:
     """a wrapper around arguments parsed from input
 
@@ -37,15 +87,27 @@ class ArgumentWrapper:
         :param args: the arguments parsed by `argparse` parser
         :type args: argparse.Namespace or something with the same structure
         """
-        self.instrument=args.instrument
+        self.instruments=args.instrument
         self.from_date=args.from_date
         self.to_date=args.to_date
         self.config_file=args.config_file
         self.output=args.output
         self.granularity=args.granularity
+        self.derive=args.derive
         self.price=args.price
         self.split=args.split
         self.retry=args.retry
+        self.workers=args.workers
+        self.cache=args.cache
+        self.format=args.format
+        self.dtype=args.dtype
+        self.checkpoint=args.checkpoint
+        self.profile=args.profile
+        self.follow=args.follow or args.poll is not None
+        self.poll=args.poll
+        self.plan=args.plan
+        self.dry_run=args.dry_run
+        self.skip_closed=args.skip_closed
 
     def getArgs(self):
         """make a dictionary of arguments and their values
@@ -58,32 +120,272 @@ class ArgumentWrapper:
             'price': self.price,
             'split':self.split,
             'retry':self.retry,
+            'workers':self.workers,
             }
 
-def fetch(args):
-    """fetch historical price data and optionally stores them into a file
+    def getJobs(self):
+        """make the list of jobs, one per instrument
+
+        :return: the list of jobs
+        :rtype: list of Job
+        :raise: ValueError if several instruments are given without an
+        output filename holding "{instrument}", or granularities are
+        derived without an output filename holding "{granularity}" or
+        cannot be derived
+        """
+        if len(self.instruments) > 1 and (self.output is None or '{instrument}' not in self.output):
+            raise ValueError('Fetching several instruments requires an output filename containing "{instrument}".')
+        if len(self.derive) > 0 and (self.output is None or '{granularity}' not in self.output):
+            raise ValueError('Deriving granularities requires an output filename containing "{granularity}".')
+        for granularity in self.derive:
+            if not canResample(self.granularity, granularity):
+                raise ValueError('Granularity \'{}\' cannot be derived from \'{}\'.'.format(granularity, self.granularity))
+        def output(instrument, granularity):
+            return self.output.format(instrument=instrument, granularity=granularity, price=self.price) if self.output is not None else None
+        return [Job(instrument, self.from_date, self.to_date, self.granularity, self.price, output(instrument, self.granularity),
+                    [(granularity, output(instrument, granularity)) for granularity in self.derive])
+                for instrument in self.instruments]
+
+def checkOutputs(jobs):
+    """verifies that no two jobs write the same output file
+
+    :param jobs: the jobs to run
+    :type jobs: list of Job
+    :raise: ValueError naming the jobs, as manifest lines, that share an output file
+    """
+    writers={}
+    for job in jobs:
+        for output in [job.output] + [output for _, output in job.derive]:
+            if output is not None:
+                writers.setdefault(output, []).append(job)
+    for output, shared in writers.items():
+        if len(shared) > 1:
+            raise ValueError('The same output file "{}" is written by {}.'.format(output, ' and '.join(
+                '"{},{},{},{},{}"'.format(job.instrument, job.granularity, job.from_date, job.to_date, job.price) for job in shared)))
+
+def failedManifestOf(output):
+    """gets the filename of the manifest listing ranges of `output` that failed
+
+    :param output: the output filename
+    :type output: str
+    :rtype: str
+    """
+    return output + '.failed'
+
+def writeFailedRanges(job, failed_ranges):
+    """writes the ranges of a job that failed into a manifest
+
+    The manifest is next to the output file of the job. It has the
+    format read by the batch fetcher, so the failed ranges can be
+    fetched again with `fetch_oandata_batch`. Each line ends with the
+    output file, which the ranges are then merged into.
+
+    :param job: the job some ranges of which failed
+    :param failed_ranges: the list of (start, end) pairs of datetime.date
+    :type job: Job
+    :type failed_ranges: list of tuple
+    :return: the filename of the manifest
+    :rtype: str
+    """
+    import csv
+    filename=failedManifestOf(job.output)
+    with open(filename, 'w', newline='') as f:
+        writer=csv.writer(f, lineterminator='\n')
+        for s,e in failed_ranges:
+            writer.writerow([job.instrument, job.granularity, s, e, job.price, job.output])
+    return filename
+
+def fetchJob(ins, job, kwargs, fmt=None, dtype=None, checkpoint=False):
+    """fetch price data of a job and optionally stores them into a file
+
+    If the job has an output file, price data is appended to it page
+    by page as it arrives and nothing is kept in memory. Derived price
+    data is appended to its own output file as it is aggregated. The
+    ranges of a job that has them are fetched and merged into the
+    existing output file instead, see `oandata.storage.mergePriceData`.
+
+    :param ins: the instrument used for fetching
+    :param job: the job to run
+    :param kwargs: keyworded arguments passed to `Instrument.getCandles`
+    :param fmt: the format of the output file, see `oandata.storage.createSink`
+    :param dtype: the dtype of prices in the output file
+    :param checkpoint: whether completed intervals are recorded, so
+    that the job resumes where it stopped, see
+    `oandata.checkpoint.fetchWithCheckpoints`
+    :type ins: Instrument
+    :type job: Job
+    :type kwargs: dict
+    :type fmt: str
+    :type dtype: str
+    :type checkpoint: bool
+    :return: the price data, or None if it is stored in the output file
+    :rtype: pandas.DataFrame
+    :raise: FetchError if some ranges failed after retries. They are
+    listed in a manifest next to the output file, see `writeFailedRanges`.
+    """
+    from oandata.storage import createSink, mergePriceData
+    from oandata.retry import FetchError
+    from oandata.checkpoint import fetchWithCheckpoints
+    from oandata.resample import Resampler
+    from oandata.metrics import getMetrics
+
+    kwargs=dict(kwargs, granularity=job.granularity, price=job.price)
+    if job.output is None:
+        return ins.getCandles(job.instrument, job.from_date, job.to_date, **kwargs)
+
+    # storing in file page by page
+    logging.info('Saving price data of {} in "{}"'.format(job.instrument, job.output))
+    try:
+        if job.ranges is not None:
+            if len(job.derive) > 0:
+                raise ValueError('Deriving granularities is not supported when merging ranges.')
+            if not isinstance(kwargs.get('split'), list):
+                kwargs['split']=job.ranges
+            try:
+                df=ins.getCandles(job.instrument, job.from_date, job.to_date, **kwargs)
+            except FetchError as exp:
+                # what could be fetched is merged nevertheless
+                if exp.data is not None and len(exp.data) > 0:
+                    mergePriceData(job.output, exp.data, fmt, dtype)
+                raise
+            if len(df) > 0:
+                mergePriceData(job.output, df, fmt, dtype)
+            return None
+        if checkpoint:
+            if len(job.derive) > 0:
+                raise ValueError('Deriving granularities is not supported with checkpoints.')
+            fetchWithCheckpoints(ins, job.instrument, job.from_date, job.to_date, job.output, kwargs, fmt, dtype)
+            return None
+        pages=ins.iterCandles(job.instrument, job.from_date, job.to_date, **kwargs)
+        resamplers=[(Resampler(job.granularity, granularity), createSink(output, fmt=fmt, dtype=dtype)) for granularity, output in job.derive]
+        sink=createSink(job.output, fmt=fmt, dtype=dtype)
+        metrics=getMetrics()
+        try:
+            for df in pages:
+                with metrics.timer('write'):
+                    sink.write(df)
+                for resampler, derived in resamplers:
+                    bars=resampler.update(df)
+                    if len(bars) > 0:
+                        with metrics.timer('write'):
+                            derived.write(bars)
+            for resampler, derived in resamplers:
+                bars=resampler.flush()
+                if len(bars) > 0:
+                    derived.write(bars)
+        finally:
+            sink.close()
+            for resampler, derived in resamplers:
+                derived.close()
+    except FetchError as exp:
+        filename=writeFailedRanges(job, exp.failed_ranges)
+        logging.error('Some ranges of {} failed, they are listed in "{}"'.format(job.instrument, filename))
+        raise
+    return None
+
+def fetchJobs(args, jobs):
+    """runs several jobs in one process
+
+    All jobs share one v20 context. If asked for, they are run as
+    planned by `oandata.planner.makePlan`, which is only printed for a
+    dry run. A single job may fetch several sub-intervals concurrently, while
+    several jobs are run concurrently, each fetching its
+    sub-intervals one after another.
 
     :param args: the input arguments
-    :type args: ArgumentWrapper
+    :param jobs: the jobs to run
+    :type args: ArgumentWrapper, or something with the same structure
+    :type jobs: list of Job
+    :return: the results of jobs, each is the price data or None if
+    it is stored in the output file, is derived from another job or
+    the run is dry
+    :rtype: list
+    :raise: ValueError if jobs share an output file, see `checkOutputs`,
+    FetchError after all jobs are run, if some ranges failed after retries
     """
+    from oandata.metrics import getMetrics
+    if args.profile:
+        getMetrics().reset()
+        try:
+            return _fetchJobs(args, jobs)
+        finally:
+            print(getMetrics().report(), file=sys.stderr)
+    return _fetchJobs(args, jobs)
+
+def _fetchJobs(args, jobs):
+    from concurrent.futures import ThreadPoolExecutor
+    from oandata.instrument import Instrument
+    from oandata.cache import CandleCache
+    from oandata.retry import FetchError
+    from oandata.planner import makePlan
+
+    checkOutputs(jobs)
+    if args.follow:
+        if args.checkpoint or args.dry_run:
+            raise ValueError('Following output files is not supported with checkpoints or dry runs.')
+        if any(job.output is None or len(job.derive) > 0 for job in jobs):
+            raise ValueError('Following requires an output file and no derived granularities.')
+
+    cache=CandleCache(args.cache) if args.cache is not None else None
+    plan=None
+    if args.plan or args.dry_run:
+        plan=makePlan(jobs, cache, args.split, args.workers, derive=not args.checkpoint, skip_closed=args.skip_closed)
+        if args.dry_run:
+            print(plan.report())
+            return [None] * len(jobs)
+        logging.info('Planned about {} request(s) instead of {}'.format(plan.requests, plan.unplanned))
+
     if not args.config_file:
         logging.error('Config file is missing or not readable.')
         sys.exit(1)
 
     logging.info('Reading configurations from "{}"'.format(args.config_file.name))
-    ins=Instrument.fromConfigFile(args.config_file)
+    ins=Instrument.fromConfigFile(args.config_file, cache=cache)
 
     # get the keyworded arguments to be passed to getCandle
     kwargs=args.getArgs()
-    # compute the number of subintervals
-    price_data=ins.getCandles(args.instrument, args.from_date, args.to_date, **kwargs)
+    if args.follow:
+        from oandata.follow import followJobs
+        followJobs(ins, jobs, kwargs, args.format, args.dtype, args.poll)
+        return [None] * len(jobs)
+    # each run is a job and its keyworded arguments, holding the planned splits
+    if plan is None:
+        runs=[(job, kwargs) for job in jobs]
+    else:
+        runs=[(step.job, dict(kwargs, split=step.splits)) for step in plan.steps]
+    if len(runs) == 1:
+        job, job_kwargs=runs[0]
+        results=[fetchJob(ins, job, job_kwargs, args.format, args.dtype, args.checkpoint)]
+        return results if plan is None else plan.results(results)
 
-    # storing in file
-    if args.output is not None:
-        logging.info('Saving price data in "{}"'.format(args.output))
-        price_data.to_csv(args.output, sep=',', header=True, index_label='Time')
+    failed=[]
+    def run(job_run):
+        job, job_kwargs=job_run
+        try:
+            return fetchJob(ins, job, dict(job_kwargs, workers=1), args.format, args.dtype, args.checkpoint)
+        except FetchError as exp:
+            failed.append(exp)
+            return exp.data
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        results=list(executor.map(run, runs))
+    if failed:
+        raise FetchError('Fetching {} job(s) failed after retries'.format(len(failed)),
+                         [r for exp in failed for r in exp.failed_ranges])
+    return results if plan is None else plan.results(results)
 
-    return price_data
+def fetch(args):
+    """fetch historical price data and optionally stores them into a file
+
+    If an output file is given, price data is appended to it page by
+    page as it arrives and nothing is kept in memory.
+
+    :param args: the input arguments
+    :type args: ArgumentWrapper
+    :return: the price data, or None if it is stored in the output file
+    :rtype: pandas.DataFrame
+    """
+    results=fetchJobs(args, args.getJobs())
+    return results[0] if len(results) == 1 else None
 
 def main():
     try:
@@ -91,8 +393,9 @@ def main():
         args=ArgumentWrapper(parser.parse_args())
         price_data=fetch(args)
 
-        logging.info('Printing price data...')
-        print(price_data)
+        if price_data is not None:
+            logging.info('Printing price data...')
+            print(price_data)
         return 0
     except Exception as exp:
         logging.error('Error fetching data from OANDA, reason:\n{}'.format(exp))
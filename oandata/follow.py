@@ -0,0 +1,191 @@
+import os, time, logging
+from datetime import date
+import numpy as np
+import pandas as pd
+
+from oandata.instrument import Constants, getGranularityInSec
+from oandata.storage import CsvSink, createSink, formatOf, loadPriceData
+from oandata.columnar import hasColumns
+from oandata.retry import FetchError
+
+TAIL_BLOCK=1 << 16 # the number of bytes first read from the end of a csv file
+
+def _csvTail(filename):
+    """finds the last complete candle stick of a csv file written by `CsvSink`
+
+    Only the end of the file is read, growing the block until a
+    complete row is found.
+
+    :param filename: the csv filename
+    :type filename: str
+    :return: the time of the last complete candle stick, or None if
+    there is none, and the offset at which the rows after it start,
+    i.e. the incomplete and partially written ones
+    :rtype: tuple
+    """
+    with open(filename, 'rb') as f:
+        header=f.readline()
+        if not header.endswith(b'\n'):
+            return None, 0
+        columns=header.decode().rstrip('\r\n').split(',')
+        complete=columns.index('Complete') if 'Complete' in columns else None
+        start=f.tell()
+        size=f.seek(0, os.SEEK_END)
+        n=TAIL_BLOCK
+        while True:
+            pos=max(start, size - n)
+            f.seek(pos)
+            lines=f.read(size - pos).split(b'\n')
+            offsets=np.cumsum([pos] + [len(line) + 1 for line in lines[:-1]])
+            # the last line is partially written unless empty, the first may start before the block
+            offset=int(offsets[-1])
+            for i in range(len(lines) - 2, -1 if pos == start else 0, -1):
+                fields=lines[i].decode().rstrip('\r').split(',')
+                if len(fields) == len(columns) and (complete is None or fields[complete] == 'True'):
+                    return pd.Timestamp(fields[0]), offset
+                offset=int(offsets[i])
+            if pos == start:
+                return None, offset
+            n*=2
+
+def openOutput(output, fmt=None, dtype=None):
+    """opens an output file to append candle sticks newer than its last complete one
+
+    The rows after the last complete candle stick, e.g. the current
+    candle stick stored while it was not complete yet, are removed. A
+    csv file is truncated and appended to, only its end is read. Files
+    of other formats are read and written again.
+
+    :param output: the output filename, it is created if it does not exist
+    :param fmt: the format of the output file, guessed from `output` if not given
+    :param dtype: the dtype of prices in the output file
+    :type output: str
+    :type fmt: str
+    :type dtype: str
+    :return: the time of the last complete candle stick in UTC, or
+    None if there is none, and the sink appending to the output file
+    :rtype: tuple
+    """
+    fmt=formatOf(output) if fmt is None else fmt
+    if not os.path.exists(output) or (fmt == 'npy' and not hasColumns(output)):
+        return None, createSink(output, fmt=fmt, dtype=dtype)
+    if fmt == 'csv':
+        last, offset=_csvTail(output)
+        with open(output, 'r+b') as f:
+            f.truncate(offset)
+        sink=CsvSink(output, dtype=dtype, append=True)
+    else:
+        # the data is copied, as npy files are mapped and rewritten
+        df=loadPriceData(output, fmt).copy()
+        complete=df['Complete'].to_numpy(dtype=bool) if 'Complete' in df.columns else np.ones(len(df), dtype=bool)
+        n=len(complete) - np.argmax(complete[::-1]) if complete.any() else 0
+        df=df.iloc[:n]
+        last=df.index[-1] if n > 0 else None
+        sink=createSink(output, fmt=fmt, dtype=dtype)
+        if n > 0:
+            sink.write(df)
+    if last is not None:
+        last=last.tz_localize('UTC') if last.tz is None else last.tz_convert('UTC')
+    return last, sink
+
+def followJob(ins, job, kwargs, fmt=None, dtype=None):
+    """appends the candle sticks newer than those in the output file of a job
+
+    The candle sticks after the last complete one in the output file
+    are fetched, see `Instrument.iterCandlesAfter`, and appended. If
+    the file holds no complete candle stick, those from the first day
+    of the job up to now are fetched. The to date of the job is not used.
+
+    :param ins: the instrument used for fetching
+    :param job: the job, it must have an output file
+    :param kwargs: keyworded arguments passed to `Instrument.iterCandles`
+    :param fmt: the format of the output file
+    :param dtype: the dtype of prices in the output file
+    :type ins: Instrument
+    :type job: oandata.fetcher.Job
+    :type kwargs: dict
+    :type fmt: str
+    :type dtype: str
+    :return: the number of candle sticks appended
+    :rtype: int
+    :raise: FetchError if a page failed after retries, the candle
+    sticks fetched before are appended though
+    """
+    kwargs=dict(kwargs, granularity=job.granularity, price=job.price)
+    last, sink=openOutput(job.output, fmt, dtype)
+    rows=0
+    try:
+        if last is None:
+            pages=ins.iterCandles(job.instrument, job.from_date, date.today(), **kwargs)
+        else:
+            pages=ins.iterCandlesAfter(job.instrument, last, granularity=job.granularity, price=job.price,
+                                       retry=kwargs.get('retry', 1))
+        for df in pages:
+            sink.write(df)
+            rows+=len(df)
+    finally:
+        sink.close()
+    return rows
+
+def secondsToNextPoll(interval, now=None, delay=Constants.POLL_DELAY):
+    """computes the seconds until the next poll
+
+    Polls happen `delay` seconds after each multiple of `interval`
+    since epoch, e.g. 2 seconds past each minute for 60 seconds.
+
+    :param interval: the seconds between polls
+    :param now: the current time in seconds since epoch, the clock if not given
+    :param delay: the seconds after each multiple of `interval`
+    :type interval: float
+    :type now: float
+    :type delay: float
+    :rtype: float
+    """
+    now=time.time() if now is None else now
+    return ((now - delay) // interval + 1) * interval + delay - now
+
+def followJobs(ins, jobs, kwargs, fmt=None, dtype=None, poll=None, sleep=time.sleep, polls=None):
+    """keeps the output files of jobs up to date
+
+    Each update appends the new candle sticks of every job, see
+    `followJob`. If `poll` is given, updates are repeated forever,
+    aligned to multiples of the interval, see `secondsToNextPoll`.
+    Jobs failing during an update are fetched again at the next one.
+
+    :param ins: the instrument used for fetching
+    :param jobs: the jobs, each must have an output file
+    :param kwargs: keyworded arguments passed to `Instrument.iterCandles`
+    :param fmt: the format of output files
+    :param dtype: the dtype of prices in output files
+    :param poll: the seconds between updates, 0 for the shortest
+    granularity of the jobs. If not given, a single update is done.
+    :param sleep: the function waiting between updates
+    :param polls: the maximum number of updates, unlimited if not given
+    :type ins: Instrument
+    :type jobs: list of oandata.fetcher.Job
+    :type kwargs: dict
+    :type fmt: str
+    :type dtype: str
+    :type poll: float
+    :type sleep: callable
+    :type polls: int
+    :raise: FetchError if some jobs failed at the last update
+    """
+    interval=poll if poll else min(getGranularityInSec(job.granularity) for job in jobs)
+    n=0
+    while True:
+        failed=[]
+        for job in jobs:
+            try:
+                rows=followJob(ins, job, kwargs, fmt, dtype)
+                logging.info('Appended {} candle stick(s) of {} to "{}"'.format(rows, job.instrument, job.output))
+            except FetchError as exp:
+                logging.error('Updating "{}" failed, reason:\n{}'.format(job.output, exp))
+                failed.append(exp)
+        n+=1
+        if poll is None or (polls is not None and n >= polls):
+            break
+        sleep(secondsToNextPoll(interval))
+    if failed:
+        raise FetchError('Updating {} job(s) failed after retries'.format(len(failed)),
+                         [r for exp in failed for r in exp.failed_ranges])
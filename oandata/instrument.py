@@ -1,103 +1,68 @@
 from datetime import date, timedelta
+from concurrent.futures import ThreadPoolExecutor
+import threading, queue, time, warnings
+import numpy as np
 import pandas as pd
 import logging
-
-from oandata.factory import Factory
+import v20
+from v20.request import Request
+from v20.errors import ResponseUnexpectedStatus
+try:
+    import ujson as json
+except ImportError: # ujson is optional, it only speeds up decoding
+    import json
+
+# GRANULARITY and PRICE are re-exported, e.g. for `from oandata.instrument import PRICE`
+from oandata.constants import Constants, GRANULARITY, PRICE, isoStrToDate, getGranularityInSec, isValidPrice
+from oandata.factory import Factory, Token, TokenPool
+from oandata.ratelimit import getRateLimiter
+from oandata.retry import RetryPolicy, FetchError, isRetryable, statusOf
+from oandata.metrics import getMetrics
+from oandata.compact import LAYOUTS, compactFrame
+from oandata.merge import PageMerger, iterMerged
+from oandata.storage import castPrices
 
 ### configure logging
 logging.basicConfig(format='%(levelname)s: %(message)s', level=logging.INFO)
 
-# the set of valid granularities
-GRANULARITY = (
-    'S5', 'S10', 'S15', 'S30',                   # seconds e.g. S5 denotes 5 second granularity
-    'M1', 'M2', 'M4', 'M5', 'M10', 'M15', 'M30', # minutes e.g. M1 denotes one minute granularity
-    'H1', 'H2', 'H3', 'H4', 'H6', 'H8', 'H12',   # hours e.g. H1 denotes one hour granularity
-    'D',                                         # daily
-    'W',                                         # weekly
-    'M',                                         # montly
-)
-
-# the set of valid price types
-PRICE = (
-    'B',  # bid
-    'A',  # ask
-    'M',  # mid
-)
-
-class Constants:
-    DEFAULT_RETRY=3          # the default number of retries when a request fails
-    DEFAULT_GRANULARITY='D'  # the default price granularity
-    DEFAULT_PRICE='M'        # the
-    MAX_CANDLE_STICKS = 2500 # the maximum number of candle sticks allowed in each request
-
-def isoStrToDate(d):
-    """converts date from iso format to datetime.date
-
-    This method was added since python 3.5 does not provide
-    datetime.date.fromisoformat.
-
-    :param d: date specified in iso format YYYY-MM-DD
-    :type d: str
-    :return: the coverted date object
-    :rtype: datetime.date
-
-    """
-    return pd.Timestamp(d).to_pydatetime().date()
-
-def getGranularityInSec(granularity):
-    """gets the granularity in seconds
-
-    :param granularity: price granularity, which can be one of the
-    granularities defined in `GRANULARITY`
-
-    :type granularity: str
-    :return: the granularity in seconds
-    :rtype: int
-    :raise: ValueError
-    """
-    if granularity not in GRANULARITY:
-        raise ValueError('Unexpected granularity "{0}"'.format(granularity))
-
-    if granularity[0] == 'S':
-        return int(granularity[1:])
-    elif granularity[0] == 'M':
-        return int(granularity[1:]) * 60
-    elif granularity[0] == 'H':
-        return int(granularity[1:]) * 60 * 60
-    elif granularity[0] == 'D':
-        return 60 * 60 * 24
-    elif granularity[0] == 'W':
-        return 60 * 60 * 24 * 7
-    else: # it must be 'M'
-        return 60 * 60 * 24 * 30
-
 def computeIntervalNum(start, end, granularity):
     """computes the number of splits between `start` and `end`
 
-    If the period between @param start and @param end is long and
-    @param granularity is fine, i.e. historical price data contains
-    lots of candle sticks, oanda will return "Bad Request". To
-    mitigate the problem, the period can be split into several
-    sub-intervals, each holding a fewer candle sticks. The number of
-    candle sticks within each sub-interval is kept at most
-    `Constants.MAX_CANDLE_STICKS` (unless the sub-interval is smaller
-    than a day.) This function computes the number of those
-    sub-intervals.
+    Deprecated: periods are fetched page by page, so they no longer
+    need splitting to keep each request below
+    `Constants.MAX_CANDLE_STICKS` candle sticks. Use `getSplits` to
+    split a period for fetching it concurrently.
+
+    This computes the number of sub-intervals, at most one per day,
+    each holding at most `Constants.MAX_CANDLE_STICKS` candle sticks.
 
     :param start: the first day on which price data is downloaded
     :param end: the last day on which price data is downloaded
     :param granularity: the granularity of price data
     :type start: datetime.date
-    :type end: dattime.date
+    :type end: datetime.date
     :type granularity: str, it must holds that `granularity in GRANULARITY`
     :return: the number of periods
     :rtype: int
     """
+    warnings.warn('computeIntervalNum is deprecated, periods are fetched page by page', DeprecationWarning, stacklevel=2)
     delta=end - start + timedelta(days=1)
     delta_sec=delta.total_seconds()
     granularity_sec=getGranularityInSec(granularity)
     return min(int(delta_sec / granularity_sec / Constants.MAX_CANDLE_STICKS) + 1, delta.days)
 
+def toRFC3339(ts):
+    """formats a timestamp in RFC3339 as used by v20
+
+    :param ts: the timestamp, naive ones are taken as UTC
+    :type ts: pandas.Timestamp
+    :return: the formatted timestamp e.g. '2020-01-01T00:00:05.000000000Z'
+    :rtype: str
+    """
+    if ts.tz is not None:
+        ts=ts.tz_convert('UTC')
+    return ts.strftime('%Y-%m-%dT%H:%M:%S.%f') + '{:03d}Z'.format(ts.nanosecond)
+
 def getSplits(start, end, splits):
     """split time interval [start, end] into splits and returns them as a list
     :param start: the first day in the interval
@@ -120,157 +85,781 @@ def getSplits(start, end, splits):
 
     return sub_int
 
+def getSplitIntervals(start, end, split, workers):
+    """gets the sub-intervals of [start, end] fetched one by one
+
+    :param start: the first day in the interval
+    :param end: the last day in the interval
+    :param split: the number of splits, or the list of (start, end)
+    pairs of sub-intervals, e.g. as planned by `oandata.planner.planSplits`.
+    Sub-intervals are clipped to [start, end]. If None, there are as
+    many splits as workers.
+    :param workers: the number of workers
+    :type start: datetime.date
+    :type end: datetime.date
+    :type split: int or list
+    :type workers: int
+    :return: the list of pairs of (start,end) for each split
+    :rtype: list
+    """
+    if isinstance(split, list):
+        return [(max(s, start), min(e, end)) for s,e in split if s <= end and e >= start]
+    return getSplits(start=start, end=end, splits=workers if split is None else split)
+
+# the candle stick attribute and column prefix of each price type
+PRICE_COMPONENT = {
+    'B': 'bid',
+    'A': 'ask',
+    'M': 'mid',
+}
+
+def checkArguments(from_date, to_date, granularity, price, split, retry, workers):
+    """verifies the arguments of `Instrument.getCandles`
+
+    :return: from_date and to_date converted to datetime.date
+    :rtype: tuple
+    :raise: ValueError if an argument is not valid
+    """
+    # check and convert from_date
+    if isinstance(from_date, str):
+        from_date=isoStrToDate(from_date)
+    elif not isinstance(from_date, date):
+        raise ValueError("'from_date' must be either a string in 'YYYY-MM-DD' format, or an object of type datetime.date")
+
+    # check and convert to_date
+    if isinstance(to_date, str):
+        to_date=isoStrToDate(to_date)
+    elif not isinstance(to_date, date):
+        raise ValueError("'to_date' must be either a string in 'YYYY-MM-DD' format, or an object of type datetime.date")
+
+    # check the duration
+    if from_date > to_date or to_date > date.today():
+        raise ValueError('Invalid date period: \'{0}\' -- \'{1}\''.format(from_date, to_date))
+
+    # check granularity
+    if not isinstance(granularity, str) or granularity not in GRANULARITY:
+        raise ValueError('Given granularity \'{}\' is not supported.'.format(granularity))
+
+    # check price
+    if not isValidPrice(price):
+        raise ValueError('Given price type \'{}\' is not supported.'.format(price))
+
+    # check split
+    if isinstance(split, list):
+        last=None
+        for interval in split:
+            if (not isinstance(interval, tuple) or len(interval) != 2 or not all(isinstance(d, date) for d in interval)
+                or interval[0] > interval[1] or (last is not None and interval[0] <= last)):
+                raise ValueError('Expected sorted disjoint (start, end) pairs of dates as splits, but {} is given.'.format(split))
+            last=interval[1]
+    elif split is not None and (not isinstance(split, int) or split < 1):
+        raise ValueError('Expected a positive split, but {} is given.'.format(split))
+
+    # check retry
+    if not isinstance(retry, int) or retry < 1:
+        raise ValueError('Expected a positive parameter for the number of retries, but {} is given.'.format(retry))
+
+    # check workers
+    if not isinstance(workers, int) or workers < 1:
+        raise ValueError('Expected a positive number of workers, but {} is given.'.format(workers))
+
+    return from_date, to_date
+
+# the query parameters of the candles endpoint and the arguments of
+# v20.Context.instrument.candles giving them
+CANDLES_PARAMS = (
+    ('price', 'price'), ('granularity', 'granularity'), ('count', 'count'),
+    ('from', 'fromTime'), ('to', 'toTime'), ('smooth', 'smooth'),
+    ('includeFirst', 'includeFirst'), ('dailyAlignment', 'dailyAlignment'),
+    ('alignmentTimezone', 'alignmentTimezone'), ('weeklyAlignment', 'weeklyAlignment'),
+)
+
+def _candlesRequest(instrument, kwargs):
+    """builds the request v20.Context.instrument.candles sends
+    """
+    request=Request('GET', '/v3/instruments/{instrument}/candles')
+    request.set_path_param('instrument', instrument)
+    for param, arg in CANDLES_PARAMS:
+        request.set_param(param, kwargs.get(arg))
+    return request
+
+def candlesToDataFrame(candleSticks):
+    """converts a list of candle sticks to a dataframe
+
+    The candle sticks are walked once, filling preallocated columns,
+    and their times are parsed in one batch. If candle sticks hold
+    one of bid, ask and mid prices, they are stored in columns Open,
+    Close, Low and High. If they hold several of them, each one is
+    stored in columns prefixed by its name, e.g. bid_o, bid_c, bid_l,
+    bid_h, ask_o, ....
+
+    :param candleSticks: the candle sticks returned by v20
+    :type candleSticks: non-empty list of v20.instrument.Candlestick
+    :return: a dataframe of candle sticks indexed by their time
+    :rtype: pandas.DataFrame
+    """
+    first=candleSticks[0]
+    components=[name for name in ('bid', 'ask', 'mid') if getattr(first, name) is not None]
+
+    n=len(candleSticks)
+    times=[None] * n
+    volume=np.empty(n, dtype=np.int64)
+    complete=np.empty(n, dtype=bool)
+    prices=[]
+    for name in components:
+        # prices are strings if the context does not convert decimal numbers to float
+        dtype=np.float64 if isinstance(getattr(first, name).o, float) else object
+        prices.append((name, np.empty(n, dtype=dtype), np.empty(n, dtype=dtype), np.empty(n, dtype=dtype), np.empty(n, dtype=dtype)))
+
+    for i, cs in enumerate(candleSticks):
+        times[i]=cs.time
+        volume[i]=cs.volume
+        complete[i]=cs.complete
+        for name, o, c, l, h in prices:
+            data=getattr(cs, name)
+            o[i]=data.o
+            c[i]=data.c
+            l[i]=data.l
+            h[i]=data.h
+    return _toDataFrame(times, prices, volume, complete)
+
+def candleDictsToDataFrame(candles, as_float=True):
+    """converts candle sticks decoded from JSON to a dataframe
+
+    It is the counterpart of `candlesToDataFrame` for candle sticks
+    as sent by the v20 REST server, i.e. dictionaries holding time,
+    volume, complete and bid, ask or mid prices as strings. No v20
+    object is built, each field is extracted for all candle sticks at
+    once. The dataframe is the same as the one `candlesToDataFrame`
+    makes of the v20 objects.
+
+    :param candles: the candle sticks
+    :param as_float: whether prices are converted to float, like
+    v20 does unless its context is told otherwise
+    :type candles: non-empty list of dict
+    :type as_float: bool
+    :return: a dataframe of candle sticks indexed by their time
+    :rtype: pandas.DataFrame
+    """
+    first=candles[0]
+    n=len(candles)
+    times=[cs['time'] for cs in candles]
+    volume=np.fromiter([cs['volume'] for cs in candles], dtype=np.int64, count=n)
+    complete=np.fromiter([cs['complete'] for cs in candles], dtype=bool, count=n)
+    prices=[]
+    for name in ('bid', 'ask', 'mid'):
+        if name not in first:
+            continue
+        data=[cs[name] for cs in candles]
+        if as_float:
+            # float() is what v20 converts prices with, so values are the same to the last bit
+            columns=[np.fromiter(map(float, [d[f] for d in data]), dtype=np.float64, count=n) for f in 'oclh']
+        else:
+            columns=[np.array([d[f] for d in data], dtype=object) for f in 'oclh']
+        prices.append((name, *columns))
+    return _toDataFrame(times, prices, volume, complete, _parseTimes(times))
+
+def _parseTimes(times):
+    """parses RFC3339 times in UTC, as sent by v20, in one batch
+
+    NumPy parses them much faster than pandas, once the trailing Z
+    is removed. Times in any other format are parsed by pandas.
+    """
+    try:
+        if all(t[-1] == 'Z' for t in times):
+            return pd.DatetimeIndex(np.array([t[:-1] for t in times], dtype='datetime64[ns]')).tz_localize('UTC')
+    except ValueError:
+        pass
+    return pd.to_datetime(times, format='ISO8601')
+
+def _toDataFrame(times, prices, volume, complete, index=None):
+    columns={}
+    if len(prices) == 1:
+        _, columns['Open'], columns['Close'], columns['Low'], columns['High']=prices[0]
+    else:
+        for name, o, c, l, h in prices:
+            columns[name + '_o'], columns[name + '_c'], columns[name + '_l'], columns[name + '_h']=o, c, l, h
+    columns['Volume']=volume
+    columns['Complete']=complete
+    return pd.DataFrame(columns, index=index if index is not None else pd.to_datetime(times, format='ISO8601'))
+
+## Paging through a sub-interval
+#
+# Each page holds at most `Constants.MAX_CANDLE_STICKS` candle sticks.
+# The next page starts right after the last candle stick of the
+# previous one, until the sub-interval is covered. A page that is
+# expected to reach the end of the sub-interval is bounded by its end,
+# if the end is not in the future. The pager only computes requests,
+# sending them is left to its user.
+class Pager:
+    def __init__(self, start, end, granularity, price, after=None):
+        """create an instance of Pager
+
+        :param start: the first day of the sub-interval
+        :param end: the last day of the sub-interval
+        :param granularity: the frequency of price data
+        :param price: the price type
+        :param after: if given, the sub-interval starts right after
+        this time instead of at `start`
+        :type start: datetime.date
+        :type end: datetime.date
+        :type granularity: str
+        :type price: str
+        :type after: pandas.Timestamp in UTC
+        """
+        self._end=end
+        self._end_ts=pd.Timestamp(end + timedelta(days=1), tz='UTC') # exclusive end of the sub-interval
+        self._granularity=granularity
+        self._granularity_sec=getGranularityInSec(granularity)
+        self._price=price
+        if after is None:
+            self._cursor, self._cursor_ts=start, pd.Timestamp(start, tz='UTC')
+            self._page_args={}
+        else:
+            self._cursor, self._cursor_ts=toRFC3339(after), after
+            self._page_args={'includeFirst': False}
+        self._done=False
+
+    def request(self):
+        """gets the arguments of the next request
+
+        :return: the keyword arguments of `v20.Context.instrument.candles`,
+        or None if the sub-interval is covered
+        :rtype: dict
+        """
+        if self._done:
+            return None
+        kwargs=dict(fromTime=self._cursor, granularity=self._granularity, price=self._price, **self._page_args)
+        remaining=(self._end_ts - self._cursor_ts).total_seconds() / self._granularity_sec
+        if remaining < Constants.MAX_CANDLE_STICKS and self._end_ts <= pd.Timestamp.now(tz='UTC'):
+            kwargs['toTime']=self._end + timedelta(days=1)
+        else:
+            kwargs['count']=Constants.MAX_CANDLE_STICKS
+        return kwargs
+
+    def advance(self, df):
+        """moves past the response of the last request
+
+        :param df: the candle sticks of the response, or None if there was none
+        :type df: pandas.DataFrame
+        :return: the candle sticks of the response within the
+        sub-interval, or None if there is none
+        :rtype: pandas.DataFrame
+        """
+        if df is None:
+            self._done=True
+            return None
+        self._cursor_ts=df.index[-1]
+        page=df[df.index < self._end_ts]
+        if self._cursor_ts >= self._end_ts or len(df) < Constants.MAX_CANDLE_STICKS:
+            self._done=True
+        else:
+            # continue from the last candle stick, excluding it
+            self._cursor=toRFC3339(self._cursor_ts)
+            self._page_args={'includeFirst': False}
+        return page if len(page) > 0 else None
+
+    def remaining(self):
+        """gets the days not fetched yet
+
+        The day of the last candle stick may be fetched partially,
+        it is included.
+
+        :return: a (start, end) pair of datetime.date, both inclusive
+        :rtype: tuple
+        """
+        return (self._cursor_ts.date(), self._end)
+
+_response=threading.local() # the timing of the last http response of each thread
+
+# the statuses of requests refused for their token, e.g. a revoked one
+TOKEN_REFUSED_STATUS=(401, 403)
+# the statuses of failures caused by the token, counting against its health
+TOKEN_FAILURE_STATUS=TOKEN_REFUSED_STATUS + (429,)
+
+def _recordResponse(response, *args, **kwargs):
+    """a hook of requests recording the time until the response headers arrived
+    """
+    _response.elapsed=response.elapsed.total_seconds()
+    return response
+
 class Instrument:
-    def __init__(self, context):
-        self._context=context
+    def __init__(self, context, cache=None, retry_policy=None, metrics=None, fast_decode=None, layout=None, store=None):
+        """create an instance of Instrument
+
+        :param context: the v20 context requests are sent through, or
+        a pool of tokens requests are spread across, see
+        `oandata.factory.Factory.createTokenPool`
+        :param cache: if given, candle sticks are cached in it and
+        only those missing from the cache are fetched
+        :param retry_policy: the backoff between retries of a failed
+        request. If not given, the default `RetryPolicy` is used.
+        :param metrics: the metrics timings and counters are recorded
+        in. If not given, the process-wide metrics are used.
+        :param fast_decode: whether responses are decoded straight
+        into columns, bypassing v20 objects. If not given, it is done
+        if `context` is a v20.Context.
+        :param layout: if given, price data is returned in this
+        memory-compact layout, see `oandata.compact`
+        :param store: if given, price data of the ranges it fully
+        covers is read from it instead of being fetched
+        :type context: v20.Context or oandata.factory.TokenPool
+        :type cache: oandata.cache.CandleCache
+        :type retry_policy: oandata.retry.RetryPolicy
+        :type metrics: oandata.metrics.Metrics
+        :type fast_decode: bool
+        :type layout: str, one of `oandata.compact.LAYOUTS`
+        :type store: oandata.store.CandleStore
+        :raise ValueError: if `layout` is not supported
+        """
+        if layout is not None and layout not in LAYOUTS:
+            raise ValueError('Given layout \'{}\' is not supported.'.format(layout))
+        self._layout=layout
+        if not isinstance(context, TokenPool):
+            context=TokenPool([Token('DEFAULT', context, getRateLimiter(getattr(context, 'hostname', None), Constants.MAX_REQUESTS_PER_SEC))])
+        self._tokens=context
+        self._context=context.tokens[0].context
+        self._cache=cache
+        self._store=store
+        self._retry_policy=retry_policy if retry_policy is not None else RetryPolicy()
+        self._metrics=metrics if metrics is not None else getMetrics()
+        self._fast_decode=isinstance(self._context, v20.Context) if fast_decode is None else fast_decode
+        # the http call is timed apart from deserializing its response
+        for token in self._tokens.tokens:
+            session=getattr(token.context, '_session', None)
+            if session is not None and _recordResponse not in session.hooks['response']:
+                session.hooks['response'].append(_recordResponse)
 
     @classmethod
-    def fromConfigFile(cls, config_file):
+    def fromConfigFile(cls, config_file, cache=None, retry_policy=None, metrics=None, fast_decode=None, layout=None, store=None):
         factory=Factory.fromConfigFile(config_file)
-        return cls(factory.createContext())
+        return cls(factory.createTokenPool(), cache=cache, retry_policy=retry_policy, metrics=metrics, fast_decode=fast_decode, layout=layout, store=store)
 
     @classmethod
-    def fromConfigDict(cls, config_dict):
+    def fromConfigDict(cls, config_dict, cache=None, retry_policy=None, metrics=None, fast_decode=None, layout=None, store=None):
         factory=Factory(config_dict)
-        return cls(factory.createContext())
+        return cls(factory.createTokenPool(), cache=cache, retry_policy=retry_policy, metrics=metrics, fast_decode=fast_decode, layout=layout, store=store)
 
-    def _getCandles(self, instrument, **kwargs):
+    def _getCandles(self, instrument, token=None, **kwargs):
         """retrieves and returns candle data for an instrument
         :param instrument: is the name of instrument
+        :param token: the token the request is sent with, acquired from the pool if not given
         :param kwargs: the argument controlling the retrieved data that is directly passed to v20.Context.instrument.candles
         :return: a dataframe of candle sticks
         :rtype: pandas.DataFrame
         """
         # The following function send a GET request and then process,
         # fill out and return the response.
-        resp=self._context.instrument.candles(instrument, **kwargs)
+        context=(token if token is not None else self._tokens.acquire()).context
+        metrics=self._metrics
+        metrics.increment('requests')
+        _response.elapsed=None
+        start=time.perf_counter()
+        if self._fast_decode:
+            resp=context.request(_candlesRequest(instrument, kwargs))
+            body=json.loads(resp.raw_body) if str(resp.status) == '200' else None
+        else:
+            resp=context.instrument.candles(instrument, **kwargs)
+        seconds=time.perf_counter() - start
+        metrics.observe('request', seconds)
+        if _response.elapsed is not None:
+            metrics.observe('http', _response.elapsed)
+            metrics.observe('deserialize', seconds - _response.elapsed)
+        raw_body=getattr(resp, 'raw_body', None)
+        if isinstance(raw_body, (str, bytes)):
+            metrics.increment('bytes_received', len(raw_body))
 
         # On success response.status will be 200 and
         # response.body["candles"] should contain a list of candle
         # sticks. Method response.get(f,s) checks if the status equals
         # s and returns response.body[f].
-        candleSticks=resp.get("candles", 200)
+        if self._fast_decode:
+            if body is None:
+                raise ResponseUnexpectedStatus(resp, 200)
+            candleSticks=body.get('candles')
+        else:
+            candleSticks=resp.get("candles", 200)
 
         # check the validity of candleSticks, it should be a list of
         # as least one candle stick
         if candleSticks is None or not isinstance(candleSticks, list) or len(candleSticks)==0:
-            logging.warn("No result was found or it is invalid")
+            logging.warning("No result was found or it is invalid")
             return None
 
-        # convert candleSticks to a dataframe
-        indexes=[pd.Timestamp(cs.time) for cs in candleSticks]
-        candleSticksDataFrame={}
-        priceAction=None
-        if candleSticks[0].bid is not None:
-            candleSticksDataFrame['Open']=[cs.bid.o for cs in candleSticks]
-            candleSticksDataFrame['Close']=[cs.bid.c for cs in candleSticks]
-            candleSticksDataFrame['Low']=[cs.bid.l for cs in candleSticks]
-            candleSticksDataFrame['High']=[cs.bid.h for cs in candleSticks]
-
-        if candleSticks[0].ask is not None:
-            candleSticksDataFrame['Open']=[cs.ask.o for cs in candleSticks]
-            candleSticksDataFrame['Close']=[cs.ask.c for cs in candleSticks]
-            candleSticksDataFrame['Low']=[cs.ask.l for cs in candleSticks]
-            candleSticksDataFrame['High']=[cs.ask.h for cs in candleSticks]
-
-        if candleSticks[0].mid is not None:
-            candleSticksDataFrame['Open']=[cs.mid.o for cs in candleSticks]
-            candleSticksDataFrame['Close']=[cs.mid.c for cs in candleSticks]
-            candleSticksDataFrame['Low']=[cs.mid.l for cs in candleSticks]
-            candleSticksDataFrame['High']=[cs.mid.h for cs in candleSticks]
-        candleSticksDataFrame['Volume']=[cs.volume for cs in candleSticks]
-        candleSticksDataFrame['Complete']=[cs.complete for cs in candleSticks]
-        return pd.DataFrame(candleSticksDataFrame, index=indexes)
+        metrics.increment('candles', len(candleSticks))
+        with metrics.timer('dataframe'):
+            if self._fast_decode:
+                return candleDictsToDataFrame(candleSticks, context.decimal_number_as_float)
+            return candlesToDataFrame(candleSticks)
+
+    def _fetchPage(self, instrument, retry, **kwargs):
+        """sends one candle request, retrying on failure
+
+        Failed attempts are retried with exponential backoff given by
+        the retry policy. If the server responds with too many
+        requests (429), all requests sent with the token are held back
+        for the delay. Errors that are not worth retrying, e.g. bad
+        request, are raised at once. With several tokens, a request
+        refused for its token (401 or 403) is retried with another one
+        at once. Only failures caused by the token, i.e. refusals and
+        too many requests, count against its health, see
+        `oandata.factory.TokenPool`; server errors and timeouts do not.
+
+        :param instrument: the name of instrument
+        :param retry: the maximum number of attempts before giving up
+        :param kwargs: the arguments passed to `_getCandles`
+        :return: a dataframe of candle sticks or None if no candle stick was found
+        :rtype: pandas.DataFrame
+        :raise: FetchError without failed ranges if fetching failed
+        after retries, the original exception if it is not retryable
+        """
+        exception = None # stores exception that may happen during price data fetch
+        for attempt in range(retry):
+            token=self._tokens.acquire()
+            try:
+                df=self._getCandles(instrument, token, **kwargs)
+            except Exception as exp:
+                refused=statusOf(exp) in TOKEN_REFUSED_STATUS and len(self._tokens) > 1
+                if not isRetryable(exp) and not refused:
+                    raise
+                if statusOf(exp) in TOKEN_FAILURE_STATUS:
+                    self._tokens.fail(token, fatal=refused)
+                exception=exp
+                if attempt + 1 == retry:
+                    break
+                self._metrics.increment('retries')
+                if refused:
+                    logging.warning('Failed ({0}), retry with another token ...'.format(exp))
+                    continue
+                delay=self._retry_policy.delay(attempt, exp)
+                logging.warning('Failed ({0}), retry in {1:.2f} seconds ...'.format(exp, delay))
+                if statusOf(exp) == 429:
+                    token.limiter.pause(delay) # slows down every request sent with the token
+                else:
+                    time.sleep(delay)
+            else:
+                self._tokens.succeed(token)
+                return df
+        self._metrics.increment('failures')
+        logging.error('Fetching data from \'{0}\' failed, aborting...'.format(kwargs['fromTime']))
+        raise FetchError(str(exception), [])
+
+    def _iterSplit(self, instrument, start, end, granularity, price, retry, after=None):
+        """fetches price data of a sub-interval page by page, see `Pager`
+
+        :param instrument: the name of instrument
+        :param start: the first day of the sub-interval
+        :param end: the last day of the sub-interval
+        :param granularity: the frequency of price data
+        :param price: indictes which of bid, ask r mid price is recorded
+        :param retry: the maximum number of retries for each page before giving up
+        :param after: if given, the sub-interval starts right after this time
+        :return: a generator yielding a non-empty dataframe of candle sticks per page
+        :raise: FetchError holding the rest of the sub-interval if
+        fetching a page failed after retries
+        """
+        logging.info('Fetching data from \'{0}\' to \'{1}\' ...'.format(start if after is None else after, end))
+        pager=Pager(start, end, granularity, price, after)
+        while True:
+            kwargs=pager.request()
+            if kwargs is None:
+                return
+            try:
+                df=self._fetchPage(instrument, retry, **kwargs)
+            except FetchError as exp:
+                raise FetchError(str(exp), [pager.remaining()])
+            page=pager.advance(df)
+            if page is not None:
+                yield page
+
+    def _iterRange(self, instrument, from_date, to_date, granularity, price, split, retry, workers):
+        """fetches price data within [from_date, to_date] from the server
+
+        The arguments are those of `getCandles`, already verified. If
+        several workers are given, splits are fetched concurrently and
+        at most `Constants.PAGE_BUFFER` pages of each split are
+        buffered until they are yielded. A split failing after retries
+        does not stop the others.
+
+        :return: a generator yielding a non-empty dataframe of candle sticks per page, in order
+        :raise: FetchError holding the ranges of all failed splits
+        """
+        # step 1: split the duration into splits. Each split is
+        # fetched page by page, so splitting is only needed to fetch
+        # several splits concurrently.
+        split_intervals=getSplitIntervals(from_date, to_date, split, workers)
+        logging.info('Splitting the period into {} chunk(s)'.format(len(split_intervals)))
+
+        # step 2: fetching data for each split, at most `workers` of
+        # them at the same time. The pages are yielded in the order
+        # of splits.
+        failed=[]
+        if workers == 1 or len(split_intervals) == 1:
+            for s,e in split_intervals:
+                try:
+                    yield from self._iterSplit(instrument, s, e, granularity, price, retry)
+                except FetchError as exp:
+                    failed+=exp.failed_ranges
+            if failed:
+                raise FetchError('Fetching {} range(s) failed after retries'.format(len(failed)), failed)
+            return
+
+        stop=threading.Event()
+        def fetch(s, e, pages):
+            try:
+                for df in self._iterSplit(instrument, s, e, granularity, price, retry):
+                    while not stop.is_set():
+                        try:
+                            pages.put(df, timeout=0.1)
+                            break
+                        except queue.Full:
+                            pass
+                    if stop.is_set():
+                        return
+            finally:
+                pages.put(None) # marks the end of the split, the consumer always makes room for it
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            splits=[]
+            for s,e in split_intervals:
+                pages=queue.Queue(maxsize=Constants.PAGE_BUFFER)
+                splits.append((pages, executor.submit(fetch, s, e, pages)))
+            try:
+                for pages, future in splits:
+                    while True:
+                        df=pages.get()
+                        if df is None:
+                            break
+                        yield df
+                    try:
+                        future.result() # raises the exception the split failed with
+                    except FetchError as exp:
+                        failed+=exp.failed_ranges
+            finally:
+                stop.set()
+                for pages, future in splits:
+                    future.cancel()
+                    # drain the queue, so that no worker is blocked on it
+                    while not future.done() or not pages.empty():
+                        try:
+                            pages.get(timeout=0.1)
+                        except queue.Empty:
+                            pass
+        if failed:
+            raise FetchError('Fetching {} range(s) failed after retries'.format(len(failed)), failed)
+
+    def _iterCandles(self, instrument, from_date, to_date, granularity, price, split, retry, workers):
+        """yields pages of price data, reading from the store or the cache if there is one
+
+        The arguments are those of `getCandles`, already verified.
+        Ranges that failed are not cached. The cache stores prices as
+        float, so with a cache, prices fetched as strings are converted
+        to float as well, whether they are read from the cache or not.
+
+        :raise: FetchError holding the ranges that failed
+        """
+        if self._store is not None and self._store.covers(instrument, granularity, price, from_date, to_date):
+            stored=self._store.load(instrument, granularity, price, from_date, to_date)
+            if stored is not None and len(stored) > 0:
+                yield stored
+            return
+        if self._cache is None:
+            yield from self._iterRange(instrument, from_date, to_date, granularity, price, split, retry, workers)
+            return
+
+        d=from_date # the first day not yielded yet
+        failed=[]
+        for s,e in self._cache.missingRanges(instrument, granularity, price, from_date, to_date):
+            if d < s:
+                cached=self._cache.load(instrument, granularity, price, d, s - timedelta(days=1))
+                if cached is not None and len(cached) > 0:
+                    yield cached
+            df_list=[]
+            try:
+                for df in self._iterRange(instrument, s, e, granularity, price, split, retry, workers):
+                    df=castPrices(df, None)
+                    df_list.append(df)
+                    yield df
+            except FetchError as exp:
+                failed+=exp.failed_ranges
+            else:
+                # incomplete candle sticks are yielded but never cached
+                self._cache.update(instrument, granularity, price, s, e, pd.concat(df_list) if len(df_list) > 0 else pd.DataFrame())
+            d=e + timedelta(days=1)
+        if d <= to_date:
+            cached=self._cache.load(instrument, granularity, price, d, to_date)
+            if cached is not None and len(cached) > 0:
+                yield cached
+        if failed:
+            raise FetchError('Fetching {} range(s) failed after retries'.format(len(failed)), failed)
+
+    def iterCandles(self, instrument, from_date, to_date,
+                    granularity=Constants.DEFAULT_GRANULARITY,
+                    price=Constants.DEFAULT_PRICE,
+                    split=None, # let the number of splits equal the number of workers
+                    retry=Constants.DEFAULT_RETRY,
+                    workers=Constants.DEFAULT_WORKERS, merger=None, **kwargs):
+        """fetch candle data from OANDA page by page
+
+        This method works like `getCandles`, but instead of merging
+        all price data into one dataframe, it returns a generator
+        yielding one dataframe per page as soon as it is fetched. The
+        pages are yielded in time order. Consuming them one at a time
+        keeps memory usage flat regardless of the period length.
+        Overlapping pages are stitched by a `oandata.merge.PageMerger`,
+        so the yielded pages hold each time once; an incomplete last
+        candle stick of a page is yielded with the next one.
+
+        The parameters are those of `getCandles`. They are verified
+        when this method is called.
+
+        :return: a generator yielding non-empty dataframes of candle sticks
+        :raise: ValueError if an argument is not valid. While
+        iterating, FetchError after all pages that could be fetched
+        are yielded, if some ranges failed after retries.
+        """
+        from_date, to_date=checkArguments(from_date, to_date, granularity, price, split, retry, workers)
+        pages=self._iterCandles(instrument, from_date, to_date, granularity, price, split, retry, workers)
+        pages=self._mergePages(pages, PageMerger(granularity) if merger is None else merger)
+        return pages if self._layout is None else self._compactPages(pages)
+
+    def iterCandlesAfter(self, instrument, after,
+                         granularity=Constants.DEFAULT_GRANULARITY,
+                         price=Constants.DEFAULT_PRICE,
+                         retry=Constants.DEFAULT_RETRY, merger=None):
+        """fetch the candle data after a time from OANDA page by page
+
+        It works like `iterCandles` for the candle sticks from right
+        after `after` up to the current one, which may be incomplete.
+        Neither the cache nor the store is used.
+
+        :param instrument: the name of instrument
+        :param after: the time of the last candle stick already known,
+        naive times are taken as UTC
+        :param granularity: the frequency of price data
+        :param price: indictes which of bid, ask r mid price is recorded
+        :param retry: the maximum number of attempts of each request before giving up
+        :param merger: the merger stitching pages, see `getCandles`
+        :type instrument: str
+        :type after: datetime.datetime or pandas.Timestamp
+        :return: a generator yielding non-empty dataframes of candle sticks
+        :raise: ValueError if an argument is not valid. While
+        iterating, FetchError holding the remaining range, if a page
+        failed after retries.
+        """
+        # the period is checked by the pager, only the other arguments are checked here
+        today=date.today()
+        checkArguments(today, today, granularity, price, None, retry, Constants.DEFAULT_WORKERS)
+        after=pd.Timestamp(after)
+        after=after.tz_localize('UTC') if after.tz is None else after.tz_convert('UTC')
+        end=max(after.date(), pd.Timestamp.now(tz='UTC').date())
+        pages=self._iterSplit(instrument, after.date(), end, granularity, price, retry, after=after)
+        pages=self._mergePages(pages, PageMerger(granularity) if merger is None else merger)
+        return pages if self._layout is None else self._compactPages(pages)
+
+    def _mergePages(self, pages, merger):
+        duplicates=merger.duplicates
+        try:
+            yield from iterMerged(pages, merger)
+        finally:
+            pages.close()
+            self._metrics.increment('duplicates', merger.duplicates - duplicates)
+
+    def _compactPages(self, pages):
+        try:
+            for df in pages:
+                yield compactFrame(df, self._layout)
+        finally:
+            pages.close()
 
     def getCandles(self, instrument, from_date, to_date,
                    granularity=Constants.DEFAULT_GRANULARITY,
                    price=Constants.DEFAULT_PRICE,
-                   split=None, # let the number of splits is automatically estimated
-                   retry=Constants.DEFAULT_RETRY, **kwargs):
+                   split=None, # let the number of splits equal the number of workers
+                   retry=Constants.DEFAULT_RETRY,
+                   workers=Constants.DEFAULT_WORKERS, merger=None, **kwargs):
         """fetch candle data from OANDA with
 
         This method fetches price of `instrument` within time period
         `from_date` to `to_date` and returns the result as `pandas.DataFrame`.
+        If the instrument has a cache, only the days that are not
+        cached yet are fetched from the server. If it has a store
+        covering the whole period, nothing is fetched.
 
         :param instrument: the name of instrument e.g. 'EUR_USD' or 'DE30_EUR'
         :param from_date: the first date on which price data is recorded
         :param to_date: the last date on ehich price data is recorded
         :param granularity: the frequency of price data
-        :param price: indictes which of bid, ask r mid price is recorded
-        :param split: the number of splits
-        :param retry: the maximum number of retries if downloading fails before giving up
+        :param price: indictes which of bid, ask r mid price is recorded. A combination such as 'BA' or 'MBA' fetches all of them in one request, stored in columns prefixed by bid_, ask_ and mid_.
+        :param split: the number of sub-intervals the period is split into, or the list of (start, end) pairs of them, e.g. those planned by `oandata.planner.planSplits`. Days outside of them are not fetched. Each of them is fetched page by page, so splitting is only a tuning option.
+        :param retry: the maximum number of attempts of each request before giving up
+        :param workers: the number of sub-intervals fetched concurrently
+        :param merger: the merger stitching pages. If given, the gaps
+        between candle sticks, e.g. weekends, can be read from it
+        afterwards via `gaps()`.
 
         :type instrument: str
         :type from_date: str of format 'YYYY-MM-DD' or datetime.date
         :type to_date: str of format 'YYYY-MM-DD' or datetime.date
         :type granularity: str, must be one of the available options in `GRANULARITY`
-        :type price: str, must be one of the available options in `PRICE`
-        :type split: int, must be positive
+        :type price: str, must be one of the available options in `PRICE` or a combination of them
+        :type split: int, must be positive, or list of tuple of datetime.date
         :type retry: int, must be positive
-
-        :raise: ValueError if an argument is not valid or fetching
-        price data failed after retries, BadRequest if the request to
-        v20 REST server is not valid, for instance the instrument name
-        is not valid.
+        :type workers: int, must be positive
+        :type merger: oandata.merge.PageMerger
+
+        :raise: ValueError if an argument is not valid, FetchError if
+        some ranges failed after retries, holding the price data that
+        was fetched in `data`, ResponseUnexpectedStatus if the request
+        to v20 REST server is not valid, for instance the instrument
+        name is not valid.
         """
-        # step 1: verify and convert arguments
-
-        # check and convert from_date
-        if isinstance(from_date, str):
-            from_date=isoStrToDate(from_date)
-        elif not isinstance(from_date, date):
-            ValueError("'from_date' must be either a string in 'YYYY-MM-DD' format, or an object of type datetime.date")
-
-        # check and convert to_date
-        if isinstance(to_date, str):
-            to_date=isoStrToDate(to_date)
-        elif not isinstance(to_date, date):
-            raise ValueError("'to_date' must be either a string in 'YYYY-MM-DD' format, or an object of type datetime.date")
-
-        # check the duration
-        if from_date > to_date or to_date > date.today():
-            raise ValueError('Invalid date period: \'{0}\' -- \'{1}\''.format(from_date, to_date))
-
-        # check granularity
-        if not isinstance(granularity, str) or granularity not in GRANULARITY:
-            raise ValueError('Given granularity \'{}\' is not supported.'.format(granularity))
-
-        # check price
-        if not isinstance(price, str) or price not in PRICE:
-            raise ValueError('Given price type \'{}\' is not supported.'.format(price))
-
-        # check split
-        if split is not None and (not isinstance(split, int) or split < 1):
-            raise ValueError('Expected a positive split, but {} is given.'.format(self.split))
-
-        # check retry
-        if not isinstance(retry, int) or retry < 1:
-            raise ValueError('Expected a positive parameter for the number of retries, but {} is given.'.format(self.retry))
-
-        # step 2: split the duration into splits
-        # compute the number of splits (splits of [from_date, to_date])
-        split_num=computeIntervalNum(from_date, to_date, granularity) if split is None else split
-        logging.info('Splitting the period into {} chunk(s)'.format(split_num))
-        split_intervals=getSplits(start=from_date, end=to_date, splits=split_num)
-
-        # step 3: fetching data for each split
-        df_list=[] # the list of dataframes, each holds price data for the corresponding split
-        for s,e in split_intervals:
-            logging.info('Fetching data from \'{0}\' to \'{1}\' ...'.format(s,e))
-            exception = None # stores exception that may happen during price data fetch
-            for _ in range(retry):
-                try:
-                    df=self._getCandles(instrument, fromTime=s, toTime=e, granularity=granularity, price=price)
-                except Exception as exp:
-                    logging.warn('Failed, retry ...')
-                    exception=exp
-                    continue
-                exception=None
-                break
-            if exception is not None:
-                logging.error('Fetching data from \'{0}\' to \'{1}\' failed, aborting...'.format(s,e))
-                raise ValueError(str(exception))
-            df_list.append(df)
-
-        # step 4: concatenating the fetched dataframes, only if at least one of them is not None
-        return pd.DataFrame() if sum([(df is not None)*1 for df in df_list]) == 0 else pd.concat(df_list)
+        df_list=[]
+        try:
+            for df in self.iterCandles(instrument, from_date, to_date, granularity=granularity,
+                                       price=price, split=split, retry=retry, workers=workers, merger=merger):
+                df_list.append(df)
+        except FetchError as exp:
+            exp.data=pd.DataFrame() if len(df_list) == 0 else pd.concat(df_list)
+            raise
+        with self._metrics.timer('concat'):
+            return pd.DataFrame() if len(df_list) == 0 else pd.concat(df_list)
+
+    def getCandlesByGranularity(self, instrument, from_date, to_date, granularities, **kwargs):
+        """fetch candle data of several granularities from OANDA at once
+
+        Only the finest granularity is fetched. The others are derived
+        from it, see `oandata.resample.Resampler`, so this replaces as
+        many downloads as granularities by one.
+
+        :param instrument: the name of instrument
+        :param from_date: the first date on which price data is recorded
+        :param to_date: the last date on which price data is recorded
+        :param granularities: the granularities of price data
+        :param kwargs: the other arguments of `getCandles`
+        :type granularities: list of str
+        :return: a dictionary mapping each granularity to its price data
+        :rtype: dict
+        :raise: ValueError if a granularity cannot be derived from the
+        finest one, and the exceptions raised by `getCandles`
+        """
+        from oandata.resample import Resampler # imported here, since it depends on this module
+
+        granularities=list(dict.fromkeys(granularities))
+        for granularity in granularities:
+            if granularity not in GRANULARITY:
+                raise ValueError('Given granularity \'{}\' is not supported.'.format(granularity))
+        finest=min(granularities, key=getGranularityInSec)
+        resamplers=[Resampler(finest, g) for g in granularities if g != finest]
+        df_lists={g: [] for g in granularities}
+        for df in self.iterCandles(instrument, from_date, to_date, granularity=finest, **kwargs):
+            df_lists[finest].append(df)
+            for resampler in resamplers:
+                df_lists[resampler.granularity].append(resampler.update(df))
+        for resampler in resamplers:
+            df_lists[resampler.granularity].append(resampler.flush())
+        result={}
+        for g, df_list in df_lists.items():
+            df_list=[df for df in df_list if len(df) > 0]
+            result[g]=pd.DataFrame() if len(df_list) == 0 else pd.concat(df_list)
+        return result
@@ -0,0 +1,186 @@
+import numpy as np
+import pandas as pd
+
+from oandata.constants import getGranularityInSec
+
+GAP_COLUMNS=('From', 'To', 'Missing')
+
+# nanoseconds per unit of time indices
+_NANOSECONDS={'s': 10**9, 'ms': 10**6, 'us': 10**3, 'ns': 1}
+
+def _times(df):
+    """gets the time index of `df` as int64 nanoseconds since epoch (UTC)
+    """
+    index=pd.DatetimeIndex(df.index)
+    times=index.asi8
+    return times if index.unit == 'ns' else times * _NANOSECONDS[index.unit]
+
+## Stitching pages of candle sticks
+#
+# Pages arrive in time order, but neighbouring pages may overlap, e.g.
+# the candle stick on the boundary of two splits, or the last one of
+# a page being fetched again once it is complete. The merger stitches
+# them in a single pass: rows at or before the last one passed on are
+# dropped, and of rows sharing a time the first complete one is kept,
+# the last one if none is complete. An incomplete last row of a page
+# is held back until the next page arrives, so that it can still be
+# replaced by its complete version; other pages are passed on without
+# copying. Nothing is sorted; a page that is not sorted, or overlaps
+# further back than the previous page, is an error. Gaps between
+# consecutive candle sticks, e.g. weekends or outages, are recorded
+# on the way.
+class PageMerger:
+    def __init__(self, granularity):
+        """create an instance of PageMerger
+
+        :param granularity: the granularity of the pages, gaps are
+        measured in candle sticks of it
+        :type granularity: str
+        """
+        self._step=getGranularityInSec(granularity) * 10**9
+        self._held=None      # the incomplete last row, held back
+        self._last=None      # the time of the last row passed on
+        self._tail=None      # the times of the last rows passed on
+        self._gaps=[]        # (from, to, missing) of the gaps found so far, as int64 arrays
+        self.duplicates=0    # the number of rows dropped as duplicates
+
+    def _dedupe(self, df, times):
+        """drops rows sharing their time with another, preferring complete rows
+        """
+        if len(times) < 2:
+            return df, times
+        same=times[1:] == times[:-1]
+        if not same.any():
+            return df, times
+        starts=np.flatnonzero(np.r_[True, ~same])
+        ends=np.r_[starts[1:], len(times)] - 1
+        if 'Complete' in df.columns:
+            complete=df['Complete'].to_numpy(dtype=bool)
+            best=np.minimum.reduceat(np.where(complete, np.arange(len(times)), len(times)), starts)
+            keep=np.where(best < len(times), best, ends)
+        else:
+            keep=ends
+        self.duplicates+=len(times) - len(keep)
+        return df.iloc[keep], times[keep]
+
+    def _pass(self, df, times):
+        """records the gaps before and within rows passed on and returns them
+        """
+        if len(times) == 0:
+            return None
+        if self._last is not None:
+            times=np.r_[self._last, times]
+        missing=np.rint(np.diff(times) / self._step).astype(np.int64) - 1
+        at=np.flatnonzero(missing > 0)
+        if len(at) > 0:
+            self._gaps.append((times[at], times[at + 1], missing[at]))
+        self._last=times[-1]
+        self._tail=times
+        return df
+
+    def add(self, df):
+        """adds the next page
+
+        :param df: the page, indexed by time
+        :type df: pandas.DataFrame
+        :return: the rows of the merged data that are final, possibly
+        including the row held back from the previous page, or None if
+        there is none
+        :rtype: pandas.DataFrame
+        :raise ValueError: if the page is not sorted by time, or
+        overlaps rows before those of the previous page
+        """
+        if df is None or len(df) == 0:
+            return None
+        times=_times(df)
+        if (times[1:] < times[:-1]).any():
+            raise ValueError('The page from {} to {} is not sorted by time'.format(df.index[0], df.index[-1]))
+        if self._last is not None:
+            n=int(np.searchsorted(times, self._last, side='right'))
+            if n > 0:
+                # the tail is sorted, so the overlap is looked up by binary search
+                at=np.minimum(np.searchsorted(self._tail, times[:n]), len(self._tail) - 1)
+                if (self._tail[at] != times[:n]).any():
+                    raise ValueError('The page from {} to {} overlaps rows before the previous page'.format(df.index[0], df.index[-1]))
+                self.duplicates+=n
+                df, times=df.iloc[n:], times[n:]
+        if self._held is not None:
+            df=pd.concat([self._held, df]) if len(df) > 0 else self._held
+            times=np.r_[_times(self._held), times]
+            if len(times) > 1 and times[1] < times[0]:
+                raise ValueError('The page from {} to {} overlaps rows before the previous page'.format(df.index[1], df.index[-1]))
+        self._held=None
+        df, times=self._dedupe(df, times)
+        if len(times) > 0 and 'Complete' in df.columns and not df['Complete'].iat[-1]:
+            self._held=df.iloc[-1:]
+            return self._pass(df.iloc[:-1], times[:-1])
+        return self._pass(df, times)
+
+    def finish(self):
+        """passes on the held back row
+
+        :return: the last row, or None if there is none
+        :rtype: pandas.DataFrame
+        """
+        held, self._held=self._held, None
+        if held is None:
+            return None
+        return self._pass(held, _times(held))
+
+    def gaps(self):
+        """gets the gaps found so far
+
+        :return: the gap table, one row per gap holding the times of
+        the candle sticks before (From) and after (To) it and the
+        number of candle sticks missing in between (Missing)
+        :rtype: pandas.DataFrame
+        """
+        if len(self._gaps) == 0:
+            return pd.DataFrame({'From': pd.DatetimeIndex([], tz='UTC'), 'To': pd.DatetimeIndex([], tz='UTC'),
+                                 'Missing': np.array([], dtype=np.int64)}, columns=list(GAP_COLUMNS))
+        starts, ends, missing=(np.concatenate(a) for a in zip(*self._gaps))
+        return pd.DataFrame({'From': pd.to_datetime(starts, unit='ns', utc=True),
+                             'To': pd.to_datetime(ends, unit='ns', utc=True),
+                             'Missing': missing}, columns=list(GAP_COLUMNS))
+
+def iterMerged(pages, merger):
+    """stitches pages by `merger`
+
+    :param pages: the pages in time order
+    :param merger: the merger
+    :type pages: iterable of pandas.DataFrame
+    :type merger: PageMerger
+    :return: a generator yielding non-empty merged pages. If `pages`
+    raises, e.g. FetchError once the pages that could be fetched are
+    yielded, the held back row is yielded before it is raised again.
+    """
+    try:
+        for df in pages:
+            df=merger.add(df)
+            if df is not None and len(df) > 0:
+                yield df
+    except Exception:
+        df=merger.finish()
+        if df is not None:
+            yield df
+        raise
+    df=merger.finish()
+    if df is not None:
+        yield df
+
+def mergePages(pages, granularity):
+    """merges pages of candle sticks into one dataframe
+
+    See `PageMerger` for how pages are stitched.
+
+    :param pages: the pages in time order
+    :param granularity: the granularity of the pages
+    :type pages: iterable of pandas.DataFrame
+    :type granularity: str
+    :return: the merged dataframe and the gap table, see `PageMerger.gaps`
+    :rtype: tuple
+    :raise ValueError: if the pages are not in time order
+    """
+    merger=PageMerger(granularity)
+    df_list=list(iterMerged(pages, merger))
+    return pd.DataFrame() if len(df_list) == 0 else pd.concat(df_list), merger.gaps()
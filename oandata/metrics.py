@@ -0,0 +1,181 @@
+import threading, time
+from contextlib import contextmanager
+
+# the stages of fetching price data, in the order they happen
+STAGES = (
+    'request',     # a candle request as a whole, i.e. http and deserialize
+    'http',        # the http call, until the response headers arrive
+    'deserialize', # the rest of the request, mostly JSON to v20 objects
+    'dataframe',   # v20 candle sticks to dataframe
+    'concat',      # merging pages into one dataframe
+    'write',       # writing pages into the output file
+)
+
+# the counters
+COUNTERS = (
+    'requests',       # candle requests sent
+    'retries',        # failed requests that are retried
+    'failures',       # requests that failed after retries
+    'bytes_received', # the size of response bodies
+    'candles',        # candle sticks received
+    'duplicates',     # candle sticks dropped when merging overlapping pages
+)
+
+## Timings and counters of the fetch path
+#
+# Stages are timed via `timer` and counted via `increment`. Each
+# observation is also passed to the callbacks, e.g. to forward them
+# to a monitoring system. It is safe to share one instance between
+# threads.
+class Metrics:
+    def __init__(self, callback=None):
+        """create an instance of Metrics
+
+        :param callback: if given, it is called with kind ('timing' or
+        'counter'), name and value of each observation
+        :type callback: callable
+        """
+        self._lock=threading.Lock()
+        self._callbacks=[callback] if callback is not None else []
+        self.reset()
+
+    def reset(self):
+        """forgets all observations
+        """
+        with self._lock:
+            self._timings={} # maps a stage to [count, total seconds, max seconds]
+            self._counters=dict.fromkeys(COUNTERS, 0)
+            self._first=None # the time of the first request
+            self._last=None # the time of the last request
+
+    def addCallback(self, callback):
+        """adds a callback called with kind, name and value of each observation
+
+        :type callback: callable
+        """
+        self._callbacks.append(callback)
+
+    def observe(self, stage, seconds):
+        """records the duration of a stage
+
+        :param stage: the name of the stage, e.g. one of `STAGES`
+        :param seconds: the duration
+        :type stage: str
+        :type seconds: float
+        """
+        with self._lock:
+            timing=self._timings.setdefault(stage, [0, 0.0, 0.0])
+            timing[0]+=1
+            timing[1]+=seconds
+            timing[2]=max(timing[2], seconds)
+        for callback in self._callbacks:
+            callback('timing', stage, seconds)
+
+    @contextmanager
+    def timer(self, stage):
+        """times the enclosed block as `stage`
+
+        :param stage: the name of the stage, e.g. one of `STAGES`
+        :type stage: str
+        """
+        start=time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+
+    def increment(self, name, value=1):
+        """increments a counter
+
+        :param name: the name of the counter, e.g. one of `COUNTERS`
+        :param value: the increment
+        :type name: str
+        :type value: int
+        """
+        with self._lock:
+            self._counters[name]=self._counters.get(name, 0) + value
+            if name == 'requests':
+                now=time.monotonic()
+                if self._first is None:
+                    self._first=now
+                self._last=now
+        for callback in self._callbacks:
+            callback('counter', name, value)
+
+    def snapshot(self):
+        """gets the observations so far
+
+        :return: a dictionary with keys 'timings', mapping each stage to
+        a dictionary of count, total and max seconds, 'counters',
+        mapping each counter to its value, and the derived
+        'candles_per_request' and 'requests_per_second'
+        :rtype: dict
+        """
+        with self._lock:
+            timings={stage: {'count': c, 'total': t, 'max': m} for stage, (c, t, m) in self._timings.items()}
+            counters=dict(self._counters)
+            elapsed=self._last - self._first if self._first is not None else 0.0
+        requests=counters['requests']
+        return {
+            'timings': timings,
+            'counters': counters,
+            'candles_per_request': counters['candles'] / requests if requests > 0 else 0.0,
+            'requests_per_second': requests / elapsed if elapsed > 0 else float(requests),
+        }
+
+    def toPrometheus(self, prefix='oandata'):
+        """exports the observations in Prometheus text format
+
+        :param prefix: the prefix of metric names
+        :type prefix: str
+        :rtype: str
+        """
+        snapshot=self.snapshot()
+        lines=['# HELP {}_stage_seconds the time spent in each stage of fetching'.format(prefix),
+               '# TYPE {}_stage_seconds summary'.format(prefix)]
+        for stage, timing in snapshot['timings'].items():
+            lines.append('{}_stage_seconds_sum{{stage="{}"}} {!r}'.format(prefix, stage, timing['total']))
+            lines.append('{}_stage_seconds_count{{stage="{}"}} {}'.format(prefix, stage, timing['count']))
+        for name, value in snapshot['counters'].items():
+            lines.append('# TYPE {}_{}_total counter'.format(prefix, name))
+            lines.append('{}_{}_total {}'.format(prefix, name, value))
+        for name in ('candles_per_request', 'requests_per_second'):
+            lines.append('# TYPE {}_{} gauge'.format(prefix, name))
+            lines.append('{}_{} {!r}'.format(prefix, name, snapshot[name]))
+        return '\n'.join(lines) + '\n'
+
+    def report(self):
+        """formats a per-stage breakdown for humans
+
+        :rtype: str
+        """
+        snapshot=self.snapshot()
+        stages=[s for s in STAGES if s in snapshot['timings']] + sorted(s for s in snapshot['timings'] if s not in STAGES)
+        lines=['{:<12} {:>8} {:>10} {:>10} {:>10}'.format('stage', 'count', 'total (s)', 'mean (ms)', 'max (ms)')]
+        for stage in stages:
+            timing=snapshot['timings'][stage]
+            lines.append('{:<12} {:>8} {:>10.3f} {:>10.3f} {:>10.3f}'.format(
+                stage, timing['count'], timing['total'], timing['total'] / timing['count'] * 1e3, timing['max'] * 1e3))
+        lines.append('')
+        for name, value in snapshot['counters'].items():
+            lines.append('{:<20} {}'.format(name, value))
+        lines.append('{:<20} {:.1f}'.format('candles_per_request', snapshot['candles_per_request']))
+        lines.append('{:<20} {:.1f}'.format('requests_per_second', snapshot['requests_per_second']))
+        return '\n'.join(lines)
+
+_metrics=Metrics()
+
+def getMetrics():
+    """gets the process-wide metrics, used unless an instrument is given its own
+
+    :rtype: Metrics
+    """
+    return _metrics
+
+def setMetrics(metrics):
+    """replaces the process-wide metrics
+
+    :type metrics: Metrics
+    """
+    global _metrics
+    _metrics=metrics
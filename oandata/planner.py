@@ -0,0 +1,303 @@
+import math
+from datetime import timedelta
+import numpy as np
+import pandas as pd
+
+from oandata.constants import Constants, getGranularityInSec, canResample
+from oandata.instrument import getSplits
+from oandata.resample import DAILY_ALIGNMENT, ALIGNMENT_TIMEZONE
+
+## Trading calendar
+#
+# FX markets close on Friday at `DAILY_ALIGNMENT` o'clock in
+# `ALIGNMENT_TIMEZONE` (5pm New York time) and open again two days
+# later at the same time. OANDA has no FX candle sticks in between,
+# so a request for a closed window is wasted. Other instruments, e.g.
+# CFDs or cryptocurrencies, may be traded then, so closed windows are
+# only skipped on request.
+
+MARKET_CLOSE_DAY=4      # the weekday on which markets close, i.e. Friday
+MARKET_CLOSED_DAYS=2    # the days markets stay closed
+DEFAULT_LATENCY=0.25    # the seconds a request is assumed to take, used for estimates
+PAGES_PER_SPLIT=2       # the minimum number of pages of each planned split
+SECONDS_PER_DAY=24 * 3600
+
+def tradingSeconds(from_date, to_date, all_week=False):
+    """computes the seconds markets are open on each day
+
+    :param from_date: the first day
+    :param to_date: the last day
+    :param all_week: whether markets are never closed
+    :type from_date: datetime.date
+    :type to_date: datetime.date
+    :type all_week: bool
+    :return: the seconds of each day from `from_date` to `to_date` (UTC)
+    :rtype: numpy.ndarray of float
+    """
+    days=(to_date - from_date).days + 1
+    seconds=np.full(days, float(SECONDS_PER_DAY))
+    if all_week:
+        return seconds
+    start=pd.Timestamp(from_date, tz='UTC')
+    close_day=from_date - timedelta(days=(from_date.weekday() - MARKET_CLOSE_DAY) % 7)
+    while close_day <= to_date:
+        window=[(pd.Timestamp(d) + pd.Timedelta(hours=DAILY_ALIGNMENT)).tz_localize(ALIGNMENT_TIMEZONE)
+                for d in (close_day, close_day + timedelta(days=MARKET_CLOSED_DAYS))]
+        closes, opens=[(t - start).total_seconds() for t in window]
+        for i in range(max(0, int(closes // SECONDS_PER_DAY)), min(days, math.ceil(opens / SECONDS_PER_DAY))):
+            seconds[i]-=max(0.0, min(opens, (i + 1) * SECONDS_PER_DAY) - max(closes, i * SECONDS_PER_DAY))
+        close_day+=timedelta(days=7)
+    return seconds
+
+def countRequests(intervals, granularity, skip_closed=False):
+    """estimates the number of requests fetching sub-intervals page by page
+
+    Each page holds at most `Constants.MAX_CANDLE_STICKS` candle
+    sticks and each sub-interval takes a request at least, even if
+    markets are closed all along.
+
+    :param intervals: the (start, end) pairs of sub-intervals, both inclusive
+    :param granularity: the granularity of price data
+    :param skip_closed: whether only trading time holds candle sticks
+    :type intervals: list of tuple of datetime.date
+    :type granularity: str
+    :type skip_closed: bool
+    :rtype: int
+    """
+    granularity_sec=getGranularityInSec(granularity)
+    return sum(max(1, math.ceil(tradingSeconds(s, e, not skip_closed).sum() / granularity_sec / Constants.MAX_CANDLE_STICKS))
+               for s,e in intervals)
+
+def planSplits(from_date, to_date, granularity, splits=1, skip_closed=False, capped=True):
+    """splits a period into sub-intervals of about the same trading time
+
+    Sub-intervals end at midnight, so each may take a request more
+    than its share of pages. If capped, there is thus at most one
+    sub-interval per `PAGES_PER_SPLIT` pages needed for the period.
+    If closed windows are skipped, none of the sub-intervals falls
+    into one, days on which markets are closed belong to a
+    neighbouring sub-interval, costing no request.
+
+    :param from_date: the first day of the period
+    :param to_date: the last day of the period
+    :param granularity: the granularity of price data
+    :param splits: the number of sub-intervals, at most one per day
+    :param skip_closed: whether no sub-interval falls into a closed window
+    :param capped: whether `splits` is capped by the number of pages
+    :type from_date: datetime.date
+    :type to_date: datetime.date
+    :type granularity: str
+    :type splits: int
+    :type skip_closed: bool
+    :type capped: bool
+    :return: the (start, end) pairs of sub-intervals, both
+    inclusive, at least one. The period is a single sub-interval if
+    markets are closed all along.
+    :rtype: list of tuple of datetime.date
+    """
+    seconds=tradingSeconds(from_date, to_date, not skip_closed)
+    total=seconds.sum()
+    if total <= 0:
+        return [(from_date, to_date)]
+    n=min(splits, np.count_nonzero(seconds))
+    if capped:
+        n=min(n, math.ceil(total / getGranularityInSec(granularity) / Constants.MAX_CANDLE_STICKS) // PAGES_PER_SPLIT)
+    n=max(1, n)
+    cumulative=np.cumsum(seconds)
+    ends=np.unique(np.searchsorted(cumulative, total * np.arange(1, n) / n)).tolist() + [len(seconds) - 1]
+    intervals=[]
+    s=0
+    for e in ends:
+        if e >= s and cumulative[e] > (cumulative[s - 1] if s > 0 else 0):
+            intervals.append((from_date + timedelta(days=s), from_date + timedelta(days=e)))
+            s=e + 1
+    return intervals
+
+def estimateSeconds(requests, workers=1, rate=Constants.MAX_REQUESTS_PER_SEC, latency=DEFAULT_LATENCY):
+    """estimates the duration of sending requests
+
+    :param requests: the number of requests
+    :param workers: the number of requests sent concurrently
+    :param rate: the maximum number of requests per second
+    :param latency: the seconds each request takes
+    :type requests: int
+    :type workers: int
+    :type rate: float
+    :type latency: float
+    :rtype: float
+    """
+    return max(requests / rate, requests * latency / workers)
+
+## A job as planned
+#
+# The job fetched may derive the granularities of other jobs, which
+# are then not fetched. Only the ranges missing from the cache are
+# fetched, split into `splits`.
+class Step:
+    def __init__(self, job, indices, ranges, splits, requests):
+        """create an instance of Step
+
+        :param job: the job fetched, with the granularities derived from it
+        :param indices: the indices of the planned jobs it runs
+        :param ranges: the (start, end) ranges fetched from the server
+        :param splits: the sub-intervals of the ranges fetched one by one
+        :param requests: the estimated number of requests
+        :type job: oandata.fetcher.Job
+        :type indices: list of int
+        :type ranges: list of tuple of datetime.date
+        :type splits: list of tuple of datetime.date
+        :type requests: int
+        """
+        self.job=job
+        self.indices=indices
+        self.ranges=ranges
+        self.splits=splits
+        self.requests=requests
+
+## A fetch plan of several jobs
+#
+# It is computed before any request is sent, see `makePlan`.
+class Plan:
+    def __init__(self, steps, jobs, requests, unplanned, seconds):
+        """create an instance of Plan
+
+        :param steps: the steps to run
+        :param jobs: the number of jobs planned
+        :param requests: the estimated number of requests of the plan
+        :param unplanned: the estimated number of requests of the jobs run as given
+        :param seconds: the estimated duration of the plan
+        :type steps: list of Step
+        :type jobs: int
+        :type requests: int
+        :type unplanned: int
+        :type seconds: float
+        """
+        self.steps=steps
+        self.jobs=jobs
+        self.requests=requests
+        self.unplanned=unplanned
+        self.seconds=seconds
+
+    def results(self, step_results):
+        """maps the results of steps to the jobs planned
+
+        :param step_results: the result of each step
+        :type step_results: list
+        :return: the result of each job, None for derived ones
+        :rtype: list
+        """
+        results=[None] * self.jobs
+        for step, result in zip(self.steps, step_results):
+            results[step.indices[0]]=result
+        return results
+
+    def report(self):
+        """formats the plan, one line per step and a summary
+
+        :rtype: str
+        """
+        lines=[]
+        for step in self.steps:
+            job=step.job
+            derived=' -> {}'.format(', '.join(g for g, _ in job.derive)) if len(job.derive) > 0 else ''
+            lines.append('{} {}{} {} {} -- {}: {} range(s), {} split(s), {} request(s)'.format(
+                job.instrument, job.granularity, derived, job.price, job.from_date, job.to_date,
+                len(step.ranges), len(step.splits), step.requests))
+        lines.append('{} job(s) in {} step(s): {} request(s) instead of {}, about {:.1f} s'.format(
+            self.jobs, len(self.steps), self.requests, self.unplanned, self.seconds))
+        return '\n'.join(lines)
+
+def _attach(base, job):
+    """makes `base` derive the granularities of `job` if possible
+
+    :return: whether `job` is attached
+    :rtype: bool
+    """
+    if (base.instrument != job.instrument or base.price != job.price or base.from_date != job.from_date
+        or base.to_date != job.to_date or base.output is None or job.output is None
+        or base.ranges is not None or job.ranges is not None
+        or getGranularityInSec(base.granularity) >= getGranularityInSec(job.granularity)):
+        return False
+    derive=[(job.granularity, job.output)] + job.derive
+    if not all(canResample(base.granularity, g) for g, _ in derive):
+        return False
+    base.derive+=derive
+    return True
+
+def _missingRanges(job, cache):
+    """gets the ranges of a job fetched from the server
+
+    :return: the (start, end) ranges of the job, see `oandata.fetcher.Job.ranges`,
+    that are missing from the cache
+    :rtype: list of tuple of datetime.date
+    """
+    ranges=job.ranges if job.ranges is not None else [(job.from_date, job.to_date)]
+    if cache is None:
+        return list(ranges)
+    return [r for s,e in ranges for r in cache.missingRanges(job.instrument, job.granularity, job.price, s, e)]
+
+def makePlan(jobs, cache=None, split=None, workers=Constants.DEFAULT_WORKERS, derive=True, skip_closed=False,
+             rate=Constants.MAX_REQUESTS_PER_SEC, latency=DEFAULT_LATENCY):
+    """computes the plan of fetching jobs without sending any request
+
+    A job whose granularity can be derived from a finer job of the
+    same instrument, price and period is derived from it, see
+    `oandata.resample.Resampler`. Days cached as final are not
+    fetched. The rest is split by `planSplits`. A single step splits
+    its ranges into `split` sub-intervals if given, or among `workers`
+    but no more than needed for the number of pages. Several steps
+    are run by `workers` concurrently, each fetching a split at a
+    time, as done by `oandata.fetcher.fetchJobs`.
+
+    :param jobs: the jobs to plan
+    :param cache: the cache used when fetching
+    :param split: the number of splits of each range of a single step
+    :param workers: the number of workers
+    :param derive: whether jobs may be derived from others, which
+    requires output files and is not supported with checkpoints
+    :param skip_closed: whether closed windows are skipped, see `planSplits`
+    :param rate: the maximum number of requests per second, used for the estimate
+    :param latency: the seconds each request takes, used for the estimate
+    :type jobs: list of oandata.fetcher.Job
+    :type cache: oandata.cache.CandleCache
+    :type split: int
+    :type workers: int
+    :type derive: bool
+    :type skip_closed: bool
+    :type rate: float
+    :type latency: float
+    :rtype: Plan
+    """
+    from oandata.fetcher import Job # imported here, since the fetcher imports this module lazily
+
+    # step 1: deriving coarse granularities from fine ones, finest first
+    bases=[]
+    order=sorted(range(len(jobs)), key=lambda i: getGranularityInSec(jobs[i].granularity))
+    for i in order:
+        job=jobs[i]
+        base=next((b for b in bases if _attach(b[0], job)), None) if derive else None
+        if base is not None:
+            base[1].append(i)
+        else:
+            bases.append((Job(job.instrument, job.from_date, job.to_date, job.granularity, job.price, job.output, job.derive, job.ranges), [i]))
+    bases.sort(key=lambda b: b[1][0])
+
+    # step 2: splitting the ranges missing from the cache
+    splits_per_range=(split or workers) if len(bases) == 1 else 1
+    steps=[]
+    for job, indices in bases:
+        ranges=_missingRanges(job, cache)
+        splits=[interval for s,e in ranges
+                for interval in planSplits(s, e, job.granularity, splits_per_range, skip_closed, capped=split is None)]
+        steps.append(Step(job, indices, ranges, splits, countRequests(splits, job.granularity, skip_closed)))
+
+    unplanned=0
+    # the requests of running the jobs as given, split by `getSplits`
+    splits_per_range=(split or workers) if len(jobs) == 1 else 1
+    for job in jobs:
+        ranges=_missingRanges(job, cache)
+        splits=[interval for s,e in ranges for interval in getSplits(s, e, splits_per_range)]
+        unplanned+=countRequests(splits, job.granularity, skip_closed)
+
+    requests=sum(step.requests for step in steps)
+    return Plan(steps, len(jobs), requests, unplanned, estimateSeconds(requests, workers, rate, latency))
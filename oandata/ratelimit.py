@@ -0,0 +1,124 @@
+import threading, time, multiprocessing
+
+## Rate limiter for requests sent to a host
+#
+# It spaces out requests evenly so that at most `rate` requests per
+# second are sent. It is safe to share one limiter between threads.
+class RateLimiter:
+    def __init__(self, rate):
+        """create an instance of RateLimiter
+
+        :param rate: the maximum number of requests per second. A
+        non-positive rate disables limiting.
+        :type rate: float
+        """
+        self._interval=1.0 / rate if rate > 0 else 0.0
+        self._next=0.0
+        self._lock=threading.Lock()
+
+    def reserve(self):
+        """reserves the next slot for sending a request without waiting
+
+        :return: the seconds to wait before sending the request
+        :rtype: float
+        """
+        with self._lock:
+            now=time.monotonic()
+            wait=self._next - now
+            self._next=max(now, self._next) + self._interval
+        return max(0.0, wait)
+
+    def available(self):
+        """gets the seconds until the next slot is free without reserving it
+
+        :rtype: float
+        """
+        with self._lock:
+            return max(0.0, self._next - time.monotonic())
+
+    def acquire(self):
+        """blocks until sending the next request is allowed
+        """
+        wait=self.reserve()
+        if wait > 0:
+            time.sleep(wait)
+
+    def pause(self, delay):
+        """holds back all requests for `delay` seconds
+
+        It is used when the host asks for fewer requests, e.g. by
+        responding with too many requests (429).
+
+        :param delay: the delay in seconds
+        :type delay: float
+        """
+        with self._lock:
+            self._next=max(self._next, time.monotonic() + delay)
+
+## Rate limiter shared between processes
+#
+# It works like `RateLimiter`, but its state lives in shared memory,
+# so that processes created after it, e.g. the workers of a process
+# pool given it via their initializer, send at most `rate` requests
+# per second all together. The monotonic clock is system-wide, so the
+# slots reserved by all processes are on the same time line.
+class SharedRateLimiter(RateLimiter):
+    def __init__(self, rate, context=None):
+        """create an instance of SharedRateLimiter
+
+        :param rate: the maximum number of requests per second. A
+        non-positive rate disables limiting.
+        :param context: the multiprocessing context the processes are
+        created by, the default one if not given
+        :type rate: float
+        """
+        self._interval=1.0 / rate if rate > 0 else 0.0
+        self._shared=(context if context is not None else multiprocessing).Value('d', 0.0)
+
+    def reserve(self):
+        with self._shared.get_lock():
+            now=time.monotonic()
+            wait=self._shared.value - now
+            self._shared.value=max(now, self._shared.value) + self._interval
+        return max(0.0, wait)
+
+    def available(self):
+        with self._shared.get_lock():
+            return max(0.0, self._shared.value - time.monotonic())
+
+    def pause(self, delay):
+        with self._shared.get_lock():
+            self._shared.value=max(self._shared.value, time.monotonic() + delay)
+
+_limiters={}
+_limiters_lock=threading.Lock()
+
+def getRateLimiter(host, rate):
+    """gets the process-wide rate limiter of `host`
+
+    The limiter is created on the first call for a host. Later calls
+    return the same limiter, regardless of `rate`.
+
+    :param host: the host name requests are sent to, or the key of
+    another budget, e.g. of a token, see `oandata.factory.Factory.limiterKey`
+    :param rate: the maximum number of requests per second
+    :type host: str
+    :type rate: float
+    :return: the rate limiter of `host`
+    :rtype: RateLimiter
+    """
+    with _limiters_lock:
+        if host not in _limiters:
+            _limiters[host]=RateLimiter(rate)
+        return _limiters[host]
+
+def setRateLimiter(host, limiter):
+    """replaces the process-wide rate limiter of `host`
+
+    :param host: the host name requests are sent to
+    :param limiter: the rate limiter, e.g. one shared between processes
+    :type host: str
+    :type limiter: RateLimiter
+    """
+    with _limiters_lock:
+        _limiters[host]=limiter
@@ -0,0 +1,198 @@
+import numpy as np
+import pandas as pd
+
+from oandata.constants import GRANULARITY, getGranularityInSec, canResample
+from oandata.storage import castPrices
+
+## Alignment of candle sticks as done by OANDA
+#
+# Granularities of at most an hour are aligned to multiples of their
+# length in UTC. Longer ones are aligned to the start of the trading
+# day, which is at `DAILY_ALIGNMENT` o'clock in `ALIGNMENT_TIMEZONE`
+# (5pm New York time by default). Weekly candle sticks start on
+# `WEEKLY_ALIGNMENT` and monthly ones on the first trading day of the
+# month, i.e. the trading day starting on the evening before.
+
+DAILY_ALIGNMENT=17                     # the hour at which trading days start
+ALIGNMENT_TIMEZONE='America/New_York'  # the timezone of DAILY_ALIGNMENT
+WEEKLY_ALIGNMENT='Friday'              # the day on which trading weeks start
+
+WEEKDAYS=('Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday')
+NS_PER_SEC=10**9
+NS_PER_HOUR=3600 * NS_PER_SEC
+NS_PER_DAY=24 * NS_PER_HOUR
+
+# the fields of unprefixed price columns
+_FIELDS={'Open': 'o', 'Close': 'c', 'Low': 'l', 'High': 'h'}
+
+# granularities aligned to the start of the trading day
+DAILY_ALIGNED=('H2', 'H3', 'H4', 'H6', 'H8', 'H12', 'D', 'W', 'M')
+
+def bucketStarts(times, granularity, daily_alignment=DAILY_ALIGNMENT,
+                 alignment_timezone=ALIGNMENT_TIMEZONE, weekly_alignment=WEEKLY_ALIGNMENT):
+    """computes the start of the candle stick holding each time
+
+    :param times: the times in nanoseconds since epoch (UTC)
+    :param granularity: one of `GRANULARITY`
+    :param daily_alignment: the hour at which trading days start
+    :param alignment_timezone: the timezone of `daily_alignment`
+    :param weekly_alignment: the day on which trading weeks start, one of `WEEKDAYS`
+    :type times: numpy.ndarray of int64
+    :type granularity: str
+    :type daily_alignment: int
+    :type alignment_timezone: str
+    :type weekly_alignment: str
+    :return: the starts in nanoseconds since epoch (UTC)
+    :rtype: numpy.ndarray of int64
+    """
+    times=np.asarray(times, dtype=np.int64)
+    if granularity not in DAILY_ALIGNED:
+        length=getGranularityInSec(granularity) * NS_PER_SEC
+        return times // length * length
+
+    # the computation is done on wall clock times of the alignment
+    # timezone, shifted so that trading days start at midnight
+    wall=pd.DatetimeIndex(times.astype('M8[ns]')).tz_localize('UTC').tz_convert(alignment_timezone).tz_localize(None).as_unit('ns').asi8
+    offset=(24 - daily_alignment) * NS_PER_HOUR
+    shifted=wall + offset
+    day=shifted // NS_PER_DAY * NS_PER_DAY # the trading day, labelled by the day it ends on
+    if granularity == 'D':
+        start=day
+    elif granularity == 'W':
+        days=day // NS_PER_DAY
+        # trading weeks starting on `weekly_alignment` are labelled by the following day
+        first=(WEEKDAYS.index(weekly_alignment) + 1) % 7
+        start=(days - ((days + 3 - first) % 7)) * NS_PER_DAY # 1970-01-01 was on Thursday
+    elif granularity == 'M':
+        start=day.astype('M8[ns]').astype('M8[M]').astype('M8[ns]').astype(np.int64)
+    else:
+        length=getGranularityInSec(granularity) * NS_PER_SEC
+        start=day + (shifted - day) // length * length
+    start=start - offset
+
+    # wall clock times are converted back to UTC, only once per bucket
+    unique, inverse=np.unique(start, return_inverse=True)
+    utc=pd.DatetimeIndex(unique.astype('M8[ns]')).tz_localize(alignment_timezone, ambiguous=np.zeros(len(unique), dtype=bool),
+                                                             nonexistent='shift_forward').tz_convert('UTC').as_unit('ns').asi8
+    return utc[inverse]
+
+## Incremental aggregation of candle sticks into coarser ones
+#
+# Pages of fine candle sticks are fed in time order. The candle sticks
+# of the last coarse bucket are kept back until a later page shows it
+# is over, so that pages of any size can be aggregated with flat
+# memory. Coarse candle sticks are complete if all their fine candle
+# sticks are complete and cover them from start to end; the first
+# and last buckets of a period that only partially covers them are
+# marked incomplete.
+class Resampler:
+    def __init__(self, from_granularity, to_granularity, daily_alignment=DAILY_ALIGNMENT,
+                 alignment_timezone=ALIGNMENT_TIMEZONE, weekly_alignment=WEEKLY_ALIGNMENT):
+        """create an instance of Resampler
+
+        :param from_granularity: the granularity of fed candle sticks
+        :param to_granularity: the granularity of derived candle sticks
+        :param daily_alignment: the hour at which trading days start
+        :param alignment_timezone: the timezone of `daily_alignment`
+        :param weekly_alignment: the day on which trading weeks start
+        :type from_granularity: str
+        :type to_granularity: str
+        :type daily_alignment: int
+        :type alignment_timezone: str
+        :type weekly_alignment: str
+        :raise ValueError: if `to_granularity` cannot be derived from `from_granularity`
+        """
+        if not canResample(from_granularity, to_granularity):
+            raise ValueError('Granularity \'{}\' cannot be derived from \'{}\'.'.format(to_granularity, from_granularity))
+        if weekly_alignment not in WEEKDAYS:
+            raise ValueError('Given weekly alignment \'{}\' is not supported.'.format(weekly_alignment))
+        self.granularity=to_granularity
+        self._step=getGranularityInSec(from_granularity) * NS_PER_SEC
+        self._alignment=dict(daily_alignment=daily_alignment, alignment_timezone=alignment_timezone, weekly_alignment=weekly_alignment)
+        self._carry=None # the candle sticks of the last bucket
+        self._first=True # whether no candle stick was derived yet
+
+    def _buckets(self, times):
+        return bucketStarts(times, self.granularity, **self._alignment)
+
+    def _aggregate(self, df, keys, last_complete):
+        starts=np.concatenate(([0], np.flatnonzero(np.diff(keys)) + 1))
+        ends=np.concatenate((starts[1:], [len(keys)]))
+        columns={}
+        for column in df.columns:
+            values=df[column].to_numpy()
+            if column == 'Complete':
+                values=np.logical_and.reduceat(values, starts)
+                if self._first and self._buckets(df.index[:1].as_unit('ns').asi8 - self._step)[0] == keys[0]:
+                    values[0]=False # the bucket may start before the first candle stick
+                values[-1]&=last_complete
+            elif column == 'Volume':
+                values=np.add.reduceat(values, starts)
+            else:
+                # either Open, Close, Low and High or prefixed columns, e.g. bid_o
+                field=_FIELDS.get(column, column[-1])
+                if field == 'o':
+                    values=values[starts]
+                elif field == 'c':
+                    values=values[ends - 1]
+                elif field == 'l':
+                    values=np.minimum.reduceat(values, starts)
+                else:
+                    values=np.maximum.reduceat(values, starts)
+            columns[column]=values
+        self._first=False
+        return pd.DataFrame(columns, index=pd.to_datetime(keys[starts], unit='ns', utc=True))
+
+    def update(self, df):
+        """feeds a page of candle sticks
+
+        :param df: the candle sticks following those fed so far, as
+        returned by `Instrument.getCandles`
+        :type df: pandas.DataFrame
+        :return: the derived candle sticks whose buckets are over
+        :rtype: pandas.DataFrame
+        """
+        df=castPrices(df, None)
+        if self._carry is not None:
+            df=pd.concat([self._carry, df])
+        if len(df) == 0:
+            return pd.DataFrame()
+        keys=self._buckets(df.index.as_unit('ns').asi8)
+        boundaries=np.flatnonzero(np.diff(keys))
+        last=boundaries[-1] + 1 if len(boundaries) > 0 else 0
+        self._carry=df.iloc[last:]
+        if last == 0:
+            return pd.DataFrame()
+        return self._aggregate(df.iloc[:last], keys[:last], True)
+
+    def flush(self):
+        """derives the candle stick of the last bucket
+
+        :return: the last derived candle stick, it is complete only if
+        the fed candle sticks reach the end of its bucket
+        :rtype: pandas.DataFrame
+        """
+        df, self._carry=self._carry, None
+        if df is None or len(df) == 0:
+            return pd.DataFrame()
+        times=df.index.as_unit('ns').asi8
+        keys=self._buckets(times)
+        return self._aggregate(df, keys, self._buckets(times[-1:] + self._step)[0] != keys[-1])
+
+def resample(df, from_granularity, to_granularity, **kwargs):
+    """derives coarser candle sticks from finer ones
+
+    :param df: the candle sticks as returned by `Instrument.getCandles`
+    :param from_granularity: the granularity of `df`
+    :param to_granularity: the granularity of derived candle sticks
+    :param kwargs: the alignment, see `Resampler`
+    :type df: pandas.DataFrame
+    :type from_granularity: str
+    :type to_granularity: str
+    :return: the derived candle sticks, with the same columns as `df`
+    :rtype: pandas.DataFrame
+    :raise ValueError: if `to_granularity` cannot be derived from `from_granularity`
+    """
+    resampler=Resampler(from_granularity, to_granularity, **kwargs)
+    df_list=[page for page in (resampler.update(df), resampler.flush()) if len(page) > 0]
+    return pd.DataFrame() if len(df_list) == 0 else pd.concat(df_list)
@@ -0,0 +1,113 @@
+import random
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+import requests
+from v20.errors import ResponseUnexpectedStatus, V20Timeout, V20ConnectionError
+
+# HTTP statuses worth retrying: too many requests and server errors
+RETRYABLE_STATUS = (429, 500, 502, 503, 504)
+
+class FetchError(ValueError):
+    """raised when some ranges could not be fetched after retries
+
+    :ivar failed_ranges: the list of (start, end) pairs of
+    datetime.date, both inclusive, that were not fetched
+    :ivar data: the price data that was fetched, if any
+    """
+    def __init__(self, message, failed_ranges, data=None):
+        super().__init__(message)
+        self.failed_ranges=failed_ranges
+        self.data=data
+
+def statusOf(exp):
+    """gets the HTTP status of a failed response
+
+    :param exp: the exception raised by a request
+    :return: the status or None if `exp` does not come from a response
+    :rtype: int
+    """
+    if isinstance(exp, ResponseUnexpectedStatus):
+        try:
+            return int(exp.response.status)
+        except (TypeError, ValueError):
+            return None
+    return None
+
+def retryAfter(exp):
+    """gets the delay requested by the server via Retry-After header
+
+    :param exp: the exception raised by a request
+    :return: the delay in seconds or None if not given
+    :rtype: float
+    """
+    if not isinstance(exp, ResponseUnexpectedStatus):
+        return None
+    headers=getattr(exp.response, 'headers', None) or {}
+    value=headers.get('Retry-After')
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+def isRetryable(exp):
+    """checks if a request that failed with `exp` is worth retrying
+
+    Timeouts, connection errors, too many requests and server errors
+    are retryable. Other statuses, e.g. bad request for an invalid
+    instrument name or unauthorized, are fatal. Unknown exceptions
+    are retried.
+
+    :param exp: the exception raised by a request
+    :rtype: bool
+    """
+    if isinstance(exp, (V20Timeout, V20ConnectionError, requests.exceptions.RequestException)):
+        return True
+    status=statusOf(exp)
+    if status is not None:
+        return status in RETRYABLE_STATUS
+    return True
+
+## Retry policy with exponential backoff
+#
+# The delay before the n-th retry (n starting at 0) is drawn uniformly
+# from [d/2, d], where d = min(max_delay, base_delay * 2^n). A delay
+# requested by the server via Retry-After takes precedence.
+class RetryPolicy:
+    DEFAULT_BASE_DELAY=0.5 # the default delay in seconds before the first retry
+    DEFAULT_MAX_DELAY=30   # the default maximum delay in seconds
+
+    def __init__(self, base_delay=DEFAULT_BASE_DELAY, max_delay=DEFAULT_MAX_DELAY, jitter=True):
+        """create an instance of RetryPolicy
+
+        :param base_delay: the delay in seconds before the first retry
+        :param max_delay: the maximum delay in seconds
+        :param jitter: whether delays are randomized
+        :type base_delay: float
+        :type max_delay: float
+        :type jitter: bool
+        """
+        self._base_delay=base_delay
+        self._max_delay=max_delay
+        self._jitter=jitter
+
+    def delay(self, attempt, exp):
+        """computes the delay before retrying
+
+        :param attempt: the number of retries so far
+        :param exp: the exception the last attempt failed with
+        :type attempt: int
+        :return: the delay in seconds
+        :rtype: float
+        """
+        requested=retryAfter(exp)
+        if requested is not None:
+            return min(requested, self._max_delay)
+        d=min(self._max_delay, self._base_delay * 2 ** attempt)
+        return random.uniform(d / 2, d) if self._jitter else d
+
@@ -0,0 +1,249 @@
+import os
+import pandas as pd
+
+from oandata.constants import FORMATS, DTYPES
+from oandata.columnar import ColumnsWriter, readColumns, hasColumns
+
+# columns that are not prices
+NON_PRICE_COLUMNS = ('Volume', 'Complete')
+
+def _importPyarrow(fmt):
+    try:
+        import pyarrow, pyarrow.parquet, pyarrow.ipc
+    except ImportError:
+        raise ValueError('{} format requires pyarrow to be installed.'.format(fmt))
+    return pyarrow
+
+def formatOf(filename):
+    """guesses the format of `filename`
+
+    :param filename: the filename
+    :type filename: str
+    :return: 'npy' for directories, 'npy', 'parquet' or 'feather'
+    according to the extension, and 'csv' otherwise
+    :rtype: str
+    """
+    if os.path.isdir(filename):
+        return 'npy'
+    ext=os.path.splitext(filename)[1].lower()
+    if ext == '.npy':
+        return 'npy'
+    if ext == '.parquet':
+        return 'parquet'
+    if ext in ('.feather', '.arrow'):
+        return 'feather'
+    return 'csv'
+
+def castPrices(df, dtype):
+    """casts price columns of `df` to `dtype`
+
+    :param df: the price data
+    :param dtype: 'float32' or 'float64'. If None, only prices given
+    as strings, of object or string dtype, are converted to float64.
+    :type df: pandas.DataFrame
+    :type dtype: str
+    :rtype: pandas.DataFrame
+    """
+    columns=[c for c in df.columns if c not in NON_PRICE_COLUMNS]
+    if dtype is None:
+        columns=[c for c in columns if not pd.api.types.is_numeric_dtype(df[c].dtype)]
+        dtype='float64'
+    return df.astype({c: dtype for c in columns}) if len(columns) > 0 else df
+
+class CsvSink:
+    """appends price data to a csv file page by page
+    """
+    def __init__(self, filename, dtype=None, append=False):
+        """initialize an instance of CsvSink
+
+        :param filename: the csv filename, it is overwritten if it exists
+        :param dtype: if given, the dtype prices are converted to
+        :param append: if set, rows are appended to the file instead of
+        overwriting it, and the header is only written if it is empty
+        :type filename: str
+        :type dtype: str
+        :type append: bool
+        """
+        self._file=open(filename, 'a' if append else 'w', newline='')
+        self._header=self._file.tell() == 0
+        self._dtype=dtype
+
+    def write(self, df):
+        """appends `df` to the file
+
+        :type df: pandas.DataFrame
+        """
+        if self._dtype is not None:
+            df=castPrices(df, self._dtype)
+        df.to_csv(self._file, sep=',', header=self._header, index_label='Time')
+        self._file.flush()
+        self._header=False
+
+    def close(self):
+        self._file.close()
+
+class ParquetSink:
+    """appends price data to a parquet file page by page
+
+    Each page is written as a row group. It requires `pyarrow`.
+    """
+    def __init__(self, filename, dtype=None):
+        """initialize an instance of ParquetSink
+
+        :param filename: the parquet filename, it is overwritten if it exists
+        :param dtype: if given, the dtype prices are converted to
+        :type filename: str
+        :type dtype: str
+        """
+        self._pa=_importPyarrow('parquet')
+        self._filename=filename
+        self._dtype=dtype
+        self._writer=None
+
+    def _table(self, df):
+        return self._pa.Table.from_pandas(castPrices(df, self._dtype).rename_axis('Time'), preserve_index=True)
+
+    def write(self, df):
+        """appends `df` to the file
+
+        :type df: pandas.DataFrame
+        """
+        table=self._table(df)
+        if self._writer is None:
+            self._writer=self._pa.parquet.ParquetWriter(self._filename, table.schema)
+        self._writer.write_table(table)
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+
+class FeatherSink(ParquetSink):
+    """appends price data to a feather (Arrow IPC) file page by page
+
+    Each page is written as a record batch. It requires `pyarrow`.
+    """
+    def write(self, df):
+        """appends `df` to the file
+
+        :type df: pandas.DataFrame
+        """
+        table=self._table(df)
+        if self._writer is None:
+            self._writer=self._pa.ipc.new_file(self._filename, table.schema)
+        self._writer.write_table(table)
+
+class NpySink:
+    """appends price data to a directory of NumPy files page by page
+
+    See `oandata.columnar` for the layout.
+    """
+    def __init__(self, directory, dtype=None):
+        """initialize an instance of NpySink
+
+        :param directory: the output directory, a frame already stored in it is replaced
+        :param dtype: if given, the dtype prices are converted to
+        :type directory: str
+        :type dtype: str
+        """
+        self._writer=ColumnsWriter(directory)
+        self._dtype=dtype
+
+    def write(self, df):
+        """appends `df` to the directory
+
+        :type df: pandas.DataFrame
+        """
+        self._writer.append(castPrices(df, self._dtype))
+
+    def close(self):
+        self._writer.close()
+
+_SINKS = {
+    'csv': CsvSink,
+    'parquet': ParquetSink,
+    'feather': FeatherSink,
+    'npy': NpySink,
+}
+
+def createSink(filename, fmt=None, dtype=None):
+    """creates a sink appending price data to `filename`
+
+    :param filename: the output filename, or directory for npy format
+    :param fmt: one of `FORMATS`, guessed from `filename` if not given
+    :param dtype: one of `DTYPES`, the dtype prices are stored in. If
+    not given, prices are stored as they are fetched.
+    :type filename: str
+    :type fmt: str
+    :type dtype: str
+    :return: the sink, which has methods `write(df)` and `close()`
+    :raise ValueError: if the format or dtype is not supported
+    """
+    fmt=formatOf(filename) if fmt is None else fmt
+    if fmt not in FORMATS:
+        raise ValueError('Given format \'{}\' is not supported.'.format(fmt))
+    if dtype is not None and dtype not in DTYPES:
+        raise ValueError('Given dtype \'{}\' is not supported.'.format(dtype))
+    return _SINKS[fmt](filename, dtype=dtype)
+
+def mergePriceData(filename, df, fmt=None, dtype=None):
+    """merges price data into a file stored by a sink
+
+    The rows of `df` are merged with those stored in time order,
+    replacing stored rows of the same time, and the file is written
+    again. Files are written next to `filename` first and then moved,
+    so the stored data is kept if writing fails. If the file does not
+    exist, `df` is stored in it.
+
+    :param filename: the filename, or directory for npy format
+    :param df: the price data to merge
+    :param fmt: one of `FORMATS`, guessed from `filename` if not given
+    :param dtype: one of `DTYPES`, the dtype prices are stored in
+    :type filename: str
+    :type df: pandas.DataFrame
+    :type fmt: str
+    :type dtype: str
+    """
+    fmt=formatOf(filename) if fmt is None else fmt
+    if os.path.exists(filename) and (fmt != 'npy' or hasColumns(filename)):
+        # the data is copied, as npy files are mapped and rewritten
+        stored=loadPriceData(filename, fmt).copy().rename_axis(None)
+        df=pd.concat([stored, castPrices(df, None)])
+        df=df[~df.index.duplicated(keep='last')].sort_index(kind='stable')
+    target=filename if fmt == 'npy' else filename + '.merging'
+    sink=createSink(target, fmt=fmt, dtype=dtype)
+    try:
+        sink.write(df)
+    finally:
+        sink.close()
+    if target != filename:
+        os.replace(target, filename)
+
+def loadPriceData(filename, fmt=None):
+    """loads price data stored by a sink
+
+    Binary formats are memory mapped rather than read into buffers
+    first. The returned frame owns its data though; for zero-copy
+    access to the columns of npy format, use
+    `oandata.columnar.openColumns`.
+
+    :param filename: the filename, or directory for npy format
+    :param fmt: one of `FORMATS`, guessed from `filename` if not given
+    :type filename: str
+    :type fmt: str
+    :return: price data indexed by time
+    :rtype: pandas.DataFrame
+    """
+    fmt=formatOf(filename) if fmt is None else fmt
+    if fmt == 'npy':
+        return readColumns(filename)
+    if fmt == 'csv':
+        df=pd.read_csv(filename, index_col='Time', float_precision='round_trip')
+        df.index=pd.to_datetime(df.index, format='ISO8601')
+        return df
+    pa=_importPyarrow(fmt)
+    if fmt == 'parquet':
+        return pd.read_parquet(filename, memory_map=True)
+    if fmt == 'feather':
+        with pa.memory_map(filename) as source:
+            return pa.ipc.open_file(source).read_all().to_pandas()
+    raise ValueError('Given format \'{}\' is not supported.'.format(fmt))
@@ -0,0 +1,206 @@
+import json, os
+from datetime import date, datetime, timedelta
+import numpy as np
+import pandas as pd
+
+from oandata.storage import castPrices
+from oandata.columnar import writeColumns, appendColumns, openColumns, hasColumns, INDEX_FILE
+
+COVERAGE_FILE='coverage.json'
+
+# the dtype of the time index of stored frames
+UTC_NS=pd.DatetimeTZDtype('ns', 'UTC')
+
+def _dayToTimestamp(d):
+    return pd.Timestamp(d.year, d.month, d.day, tz='UTC')
+
+def _toNanoseconds(t):
+    """converts a date, datetime or timestamp to int64 nanoseconds since epoch
+
+    Naive times are taken as UTC.
+    """
+    if isinstance(t, date) and not isinstance(t, datetime):
+        t=_dayToTimestamp(t)
+    t=pd.Timestamp(t)
+    if t.tzinfo is None:
+        t=t.tz_localize('UTC')
+    return t.as_unit('ns').value
+
+def _mergeIntervals(intervals):
+    """merges overlapping or adjacent day intervals
+
+    :param intervals: a list of (start, end) pairs of datetime.date, both inclusive
+    :return: the sorted list of merged intervals
+    :rtype: list
+    """
+    merged=[]
+    for s, e in sorted(intervals):
+        if merged and s <= merged[-1][1] + timedelta(days=1):
+            merged[-1]=(merged[-1][0], max(merged[-1][1], e))
+        else:
+            merged.append((s, e))
+    return merged
+
+## Time-indexed store of candle sticks
+#
+# Candle sticks are stored per (instrument, granularity, price) in a
+# directory of columnar files (see `oandata.columnar`), sorted by
+# time, together with the days the store covers. The columns are
+# memory mapped once and kept open, and a range is answered by binary
+# search over the int64 time index: the returned frame is a view on
+# the mapped files, so repeated reads of small windows neither parse
+# nor copy anything. A directory filled by `oandata.cache.CandleCache`
+# is a store as well.
+class CandleStore:
+    def __init__(self, root):
+        """create an instance of CandleStore
+
+        :param root: the directory in which candle sticks are stored
+        :type root: str
+        """
+        self._root=root
+        self._opened={} # (instrument, granularity, price) -> (file identity, index, columns)
+
+    def _path(self, instrument, granularity, price):
+        return os.path.join(self._root, instrument, granularity, price)
+
+    def coverage(self, instrument, granularity, price):
+        """gets the days covered by the store
+
+        :return: sorted list of disjoint (start, end) pairs of datetime.date, both inclusive
+        :rtype: list
+        """
+        path=os.path.join(self._path(instrument, granularity, price), COVERAGE_FILE)
+        if not os.path.isfile(path):
+            return []
+        with open(path) as f:
+            return [(date.fromordinal(s), date.fromordinal(e)) for s, e in json.load(f)]
+
+    def _setCoverage(self, instrument, granularity, price, intervals):
+        path=os.path.join(self._path(instrument, granularity, price), COVERAGE_FILE)
+        with open(path, 'w') as f:
+            json.dump([(s.toordinal(), e.toordinal()) for s, e in intervals], f)
+
+    def _cover(self, instrument, granularity, price, from_date, to_date):
+        coverage=self.coverage(instrument, granularity, price) + [(from_date, to_date)]
+        self._setCoverage(instrument, granularity, price, _mergeIntervals(coverage))
+
+    def covers(self, instrument, granularity, price, from_date, to_date):
+        """checks if all days of [from_date, to_date] are covered by the store
+
+        :type from_date: datetime.date
+        :type to_date: datetime.date
+        :rtype: bool
+        """
+        return any(s <= from_date and to_date <= e for s, e in self.coverage(instrument, granularity, price))
+
+    def open(self, instrument, granularity, price):
+        """memory maps the stored columns
+
+        The maps are kept open and reused until the files are
+        replaced, e.g. by `write`.
+
+        :return: the time index as sorted int64 nanoseconds since
+        epoch (UTC) and a dictionary mapping each column name to its
+        values, see `oandata.columnar.openColumns`, or None if nothing
+        is stored
+        :rtype: tuple
+        """
+        key=(instrument, granularity, price)
+        path=self._path(instrument, granularity, price)
+        if not hasColumns(path):
+            self._opened.pop(key, None)
+            return None
+        # the columnar files are replaced rather than rewritten, so a
+        # new inode tells that the maps are stale
+        st=os.stat(os.path.join(path, INDEX_FILE))
+        identity=(st.st_ino, st.st_mtime_ns, st.st_size)
+        opened=self._opened.get(key)
+        if opened is None or opened[0] != identity:
+            opened=(identity,) + openColumns(path)
+            self._opened[key]=opened
+        return opened[1], opened[2]
+
+    def _frame(self, instrument, granularity, price, start, end):
+        """returns the rows whose times are within [start, end) nanoseconds, or None
+        """
+        opened=self.open(instrument, granularity, price)
+        if opened is None:
+            return None
+        index, columns=opened
+        lo=index.searchsorted(start, side='left') if start is not None else 0
+        hi=index.searchsorted(end, side='left') if end is not None else len(index)
+        times=pd.DatetimeIndex(np.asarray(index[lo:hi]).view('M8[ns]'), copy=False).view(UTC_NS)
+        return pd.DataFrame({c: values[lo:hi] for c, values in columns.items()}, index=times, columns=list(columns), copy=False)
+
+    def slice(self, instrument, granularity, price, start, end):
+        """returns the candle sticks whose times are within [start, end]
+
+        The returned frame is a read-only view on the stored files.
+
+        :param start: the first time, naive times are taken as UTC
+        :param end: the last time, naive times are taken as UTC
+        :type start: datetime.datetime or pandas.Timestamp
+        :type end: datetime.datetime or pandas.Timestamp
+        :return: the stored candle sticks, or None if nothing is stored
+        :rtype: pandas.DataFrame
+        """
+        return self._frame(instrument, granularity, price, _toNanoseconds(start), _toNanoseconds(end) + 1)
+
+    def load(self, instrument, granularity, price, from_date, to_date):
+        """returns the candle sticks on the days within [from_date, to_date]
+
+        The returned frame is a read-only view on the stored files.
+
+        :type from_date: datetime.date
+        :type to_date: datetime.date
+        :return: the stored candle sticks, or None if nothing is stored
+        :rtype: pandas.DataFrame
+        """
+        return self._frame(instrument, granularity, price, _toNanoseconds(from_date), _toNanoseconds(to_date + timedelta(days=1)))
+
+    def _replace(self, instrument, granularity, price, from_date, to_date, df):
+        """replaces the stored candle sticks on the days within [from_date, to_date] by `df`
+
+        If nothing is stored from `from_date` on, e.g. when new days
+        are fetched, `df` is appended to the stored files, see
+        `oandata.columnar.appendColumns`. Otherwise they are written again.
+        """
+        start=_toNanoseconds(from_date)
+        end=_toNanoseconds(to_date + timedelta(days=1))
+        path=self._path(instrument, granularity, price)
+        opened=self.open(instrument, granularity, price)
+        if opened is not None and (len(opened[0]) == 0 or opened[0][-1] < start):
+            if len(df) == 0 or appendColumns(df, path):
+                return
+        frames=[self._frame(instrument, granularity, price, None, start),
+                df,
+                self._frame(instrument, granularity, price, end, None)]
+        frames=[f for f in frames if f is not None]
+        if any(len(f) > 0 for f in frames):
+            writeColumns(pd.concat([f for f in frames if len(f) > 0]), path)
+        elif hasColumns(path):
+            # the stored candle sticks were all within the range
+            writeColumns(frames[0], path)
+        else:
+            os.makedirs(path, exist_ok=True)
+
+    def write(self, instrument, granularity, price, from_date, to_date, df):
+        """stores candle sticks of the days within [from_date, to_date]
+
+        Stored candle sticks within the range are replaced by `df`,
+        and the days of the range are marked covered.
+
+        :param from_date: the first day of the range
+        :param to_date: the last day of the range
+        :param df: the candle sticks of the range, possibly empty,
+        indexed by time. Decimal numbers given as strings are stored
+        as float.
+        :type from_date: datetime.date
+        :type to_date: datetime.date
+        :type df: pandas.DataFrame
+        """
+        if len(df) > 0:
+            df=castPrices(df, None).sort_index()
+        self._replace(instrument, granularity, price, from_date, to_date, df)
+        self._cover(instrument, granularity, price, from_date, to_date)
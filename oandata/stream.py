@@ -0,0 +1,318 @@
+import logging, threading
+from datetime import datetime, timezone
+import numpy as np
+import pandas as pd
+
+from oandata.instrument import GRANULARITY, getGranularityInSec
+from oandata.resample import bucketStarts, DAILY_ALIGNED, DAILY_ALIGNMENT, ALIGNMENT_TIMEZONE, WEEKLY_ALIGNMENT
+
+NS_PER_SEC=10**9
+NS_PER_HOUR=3600 * NS_PER_SEC
+
+def parseTime(t):
+    """converts a RFC3339 time given by v20 to nanoseconds since epoch
+
+    :param t: the time, e.g. '2020-01-01T00:00:05.123456789Z'
+    :type t: str
+    :rtype: int
+    """
+    seconds=int(datetime.strptime(t[:19], '%Y-%m-%dT%H:%M:%S').replace(tzinfo=timezone.utc).timestamp())
+    fraction=t[20:-1] if len(t) > 20 and t[19] == '.' else ''
+    return seconds * NS_PER_SEC + int(fraction.ljust(9, '0')[:9] or 0)
+
+def barStart(t, granularity, daily_alignment=DAILY_ALIGNMENT,
+             alignment_timezone=ALIGNMENT_TIMEZONE, weekly_alignment=WEEKLY_ALIGNMENT):
+    """computes the start of the bar holding time `t`
+
+    Bars are aligned like the candle sticks of OANDA and those derived
+    by `oandata.resample.bucketStarts`, i.e. bars of granularities
+    from H2 on start with trading days at `daily_alignment` o'clock in
+    `alignment_timezone` and weekly bars on `weekly_alignment`.
+
+    :param t: the time in nanoseconds since epoch
+    :param granularity: one of `GRANULARITY`
+    :param daily_alignment: the hour at which trading days start
+    :param alignment_timezone: the timezone of `daily_alignment`
+    :param weekly_alignment: the day on which trading weeks start
+    :type t: int
+    :type granularity: str
+    :type daily_alignment: int
+    :type alignment_timezone: str
+    :type weekly_alignment: str
+    :return: the start of the bar in nanoseconds since epoch
+    :rtype: int
+    """
+    if granularity not in DAILY_ALIGNED:
+        length=getGranularityInSec(granularity) * NS_PER_SEC
+        return t // length * length
+    return int(bucketStarts(np.array([t], dtype=np.int64), granularity, daily_alignment,
+                            alignment_timezone, weekly_alignment)[0])
+
+## Ring buffer of ticks
+#
+# It keeps the last `capacity` ticks in preallocated arrays, so
+# appending a tick never allocates memory.
+class TickBuffer:
+    def __init__(self, capacity):
+        """create an instance of TickBuffer
+
+        :param capacity: the maximum number of ticks kept
+        :type capacity: positive int
+        """
+        self._time=np.zeros(capacity, dtype=np.int64)
+        self._bid=np.zeros(capacity, dtype=np.float64)
+        self._ask=np.zeros(capacity, dtype=np.float64)
+        self._capacity=capacity
+        self._count=0 # the number of ticks appended so far
+
+    def __len__(self):
+        return min(self._count, self._capacity)
+
+    def append(self, t, bid, ask):
+        """appends a tick, overwriting the oldest one if the buffer is full
+
+        :param t: the time in nanoseconds since epoch
+        :param bid: the bid price
+        :param ask: the ask price
+        """
+        i=self._count % self._capacity
+        self._time[i]=t
+        self._bid[i]=bid
+        self._ask[i]=ask
+        self._count+=1
+
+    def latest(self):
+        """gets the last tick
+
+        :return: a tuple of time, bid and ask or None if the buffer is empty
+        :rtype: tuple
+        """
+        if self._count == 0:
+            return None
+        i=(self._count - 1) % self._capacity
+        return int(self._time[i]), float(self._bid[i]), float(self._ask[i])
+
+    def toDataFrame(self):
+        """copies the kept ticks into a dataframe in time order
+
+        :return: a dataframe with columns Bid and Ask indexed by time
+        :rtype: pandas.DataFrame
+        """
+        n=len(self)
+        order=(np.arange(n) + self._count - n) % self._capacity
+        return pd.DataFrame({'Bid': self._bid[order], 'Ask': self._ask[order]},
+                            index=pd.to_datetime(self._time[order], unit='ns', utc=True))
+
+## Incremental aggregation of ticks into bars
+#
+# Ticks are rolled into the current bar as they arrive. When a tick
+# falls into a later bar, the current bar is complete and stored in a
+# ring buffer of the last `capacity` bars. Volume is the number of
+# ticks, like the volume of OANDA candle sticks. Bars are aligned by
+# `barStart`; bars aligned to trading days always start on the hour,
+# so their start is computed once per hour.
+class BarAggregator:
+    def __init__(self, granularity, price='M', capacity=1024, daily_alignment=DAILY_ALIGNMENT,
+                 alignment_timezone=ALIGNMENT_TIMEZONE, weekly_alignment=WEEKLY_ALIGNMENT):
+        """create an instance of BarAggregator
+
+        :param granularity: the granularity of bars, one of `GRANULARITY`
+        :param price: the price bars are built from, 'B' for bid, 'A' for ask or 'M' for mid
+        :param capacity: the maximum number of complete bars kept
+        :param daily_alignment: the hour at which trading days start
+        :param alignment_timezone: the timezone of `daily_alignment`
+        :param weekly_alignment: the day on which trading weeks start
+        :type granularity: str
+        :type price: str
+        :type capacity: positive int
+        :type daily_alignment: int
+        :type alignment_timezone: str
+        :type weekly_alignment: str
+        :raise ValueError: if granularity or price is not valid
+        """
+        if granularity not in GRANULARITY:
+            raise ValueError('Given granularity \'{}\' is not supported.'.format(granularity))
+        if price not in ('B', 'A', 'M'):
+            raise ValueError('Given price type \'{}\' is not supported.'.format(price))
+        self.granularity=granularity
+        self._price=price
+        self._bars=np.zeros((capacity, 4), dtype=np.float64) # open, close, low, high
+        self._times=np.zeros(capacity, dtype=np.int64)
+        self._volumes=np.zeros(capacity, dtype=np.int64)
+        self._capacity=capacity
+        self._count=0 # the number of complete bars so far
+        self._start=None # the start of the current bar
+        self._current=None # [open, close, low, high, volume] of the current bar
+        self._alignment=(daily_alignment, alignment_timezone, weekly_alignment)
+        self._hour=None # the hour of the last time aligned to trading days
+        self._hour_start=None # the start of the bar holding that hour
+
+    def _barStart(self, t):
+        if self.granularity not in DAILY_ALIGNED:
+            return barStart(t, self.granularity)
+        hour=t // NS_PER_HOUR
+        if hour != self._hour:
+            self._hour=hour
+            self._hour_start=barStart(t, self.granularity, *self._alignment)
+        return self._hour_start
+
+    def _close(self):
+        i=self._count % self._capacity
+        self._times[i]=self._start
+        self._bars[i]=self._current[:4]
+        self._volumes[i]=self._current[4]
+        self._count+=1
+        self._start=None
+        self._current=None
+
+    def advance(self, t):
+        """completes the current bar if time `t` is past its end
+
+        It is used when no tick arrives, e.g. on heartbeats.
+
+        :param t: the time in nanoseconds since epoch
+        :type t: int
+        """
+        if self._start is not None and self._barStart(t) > self._start:
+            self._close()
+
+    def update(self, t, bid, ask):
+        """rolls a tick into the bars
+
+        :param t: the time in nanoseconds since epoch
+        :param bid: the bid price
+        :param ask: the ask price
+        """
+        p=bid if self._price == 'B' else ask if self._price == 'A' else (bid + ask) / 2
+        start=self._barStart(t)
+        if self._start is not None and start > self._start:
+            self._close()
+        if self._start is None:
+            self._start=start
+            self._current=[p, p, p, p, 1]
+        else:
+            current=self._current
+            current[1]=p
+            if p < current[2]:
+                current[2]=p
+            if p > current[3]:
+                current[3]=p
+            current[4]+=1
+
+    def latest(self):
+        """gets the current, i.e. incomplete, bar
+
+        :return: a dictionary with keys Time, Open, Close, Low, High,
+        Volume and Complete, or None if no tick arrived since the last
+        complete bar
+        :rtype: dict
+        """
+        if self._start is None:
+            return None
+        o, c, l, h, v=self._current
+        return {'Time': pd.Timestamp(self._start, unit='ns', tz='UTC'), 'Open': o, 'Close': c, 'Low': l, 'High': h, 'Volume': v, 'Complete': False}
+
+    def toDataFrame(self, include_current=True):
+        """copies the kept bars into a dataframe in time order
+
+        The frame has the same columns as the one returned by
+        `Instrument.getCandles`.
+
+        :param include_current: whether the current bar is included
+        :type include_current: bool
+        :rtype: pandas.DataFrame
+        """
+        n=min(self._count, self._capacity)
+        order=(np.arange(n) + self._count - n) % self._capacity
+        times=self._times[order]
+        bars=self._bars[order]
+        volumes=self._volumes[order]
+        complete=np.ones(n, dtype=bool)
+        if include_current and self._start is not None:
+            times=np.append(times, self._start)
+            bars=np.vstack([bars, self._current[:4]])
+            volumes=np.append(volumes, self._current[4])
+            complete=np.append(complete, False)
+        return pd.DataFrame({'Open': bars[:, 0], 'Close': bars[:, 1], 'Low': bars[:, 2], 'High': bars[:, 3],
+                             'Volume': volumes, 'Complete': complete},
+                            index=pd.to_datetime(times, unit='ns', utc=True))
+
+## Client of the v20 pricing stream
+#
+# It consumes the pricing stream of some instruments, keeps their
+# last ticks in ring buffers and rolls them into bars of the given
+# granularities on the fly.
+class PriceStream:
+    def __init__(self, context, account_id, instruments, granularities=(), price='M', capacity=100000):
+        """create an instance of PriceStream
+
+        :param context: the v20 context of the streaming host, see `Factory.createStreamContext`
+        :param account_id: the account whose prices are streamed
+        :param instruments: the names of instruments
+        :param granularities: the granularities of bars built for each instrument
+        :param price: the price bars are built from, 'B', 'A' or 'M'
+        :param capacity: the number of ticks and bars kept per instrument and granularity
+        :type context: v20.Context
+        :type account_id: str
+        :type instruments: list of str
+        :type granularities: list of str
+        :type price: str
+        :type capacity: int
+        """
+        self._context=context
+        self._account_id=account_id
+        self._instruments=list(instruments)
+        self.ticks={instrument: TickBuffer(capacity) for instrument in self._instruments}
+        self.bars={instrument: {g: BarAggregator(g, price, capacity) for g in granularities} for instrument in self._instruments}
+        self._stop=threading.Event()
+
+    def latestBar(self, instrument, granularity):
+        """gets the current bar of an instrument in O(1)
+
+        :rtype: dict, see `BarAggregator.latest`
+        """
+        return self.bars[instrument][granularity].latest()
+
+    def onPrice(self, instrument, t, bid, ask):
+        """processes a tick
+
+        :param instrument: the name of instrument
+        :param t: the time in nanoseconds since epoch
+        :param bid: the best bid price
+        :param ask: the best ask price
+        """
+        self.ticks[instrument].append(t, bid, ask)
+        for aggregator in self.bars[instrument].values():
+            aggregator.update(t, bid, ask)
+
+    def onHeartbeat(self, t):
+        """processes a heartbeat, completing bars whose time is over
+
+        :param t: the time in nanoseconds since epoch
+        """
+        for aggregators in self.bars.values():
+            for aggregator in aggregators.values():
+                aggregator.advance(t)
+
+    def stop(self):
+        """stops `run` after the next message
+        """
+        self._stop.set()
+
+    def run(self):
+        """consumes the stream until it ends or `stop` is called
+
+        :raise: the v20 errors raised if the stream cannot be opened or breaks
+        """
+        resp=self._context.pricing.stream(self._account_id, instruments=','.join(self._instruments))
+        if str(resp.status) != '200':
+            raise ValueError('Opening pricing stream failed with status {}'.format(resp.status))
+        for msg_type, msg in resp.parts():
+            if msg_type == 'pricing.ClientPrice':
+                if msg.instrument in self.ticks and msg.bids and msg.asks:
+                    self.onPrice(msg.instrument, parseTime(msg.time), float(msg.bids[0].price), float(msg.asks[0].price))
+            elif msg_type == 'pricing.PricingHeartbeat':
+                self.onHeartbeat(parseTime(msg.time))
+            if self._stop.is_set():
+                break
+        logging.info('Pricing stream ended')
@@ -22,6 +22,8 @@ setup(name='oandata',
       license='MIT',
       packages=['oandata'],
       install_requires=['v20', 'pandas'],
-      entry_points={'console_scripts': ['fetch_oandata=oandata.fetcher:main']},
+      entry_points={'console_scripts': ['fetch_oandata=oandata.fetcher:main',
+                                        'fetch_oandata_batch=oandata.batch:main',
+                                        'fetch_oandata_backfill=oandata.backfill:main']},
       include_package_data=True,
       zip_safe=False)
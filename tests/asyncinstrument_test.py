@@ -0,0 +1,171 @@
+import unittest, asyncio, time
+from context import instrument as ins
+from context import asyncinstrument as ains
+from context import retry
+from mock_server import MockServer
+
+class AsyncInstrumentTest(unittest.TestCase):
+    def testGetCandles(self):
+        with MockServer() as server:
+            expected=ins.Instrument.fromConfigDict(server.config()).getCandles('EUR_USD', '2020-01-01', '2020-01-03', granularity='M1', price='BA')
+
+            async def fetch(workers):
+                async with ains.AsyncInstrument.fromConfigDict(server.config()) as instrument:
+                    return await instrument.getCandles('EUR_USD', '2020-01-01', '2020-01-03', granularity='M1', price='BA', workers=workers)
+
+            for workers in (1, 3):
+                df=asyncio.run(fetch(workers))
+                self.assertTrue(df.equals(expected))
+                self.assertEqual(df.to_csv(), expected.to_csv())
+
+    def testInvalidArguments(self):
+        instrument=ains.AsyncInstrument(ains.AsyncClient('localhost', 'x'))
+        with self.assertRaises(ValueError):
+            instrument.iterCandles('EUR_USD', '2020-01-02', '2020-01-01')
+        with self.assertRaises(ValueError):
+            instrument.iterCandles('EUR_USD', '2020-01-01', '2020-01-02', granularity='X')
+
+    def testConcurrency(self):
+        # the splits wait for the latency of the server at the same time
+        with MockServer(latency=0.1) as server:
+            async def fetch(workers):
+                async with ains.AsyncInstrument.fromConfigDict(server.config()) as instrument:
+                    start=time.perf_counter()
+                    df=await instrument.getCandles('EUR_USD', '2020-01-01', '2020-01-16', granularity='H1', split=16, workers=workers)
+                    return df, time.perf_counter() - start
+            serial, serial_seconds=asyncio.run(fetch(1))
+            concurrent, concurrent_seconds=asyncio.run(fetch(8))
+            self.assertTrue(concurrent.equals(serial))
+            self.assertLess(concurrent_seconds, serial_seconds / 2)
+
+    def testCancellation(self):
+        with MockServer(latency=0.2) as server:
+            async def fetch():
+                async with ains.AsyncInstrument.fromConfigDict(server.config()) as instrument:
+                    task=asyncio.ensure_future(instrument.getCandles('EUR_USD', '2020-01-01', '2020-01-20', granularity='S5', workers=4))
+                    await asyncio.sleep(0.3)
+                    task.cancel()
+                    with self.assertRaises(asyncio.CancelledError):
+                        await task
+            asyncio.run(fetch())
+            sent=len(server.requests)
+            time.sleep(0.5)
+            # no request is sent once cancelled
+            self.assertEqual(len(server.requests), sent)
+            self.assertLess(sent, 20)
+
+    def testRetry(self):
+        with MockServer(error_rate=0.3, throttle_rate=0.1, retry_after=0.01, seed=1) as server:
+            expected=ins.Instrument.fromConfigDict(server.config()).getCandles('EUR_USD', '2020-01-01', '2020-01-02', granularity='M5', retry=20)
+            async def fetch():
+                policy=retry.RetryPolicy(base_delay=0.01)
+                async with ains.AsyncInstrument.fromConfigDict(server.config(), retry_policy=policy) as instrument:
+                    return await instrument.getCandles('EUR_USD', '2020-01-01', '2020-01-02', granularity='M5', retry=20, workers=2)
+            df=asyncio.run(fetch())
+            self.assertTrue(df.equals(expected))
+            self.assertGreater(server.errors + server.throttled, 0)
+
+    def testFatalError(self):
+        with MockServer() as server:
+            async def fetch():
+                async with ains.AsyncInstrument.fromConfigDict(server.config()) as instrument:
+                    # a wrong path is answered with 404, which is not retried
+                    await instrument.getCandles('EUR/USD', '2020-01-01', '2020-01-02', granularity='H1', workers=2)
+            with self.assertRaises(ins.ResponseUnexpectedStatus):
+                asyncio.run(fetch())
+            self.assertEqual(len(server.requests), 0)
+
+    def _serve(self, handle, test):
+        # runs `test` with a client of a raw server answering each connection with `handle`
+        connections=[]
+        async def serve(reader, writer):
+            connections.append(writer)
+            try:
+                await handle(reader, writer)
+            finally:
+                writer.close()
+        async def run():
+            server=await asyncio.start_server(serve, '127.0.0.1', 0)
+            async with server:
+                client=ains.AsyncClient('127.0.0.1', 'x', port=server.sockets[0].getsockname()[1], ssl=False, poll_timeout=0.3)
+                try:
+                    await test(client)
+                finally:
+                    await client.close()
+        asyncio.run(run())
+        return connections
+
+    def testReadTimeout(self):
+        body=b'{"candles": []}' * 100
+        async def slow(reader, writer):
+            # the body arrives steadily but takes longer than the timeout in total
+            await reader.readuntil(b'\r\n\r\n')
+            writer.write('HTTP/1.1 200 OK\r\nContent-Length: {}\r\n\r\n'.format(len(body)).encode())
+            for i in range(0, len(body), 300):
+                writer.write(body[i:i + 300])
+                await writer.drain()
+                await asyncio.sleep(0.1)
+        async def test(client):
+            response=await client.get('/v3/instruments/EUR_USD/candles', {})
+            self.assertEqual(response.raw_body, body.decode())
+        self._serve(slow, test)
+
+        async def stalled(reader, writer):
+            await reader.readuntil(b'\r\n\r\n')
+            writer.write(b'HTTP/1.1 200 OK\r\nContent-Length: 10\r\n\r\n{')
+            await asyncio.sleep(1)
+        async def test(client):
+            with self.assertRaises(ains.V20Timeout):
+                await client.get('/v3/instruments/EUR_USD/candles', {})
+        self._serve(stalled, test)
+
+    def testResponses(self):
+        # responses a tolerant HTTP/1.1 client reads
+        responses=[
+            # no reason phrase
+            b'HTTP/1.1 200\r\nContent-Length: 2\r\n\r\n{}',
+            # interim responses before the final one
+            b'HTTP/1.1 100 Continue\r\n\r\nHTTP/1.1 103 Early Hints\r\nLink: </a>\r\n\r\nHTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\n{}',
+            # a chunked body with trailers
+            b'HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n1;ext=1\r\n{\r\n1\r\n}\r\n0\r\nChecksum: x\r\nOther: y\r\n\r\n',
+            ]
+        async def serve(reader, writer):
+            for response in responses:
+                await reader.readuntil(b'\r\n\r\n')
+                writer.write(response)
+                await writer.drain()
+            await reader.read()
+        async def test(client):
+            for _ in responses:
+                response=await client.get('/v3/instruments/EUR_USD/candles', {})
+                self.assertEqual((response.status, response.raw_body), (200, '{}'))
+        # all responses are read on the same connection, so none is left partially read
+        self.assertEqual(len(self._serve(serve, test)), 1)
+
+        async def invalid(reader, writer):
+            await reader.readuntil(b'\r\n\r\n')
+            writer.write(b'garbage\r\n\r\n')
+            await writer.drain()
+        async def test(client):
+            with self.assertRaises(ains.V20ConnectionError):
+                await client.get('/v3/instruments/EUR_USD/candles', {})
+        self._serve(invalid, test)
+
+    def testClosedConnection(self):
+        async def once(reader, writer):
+            # answers a single request, then closes the kept-alive connection
+            await reader.readuntil(b'\r\n\r\n')
+            writer.write(b'HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\n{}')
+            await writer.drain()
+        async def test(client):
+            await client.get('/v3/instruments/EUR_USD/candles', {})
+            await asyncio.sleep(0.1)
+            start=time.perf_counter()
+            response=await client.get('/v3/instruments/EUR_USD/candles', {})
+            self.assertEqual(response.status, 200)
+            self.assertLess(time.perf_counter() - start, 0.2)
+        # the second request goes through a new connection
+        self.assertEqual(len(self._serve(once, test)), 2)
+
+if __name__ == '__main__':
+    unittest.main()
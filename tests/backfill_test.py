@@ -0,0 +1,70 @@
+import unittest, os, json, tempfile
+import multiprocessing
+from datetime import date
+import pandas as pd
+from context import instrument as ins, backfill, fetcher, storage, retry
+from context import ratelimit
+from mock_server import MockServer
+
+def _reserve(limiter, n):
+    return [limiter.reserve() for _ in range(n)]
+
+class BackfillTest(unittest.TestCase):
+    def testGetShards(self):
+        jobs=[fetcher.Job('EUR_USD', date(2020, 1, 1), date(2020, 1, 5), 'M1', 'M', None),
+              fetcher.Job('GBP_USD', date(2020, 1, 1), date(2020, 1, 1), 'H1', 'BA', None)]
+        shards=backfill.getShards(jobs, 'csv', shard_days=2)
+        self.assertEqual([(s.instrument, s.start, s.end) for s in shards],
+                         [('EUR_USD', date(2020, 1, 1), date(2020, 1, 2)), ('EUR_USD', date(2020, 1, 3), date(2020, 1, 4)),
+                          ('EUR_USD', date(2020, 1, 5), date(2020, 1, 5)), ('GBP_USD', date(2020, 1, 1), date(2020, 1, 1))])
+        self.assertEqual(shards[0].filename, 'EUR_USD_M1_M_2020-01-01_2020-01-02.csv')
+        self.assertEqual(backfill.getShards(jobs, 'npy')[-1].filename, 'GBP_USD_H1_BA_2020-01-01_2020-01-01')
+
+    def testSharedRateLimiter(self):
+        # slots reserved in another process are taken into account
+        limiter=ratelimit.SharedRateLimiter(10)
+        process=multiprocessing.Process(target=_reserve, args=(limiter, 5))
+        process.start()
+        process.join()
+        self.assertGreater(limiter.reserve(), 0.3)
+
+    def testBackfill(self):
+        jobs=[fetcher.Job('EUR_USD', date(2020, 1, 1), date(2020, 1, 4), 'M1', 'M', None),
+              fetcher.Job('GBP_USD', date(2020, 1, 1), date(2020, 1, 2), 'M5', 'BA', None)]
+        with MockServer() as server, tempfile.TemporaryDirectory() as d:
+            index=backfill.backfill(server.config(), jobs, d, processes=2, shard_days=2)
+            self.assertEqual(len(index['shards']), 3)
+            self.assertEqual(index['failed'], [])
+            with open(os.path.join(d, backfill.INDEX)) as f:
+                self.assertEqual(json.load(f), index)
+            self.assertEqual(sorted(os.listdir(d)), sorted([backfill.INDEX] + [e['filename'] for e in index['shards']]))
+
+            instrument=ins.Instrument.fromConfigDict(server.config())
+            for job in jobs:
+                expected=instrument.getCandles(job.instrument, job.from_date, job.to_date, granularity=job.granularity, price=job.price)
+                entries=[e for e in index['shards'] if e['instrument'] == job.instrument]
+                df=pd.concat([storage.loadPriceData(os.path.join(d, e['filename'])) for e in entries])
+                self.assertEqual(sum(e['rows'] for e in entries), len(expected))
+                self.assertEqual(pd.Timestamp(entries[0]['first']), expected.index[0])
+                self.assertEqual(pd.Timestamp(entries[-1]['last']), expected.index[-1])
+                pd.testing.assert_frame_equal(df, expected, check_freq=False, check_names=False, check_index_type=False)
+
+            # a second run only fetches the shards missing from the index
+            os.remove(os.path.join(d, index['shards'][-1]['filename']))
+            requests=len(server.requests)
+            again=backfill.backfill(server.config(), jobs, d, processes=2, shard_days=2)
+            self.assertEqual(again, index)
+            self.assertEqual(len(server.requests) - requests, 1)
+
+    def testFailure(self):
+        jobs=[fetcher.Job('EUR_USD', date(2020, 1, 1), date(2020, 1, 4), 'H1', 'M', None)]
+        with MockServer(error_rate=1) as server, tempfile.TemporaryDirectory() as d:
+            with self.assertRaises(retry.FetchError) as cm:
+                backfill.backfill(server.config(), jobs, d, processes=2, shard_days=2, kwargs={'retry': 1})
+            self.assertEqual(cm.exception.failed_ranges, [(date(2020, 1, 1), date(2020, 1, 2)), (date(2020, 1, 3), date(2020, 1, 4))])
+            self.assertEqual(backfill.loadIndex(d)['shards'], [])
+            with open(os.path.join(d, backfill.FAILED_MANIFEST)) as f:
+                self.assertEqual(f.read(), 'EUR_USD,H1,2020-01-01,2020-01-02,M\nEUR_USD,H1,2020-01-03,2020-01-04,M\n')
+
+if __name__ == '__main__':
+    unittest.main()
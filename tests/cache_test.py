@@ -0,0 +1,97 @@
+import unittest, tempfile, os
+from datetime import date, datetime, timezone
+import pandas as pd
+from context import instrument as ins, cache, columnar
+from fake_context import FakeContext
+from mock_server import MockServer
+
+class CandleCacheTest(unittest.TestCase):
+    def setUp(self):
+        self._dir=tempfile.TemporaryDirectory()
+        self.addCleanup(self._dir.cleanup)
+
+    def testMissingRanges(self):
+        c=cache.CandleCache(self._dir.name)
+        self.assertEqual(c.missingRanges('EUR_USD', 'H1', 'M', date(2020, 1, 1), date(2020, 1, 5)), [(date(2020, 1, 1), date(2020, 1, 5))])
+
+        c.update('EUR_USD', 'H1', 'M', date(2020, 1, 2), date(2020, 1, 3), pd.DataFrame())
+        self.assertEqual(c.coverage('EUR_USD', 'H1', 'M'), [(date(2020, 1, 2), date(2020, 1, 3))])
+        self.assertEqual(c.missingRanges('EUR_USD', 'H1', 'M', date(2020, 1, 1), date(2020, 1, 5)),
+                         [(date(2020, 1, 1), date(2020, 1, 1)), (date(2020, 1, 4), date(2020, 1, 5))])
+        self.assertEqual(c.missingRanges('EUR_USD', 'H1', 'M', date(2020, 1, 2), date(2020, 1, 3)), [])
+
+        # adjacent ranges are merged
+        c.update('EUR_USD', 'H1', 'M', date(2020, 1, 4), date(2020, 1, 4), pd.DataFrame())
+        self.assertEqual(c.coverage('EUR_USD', 'H1', 'M'), [(date(2020, 1, 2), date(2020, 1, 4))])
+
+    def testIncrementalFetch(self):
+        direct=ins.Instrument(FakeContext())
+        first=direct.getCandles('EUR_USD', '2020-01-01', '2020-01-10', granularity='H1')
+        second=direct.getCandles('EUR_USD', '2020-01-11', '2020-01-15', granularity='H1')
+
+        ctx=FakeContext()
+        cached=ins.Instrument(ctx, cache=cache.CandleCache(self._dir.name))
+        df=cached.getCandles('EUR_USD', '2020-01-01', '2020-01-10', granularity='H1')
+        self.assertTrue(df.equals(first))
+        self.assertGreater(len(ctx.requests), 0)
+
+        # everything is served from the cache
+        ctx.requests.clear()
+        df=cached.getCandles('EUR_USD', '2020-01-03', '2020-01-07', granularity='H1')
+        self.assertEqual(len(ctx.requests), 0)
+        self.assertTrue(df.equals(first['2020-01-03':'2020-01-07']))
+
+        # only the new days are fetched
+        df=cached.getCandles('EUR_USD', '2020-01-01', '2020-01-15', granularity='H1')
+        self.assertTrue(all(r['fromTime'] > date(2020, 1, 10) for r in ctx.requests))
+        self.assertTrue(df.equals(pd.concat([first, second])))
+
+    def testAppend(self):
+        direct=ins.Instrument(FakeContext())
+        c=cache.CandleCache(self._dir.name)
+        cached=ins.Instrument(FakeContext(), cache=c)
+        cached.getCandles('EUR_USD', '2020-01-01', '2020-01-05', granularity='H1')
+        index=os.path.join(self._dir.name, 'EUR_USD', 'H1', 'M', columnar.INDEX_FILE)
+        inode=os.stat(index).st_ino
+
+        # new days are appended to the cached files, which are not written again
+        df=cached.getCandles('EUR_USD', '2020-01-01', '2020-01-08', granularity='H1')
+        self.assertEqual(os.stat(index).st_ino, inode)
+        self.assertTrue(df.equals(direct.getCandles('EUR_USD', '2020-01-01', '2020-01-08', granularity='H1')))
+        self.assertTrue(c.load('EUR_USD', 'H1', 'M', date(2020, 1, 1), date(2020, 1, 8)).equals(df))
+
+        # earlier days are not appended
+        df=cached.getCandles('EUR_USD', '2019-12-30', '2020-01-08', granularity='H1')
+        self.assertNotEqual(os.stat(index).st_ino, inode)
+        self.assertTrue(c.load('EUR_USD', 'H1', 'M', date(2019, 12, 30), date(2020, 1, 8)).equals(df))
+
+    def testDecimalAsString(self):
+        # prices fetched as strings are cached as float, those fetched alongside are converted as well
+        with MockServer() as server:
+            config=dict(server.config(), decimal_number_as_float=False)
+            uncached=ins.Instrument.fromConfigDict(config).getCandles('EUR_USD', '2020-01-01', '2020-01-01', granularity='H1')
+            self.assertFalse(pd.api.types.is_numeric_dtype(uncached['Open']))
+            cached=ins.Instrument.fromConfigDict(config, cache=cache.CandleCache(self._dir.name))
+            first=cached.getCandles('EUR_USD', '2020-01-02', '2020-01-03', granularity='H1')
+            df=cached.getCandles('EUR_USD', '2020-01-01', '2020-01-04', granularity='H1')
+        self.assertEqual(first['Open'].dtype, 'float64')
+        self.assertEqual(df['Open'].dtype, 'float64')
+        self.assertEqual(len(df), 96)
+
+    def testIncompleteCandles(self):
+        ctx=FakeContext(incomplete_after=datetime(2020, 1, 8, 12, tzinfo=timezone.utc))
+        c=cache.CandleCache(self._dir.name)
+        df=ins.Instrument(ctx, cache=c).getCandles('EUR_USD', '2020-01-01', '2020-01-10', granularity='H1')
+        self.assertFalse(df['Complete'].all())
+        self.assertEqual(c.coverage('EUR_USD', 'H1', 'M'), [(date(2020, 1, 1), date(2020, 1, 7))])
+        self.assertTrue(c.load('EUR_USD', 'H1', 'M', date(2020, 1, 1), date(2020, 1, 10))['Complete'].all())
+
+        # the days holding incomplete candle sticks are fetched again
+        ctx=FakeContext()
+        df=ins.Instrument(ctx, cache=c).getCandles('EUR_USD', '2020-01-01', '2020-01-10', granularity='H1')
+        self.assertTrue(df['Complete'].all())
+        self.assertEqual(min(r['fromTime'] for r in ctx.requests), date(2020, 1, 8))
+        self.assertEqual(c.coverage('EUR_USD', 'H1', 'M'), [(date(2020, 1, 1), date(2020, 1, 10))])
+
+if __name__ == '__main__':
+    unittest.main()
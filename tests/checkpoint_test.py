@@ -0,0 +1,92 @@
+import unittest, tempfile, os
+from datetime import date
+from unittest import mock
+import pandas as pd
+from context import instrument as ins, fetcher, checkpoint
+from fake_context import FakeContext
+
+class Killed(BaseException):
+    """stands for the process dying, e.g. killed or out of memory
+    """
+
+class CheckpointTest(unittest.TestCase):
+    def setUp(self):
+        self._dir=tempfile.TemporaryDirectory()
+        self.addCleanup(self._dir.cleanup)
+        # one day of H1 candle sticks per checkpoint
+        patcher=mock.patch.object(checkpoint, 'CHECKPOINT_CANDLES', 24)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _fetch(self, ctx, *argv):
+        parser=fetcher.createParser()
+        args=fetcher.ArgumentWrapper(parser.parse_args(list(argv) + ['-c', os.devnull]))
+        self.addCleanup(args.config_file.close)
+        with mock.patch.object(ins.Instrument, 'fromConfigFile', side_effect=lambda *a, **kw: ins.Instrument(ctx)):
+            return fetcher.fetch(args)
+
+    def testCheckpoints(self):
+        self.assertEqual(checkpoint.getCheckpoints(date(2020, 1, 1), date(2020, 1, 3), 'H1'),
+                         [(date(2020, 1, d), date(2020, 1, d)) for d in (1, 2, 3)])
+        self.assertEqual(checkpoint.getCheckpoints(date(2020, 1, 1), date(2020, 1, 3), 'H2'),
+                         [(date(2020, 1, 1), date(2020, 1, 2)), (date(2020, 1, 3), date(2020, 1, 3))])
+
+    def testResume(self):
+        argv=['EUR_USD', '2020-01-01', '2020-01-05', '-g', 'H1']
+        expected=self._fetch(FakeContext(), *argv)
+
+        # the run dies while fetching the third day
+        output=os.path.join(self._dir.name, 'out.csv')
+        ctx=FakeContext(fail=lambda request: Killed() if len(ctx.requests) == 3 else None)
+        with self.assertRaises(Killed):
+            self._fetch(ctx, *argv, '-o', output, '--checkpoint')
+        self.assertFalse(os.path.exists(output))
+        self.assertTrue(os.path.isfile(checkpoint.journalOf(output)))
+
+        # running it again only fetches the remaining days
+        ctx=FakeContext()
+        self._fetch(ctx, *argv, '-o', output, '--checkpoint')
+        self.assertEqual([r['fromTime'] for r in ctx.requests], [date(2020, 1, d) for d in (3, 4, 5)])
+        df=pd.read_csv(output, index_col='Time', float_precision='round_trip')
+        df.index=pd.to_datetime(df.index, format='ISO8601')
+        self.assertTrue(df.index.equals(expected.index))
+        self.assertTrue((df['Close'].to_numpy() == expected['Close'].to_numpy()).all())
+        self.assertFalse(os.path.exists(checkpoint.journalOf(output)))
+        self.assertFalse(os.path.exists(checkpoint.partsOf(output)))
+
+    def testTruncatedJournal(self):
+        # the run dies twice, the first time while writing a record
+        argv=['EUR_USD', '2020-01-01', '2020-01-05', '-g', 'H1']
+        output=os.path.join(self._dir.name, 'out.csv')
+        ctx=FakeContext(fail=lambda request: Killed() if len(ctx.requests) == 3 else None)
+        with self.assertRaises(Killed):
+            self._fetch(ctx, *argv, '-o', output, '--checkpoint')
+        with open(checkpoint.journalOf(output), 'a') as f:
+            f.write('{"start": "2020-01-03", "en')
+
+        ctx=FakeContext(fail=lambda request: Killed() if len(ctx.requests) == 2 else None)
+        with self.assertRaises(Killed):
+            self._fetch(ctx, *argv, '-o', output, '--checkpoint')
+        self.assertEqual([r['fromTime'] for r in ctx.requests], [date(2020, 1, 3), date(2020, 1, 4)])
+        with open(checkpoint.journalOf(output)) as f:
+            self.assertEqual(len(f.readlines()), 4) # the job and the first three days
+
+        # the record written after the truncated line is read on the next resume
+        ctx=FakeContext()
+        self._fetch(ctx, *argv, '-o', output, '--checkpoint')
+        self.assertEqual([r['fromTime'] for r in ctx.requests], [date(2020, 1, 4), date(2020, 1, 5)])
+        self.assertEqual(len(pd.read_csv(output)), 5 * 24)
+
+    def testOtherJob(self):
+        # a journal of another job is not resumed
+        output=os.path.join(self._dir.name, 'out.csv')
+        ctx=FakeContext(fail=lambda request: Killed() if len(ctx.requests) == 2 else None)
+        with self.assertRaises(Killed):
+            self._fetch(ctx, 'EUR_USD', '2020-01-01', '2020-01-03', '-g', 'H1', '-o', output, '--checkpoint')
+        ctx=FakeContext()
+        self._fetch(ctx, 'GBP_USD', '2020-01-01', '2020-01-03', '-g', 'H1', '-o', output, '--checkpoint')
+        self.assertEqual(len(ctx.requests), 3)
+        self.assertEqual(len(pd.read_csv(output)), 72)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+import unittest
+from datetime import datetime, timedelta, timezone
+import numpy as np
+from context import instrument as ins, compact
+from fake_context import FakeContext
+from mock_server import candleDict
+
+def makeCandles(n, price='BA'):
+    start=datetime(2020, 1, 6, tzinfo=timezone.utc)
+    return [candleDict(start + timedelta(seconds=5 * i), price) for i in range(n)]
+
+class CompactTest(unittest.TestCase):
+    def testLayouts(self):
+        candles=makeCandles(1000)
+        df=ins.candleDictsToDataFrame(candles)
+        strings=ins.candleDictsToDataFrame(candles, as_float=False)
+        for layout in compact.LAYOUTS:
+            for source in (df, strings):
+                c=compact.compactFrame(source, layout)
+                self.assertEqual(list(c.columns), list(df.columns))
+                self.assertTrue(c.index.equals(df.index))
+                self.assertEqual(str(c.index.dtype), 'datetime64[ns, UTC]')
+                self.assertEqual(c['Volume'].dtype, np.int32)
+                self.assertEqual(c['Complete'].dtype, bool)
+                self.assertEqual(c['bid_o'].dtype, np.dtype(layout))
+                expanded=compact.expandFrame(c)
+                if layout == 'float32':
+                    # quoted prices are given back by rounding to their decimals
+                    self.assertTrue(expanded.round(5).equals(df))
+                else:
+                    self.assertEqual(c.attrs['price_decimals'], compact.PRICE_DECIMALS)
+                    self.assertEqual(c['bid_o'].iloc[0], round(float(candles[0]['bid']['o']) * 1e5))
+                    self.assertTrue(expanded.equals(df))
+            self.assertLess(c.memory_usage(deep=True).sum(), df.memory_usage(deep=True).sum())
+
+    def testInvalid(self):
+        df=ins.candleDictsToDataFrame(makeCandles(10, 'M'))
+        with self.assertRaises(ValueError):
+            compact.compactFrame(df, 'float16')
+        # too many decimals to scale exactly
+        with self.assertRaises(ValueError):
+            compact.compactFrame(df, 'int64', decimals=2)
+        # too large for int32
+        with self.assertRaises(ValueError):
+            compact.compactFrame(df * 1e5, 'int32')
+        self.assertEqual(compact.compactFrame(df, 'int64', decimals=9)['Open'].iloc[0], round(df['Open'].iloc[0] * 1e9))
+
+    def testInstrument(self):
+        df=ins.Instrument(FakeContext()).getCandles('EUR_USD', '2020-01-01', '2020-01-02', granularity='M1')
+        c=ins.Instrument(FakeContext(), layout='int32').getCandles('EUR_USD', '2020-01-01', '2020-01-02', granularity='M1')
+        self.assertEqual(c['Open'].dtype, np.int32)
+        self.assertEqual(c.attrs['price_decimals'], compact.PRICE_DECIMALS)
+        # fake prices are computed rather than quoted, they are quoted by rounding
+        self.assertTrue(compact.expandFrame(c).equals(df.round(5)))
+        with self.assertRaises(ValueError):
+            ins.Instrument(FakeContext(), layout='int8')
+
+if __name__ == '__main__':
+    unittest.main()
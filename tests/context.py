@@ -4,3 +4,21 @@ sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')
 
 import oandata.factory as factory
 import oandata.instrument as instrument
+import oandata.cache as cache
+import oandata.store as store
+import oandata.fetcher as fetcher
+import oandata.batch as batch
+import oandata.storage as storage
+import oandata.columnar as columnar
+import oandata.stream as stream
+import oandata.retry as retry
+import oandata.checkpoint as checkpoint
+import oandata.resample as resample
+import oandata.metrics as metrics
+import oandata.asyncinstrument as asyncinstrument
+import oandata.compact as compact
+import oandata.ratelimit as ratelimit
+import oandata.backfill as backfill
+import oandata.merge as merge
+import oandata.follow as follow
+import oandata.planner as planner
@@ -1,5 +1,8 @@
-import unittest, configparser
-from context import factory as fc
+import unittest, configparser, time, types, threading
+from v20.errors import ResponseUnexpectedStatus
+from context import factory as fc, instrument as ins, ratelimit, retry
+from mock_server import MockServer
+from fake_context import FakeContext
 
 class file_mock:
     """mocks a config file
@@ -68,6 +71,161 @@ class FactoryTest(unittest.TestCase):
         self.assertEqual(fac._config['datetime_format'], "TTT9")
         self.assertEqual(fac._config['poll_timeout'], 0)
 
+    def test_stream_context(self):
+        fac=fc.Factory.fromConfigFile(file_mock("[DEFAULT]\nhostname=api.example.com\ntoken=xxxx"))
+        with self.assertRaises(ValueError):
+            fac.createStreamContext()
+
+        fac=fc.Factory.fromConfigFile(file_mock("[DEFAULT]\nhostname=api.example.com\ntoken=xxxx\nstream_hostname=stream.example.com"))
+        self.assertEqual(fac._config['stream_hostname'], 'stream.example.com')
+        self.assertEqual(fac.createContext().hostname, 'api.example.com')
+        self.assertEqual(fac.createStreamContext().hostname, 'stream.example.com')
+
+    def test_context_pool(self):
+        pool=fc.ContextPool(size=2)
+        former=fc.getContextPool()
+        fc.setContextPool(pool)
+        self.addCleanup(fc.setContextPool, former)
+        self.addCleanup(pool.clear)
+
+        with MockServer() as server:
+            config=server.config()
+            instruments=[ins.Instrument.fromConfigDict(dict(config)) for _ in range(6)]
+            self.assertEqual(len({id(i._context) for i in instruments}), 2)
+            for instrument in instruments:
+                df=instrument.getCandles('EUR_USD', '2020-01-01', '2020-01-02', granularity='H1')
+                self.assertEqual(len(df), 48)
+
+            stats=pool.stats()
+            self.assertEqual(stats['contexts'], 2)
+            self.assertEqual(stats['misses'], 2)
+            self.assertEqual(stats['hits'], 4)
+            self.assertEqual(stats['requests'], 6)
+            # one handshake per context, the rest reuse kept-alive connections
+            self.assertEqual(stats['connections'], 2)
+
+            # another configuration gets its own contexts
+            other=fc.Factory(dict(config, application='other')).getContext()
+            self.assertNotIn(other, [i._context for i in instruments])
+
+    def test_idle_eviction(self):
+        pool=fc.ContextPool(idle_timeout=0.05)
+        pool.get({'hostname': 'api.example.com', 'token': 'x'})
+        time.sleep(0.1)
+        pool.evictIdle()
+        self.assertEqual(pool.stats()['contexts'], 0)
+        self.assertEqual(pool.stats()['evictions'], 1)
+
+        # idle time counts from the last request, and contexts are not closed while a request is in flight
+        pool=fc.ContextPool(idle_timeout=0.3)
+        self.addCleanup(pool.clear)
+        with MockServer(latency=0.5) as server:
+            instrument=ins.Instrument(pool.get(server.config()))
+            time.sleep(0.2)
+            thread=threading.Thread(target=instrument.getCandles, args=('EUR_USD', '2020-01-01', '2020-01-01'), kwargs={'granularity': 'H1'})
+            thread.start()
+            time.sleep(0.3)
+            pool.evictIdle() # in flight
+            self.assertEqual(pool.stats()['contexts'], 1)
+            thread.join()
+            time.sleep(0.1)
+            pool.evictIdle() # the request has just ended
+            self.assertEqual(pool.stats()['contexts'], 1)
+            time.sleep(0.3)
+            pool.evictIdle()
+            self.assertEqual(pool.stats()['contexts'], 0)
+
+    def test_token_sections(self):
+        fac=fc.Factory.fromConfigFile(file_mock("[DEFAULT]\nhostname=api.example.com\nport=443\n[research]\ntoken=aaaa\n[trading]\ntoken=bbbb\nrate=20"))
+        self.assertEqual(list(fac.tokens), ['research', 'trading'])
+        self.assertEqual(fac.config, fac.tokens['research'])
+        self.assertEqual(fac.tokens['trading'], {'hostname': 'api.example.com', 'port': 443, 'token': 'bbbb', 'rate': 20.0})
+        self.assertNotIn('rate', fac._contextConfig(fac.tokens['trading']))
+        self.assertEqual(fac.limiterKey('trading'), 'api.example.com#trading')
+
+        # sections setting no token, or the token of another section, are skipped
+        fac=fc.Factory.fromConfigFile(file_mock("[DEFAULT]\nhostname=api.example.com\n[research]\ntoken=aaaa\n[logging]\nport=443\n[trading]\ntoken=aaaa"))
+        self.assertEqual(list(fac.tokens), ['research'])
+        # even if they inherit the token of [DEFAULT], which is a token of its own
+        fac=fc.Factory.fromConfigFile(file_mock("[DEFAULT]\nhostname=api.example.com\ntoken=xxxx\n[logging]\nport=443\n[trading]\ntoken=bbbb"))
+        self.assertEqual({name: config['token'] for name, config in fac.tokens.items()}, {'DEFAULT': 'xxxx', 'trading': 'bbbb'})
+        self.assertEqual(set(fac.createTokenPool().stats()), {'DEFAULT', 'trading'})
+        fac=fc.Factory.fromConfigFile(file_mock("[DEFAULT]\nhostname=api.example.com\ntoken=xxxx\n[logging]\nport=443"))
+        self.assertEqual(list(fac.tokens), ['DEFAULT'])
+        # unless a section sets it
+        fac=fc.Factory.fromConfigFile(file_mock("[DEFAULT]\nhostname=api.example.com\ntoken=xxxx\n[research]\ntoken=xxxx\nrate=20"))
+        self.assertEqual(list(fac.tokens), ['research'])
+        with self.assertRaises(ValueError):
+            fc.Factory.fromConfigFile(file_mock("[DEFAULT]\nhostname=api.example.com\n[research]\nport=443"))
+
+        # a single token shares the limiter of its host
+        fac=fc.Factory.fromConfigFile(file_mock("[DEFAULT]\nhostname=api.example.com\ntoken=xxxx"))
+        self.assertEqual(list(fac.tokens), ['DEFAULT'])
+        self.assertEqual(fac.limiterKey('DEFAULT'), 'api.example.com')
+
+    def _pool(self, contexts, **kwargs):
+        return fc.TokenPool([fc.Token(str(i), ctx, ratelimit.RateLimiter(0)) for i, ctx in enumerate(contexts)], **kwargs)
+
+    def test_token_pool(self):
+        contexts=[FakeContext(), FakeContext()]
+        pool=self._pool(contexts)
+        df=ins.Instrument(pool).getCandles('EUR_USD', '2020-01-01', '2020-01-10', granularity='M1')
+        self.assertEqual(len(df), 14400)
+        # requests are spread across the tokens
+        self.assertEqual(sorted(len(ctx.requests) for ctx in contexts), [3, 3])
+        self.assertEqual([s['requests'] for s in pool.stats().values()], [3, 3])
+
+        # the token whose budget frees first is taken
+        slow=fc.Token('slow', FakeContext(), ratelimit.RateLimiter(1))
+        fast=fc.Token('fast', FakeContext(), ratelimit.RateLimiter(1000))
+        pool=fc.TokenPool([slow, fast])
+        self.assertEqual([pool.acquire().name for _ in range(4)], ['slow', 'fast', 'fast', 'fast'])
+
+    def test_token_health(self):
+        def refused(request):
+            resp=types.SimpleNamespace(method='GET', path='/v3/instruments/EUR_USD/candles', status=401,
+                                       reason='', body=None, headers={})
+            return ResponseUnexpectedStatus(resp, 200)
+        revoked, valid=FakeContext(fail=refused), FakeContext()
+        pool=self._pool([revoked, valid], cooldown=60)
+        df=ins.Instrument(pool).getCandles('EUR_USD', '2020-01-01', '2020-01-10', granularity='M1', retry=2)
+        self.assertEqual(len(df), 14400)
+        # the revoked token is taken out after its first refusal
+        self.assertEqual(len(revoked.requests), 1)
+        self.assertEqual(len(valid.requests), 6)
+        stats=pool.stats()
+        self.assertFalse(stats['0']['healthy'])
+        self.assertEqual(stats['0']['cooldowns'], 1)
+        self.assertTrue(stats['1']['healthy'])
+
+        # server errors are not the fault of the token
+        def unavailable(request):
+            resp=types.SimpleNamespace(method='GET', path='/v3/instruments/EUR_USD/candles', status=503,
+                                       reason='', body=None, headers={})
+            return ResponseUnexpectedStatus(resp, 200)
+        busy=FakeContext(fail=unavailable)
+        pool=self._pool([busy, FakeContext()], max_failures=1)
+        with self.assertRaises(retry.FetchError):
+            ins.Instrument(pool, retry_policy=retry.RetryPolicy(base_delay=0.001)).getCandles(
+                'EUR_USD', '2020-01-01', '2020-01-01', granularity='H1', retry=1)
+        self.assertEqual(len(busy.requests), 1)
+        self.assertTrue(pool.stats()['0']['healthy'])
+        self.assertEqual(pool.stats()['0']['failures'], 0)
+
+        # a token failing in a row is taken out, the only one is never
+        pool=self._pool([FakeContext(), FakeContext()], max_failures=2)
+        token=pool.tokens[0]
+        pool.fail(token)
+        pool.succeed(token)
+        pool.fail(token)
+        self.assertTrue(pool.stats()['0']['healthy'])
+        pool.fail(token)
+        self.assertFalse(pool.stats()['0']['healthy'])
+        self.assertEqual({pool.acquire().name for _ in range(3)}, {'1'})
+
+        pool=self._pool([FakeContext()], max_failures=1)
+        pool.fail(pool.tokens[0], fatal=True)
+        self.assertTrue(pool.stats()['0']['healthy'])
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,114 @@
+import threading, time
+from datetime import date, datetime, timedelta, timezone
+
+from context import instrument as ins
+
+def _toDatetime(t):
+    """converts a date, datetime or RFC3339 string to an aware datetime in UTC
+    """
+    if isinstance(t, datetime):
+        return t if t.tzinfo is not None else t.replace(tzinfo=timezone.utc)
+    if isinstance(t, date):
+        return datetime(t.year, t.month, t.day, tzinfo=timezone.utc)
+    return datetime.strptime(t[:19], '%Y-%m-%dT%H:%M:%S').replace(tzinfo=timezone.utc)
+
+def _toRFC3339(dt):
+    return dt.strftime('%Y-%m-%dT%H:%M:%S.000000000Z')
+
+class CandleData:
+    """mocks v20.instrument.CandlestickData
+    """
+    def __init__(self, o, h, l, c):
+        self.o=o
+        self.h=h
+        self.l=l
+        self.c=c
+
+class Candle:
+    """mocks v20.instrument.Candlestick
+    """
+    def __init__(self, time, volume, complete, bid=None, ask=None, mid=None):
+        self.time=time
+        self.volume=volume
+        self.complete=complete
+        self.bid=bid
+        self.ask=ask
+        self.mid=mid
+
+class Response:
+    """mocks v20.response.Response
+    """
+    def __init__(self, candles):
+        self.status=200
+        self._candles=candles
+
+    def get(self, field, status=None):
+        return self._candles
+
+def makeCandle(dt, price='M', complete=True):
+    """makes a deterministic candle starting at `dt`
+    """
+    v=(int(dt.timestamp()) % 1000) / 1000.0 + 1.0
+    kwargs={}
+    for p, name in (('B', 'bid'), ('A', 'ask'), ('M', 'mid')):
+        if p in price:
+            kwargs[name]=CandleData(v, v + 0.002, v - 0.002, v + 0.001)
+    return Candle(_toRFC3339(dt), int(dt.timestamp()) % 97, complete, **kwargs)
+
+class FakeInstrumentEndpoint:
+    def __init__(self, ctx):
+        self._ctx=ctx
+
+    def candles(self, instrument, **kwargs):
+        return self._ctx.candles(instrument, **kwargs)
+
+class FakeContext:
+    """mocks v20.Context
+
+    It serves candles at every granularity step within the requested
+    period, optionally waiting `latency` seconds per request. Like
+    v20, a request gives either `toTime` or `count` candles and no
+    candle starts after `now`. Candles starting at or after
+    `incomplete_after` are incomplete. All requests are recorded in
+    `requests`, and the largest number of requests served at once in
+    `max_in_flight`. If `fail` is given, it is called with each
+    recorded request and the exception it returns, if any, is raised.
+    """
+    def __init__(self, latency=0, hostname='fake.example.com', incomplete_after=None, now=None, fail=None):
+        self.hostname=hostname
+        self.fail=fail
+        self.now=now if now is not None else datetime.now(timezone.utc)
+        self.latency=latency
+        self.incomplete_after=incomplete_after
+        self.requests=[]
+        self.in_flight=0
+        self.max_in_flight=0
+        self.instrument=FakeInstrumentEndpoint(self)
+        self._lock=threading.Lock()
+
+    def candles(self, instrument, granularity='D', price='M', fromTime=None, toTime=None, count=None, includeFirst=True, **kwargs):
+        request=dict(instrument=instrument, granularity=granularity, price=price, fromTime=fromTime, toTime=toTime, count=count, includeFirst=includeFirst, **kwargs)
+        with self._lock:
+            self.requests.append(request)
+        if self.fail is not None:
+            exp=self.fail(request)
+            if exp is not None:
+                raise exp
+        if self.latency:
+            with self._lock:
+                self.in_flight+=1
+                self.max_in_flight=max(self.max_in_flight, self.in_flight)
+            time.sleep(self.latency)
+            with self._lock:
+                self.in_flight-=1
+        step=timedelta(seconds=ins.getGranularityInSec(granularity))
+        t=_toDatetime(fromTime)
+        if not includeFirst:
+            t+=step
+        end=_toDatetime(toTime) if toTime is not None else None
+        count=count if count is not None else 500
+        candles=[]
+        while t <= self.now and (t < end if end is not None else len(candles) < count):
+            candles.append(makeCandle(t, price, self.incomplete_after is None or t < self.incomplete_after))
+            t+=step
+        return Response(candles)
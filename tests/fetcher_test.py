@@ -0,0 +1,116 @@
+import unittest, tempfile, os, sys, subprocess
+from datetime import date
+from unittest import mock
+import pandas as pd
+from context import instrument as ins, fetcher, batch
+from fake_context import FakeContext
+
+try:
+    import pyarrow
+except ImportError:
+    pyarrow=None
+
+class FetcherTest(unittest.TestCase):
+    def setUp(self):
+        self._dir=tempfile.TemporaryDirectory()
+        self.addCleanup(self._dir.cleanup)
+
+    def _args(self, *argv):
+        parser=fetcher.createParser()
+        args=fetcher.ArgumentWrapper(parser.parse_args(list(argv) + ['-c', os.devnull]))
+        self.addCleanup(args.config_file.close)
+        return args
+
+    def _fetch(self, args, ctx=None):
+        ctx=ctx if ctx is not None else FakeContext()
+        with mock.patch.object(ins.Instrument, 'fromConfigFile', side_effect=lambda *a, **kw: ins.Instrument(ctx)) as from_config:
+            result=fetcher.fetch(args)
+        self.assertEqual(from_config.call_count, 1)
+        return result
+
+    def testStreamingCsv(self):
+        expected=self._fetch(self._args('EUR_USD', '2020-01-01', '2020-01-01', '-g', 'S5'))
+
+        output=os.path.join(self._dir.name, 'out.csv')
+        self.assertIsNone(self._fetch(self._args('EUR_USD', '2020-01-01', '2020-01-01', '-g', 'S5', '-o', output)))
+        df=pd.read_csv(output, index_col='Time', parse_dates=True, float_precision='round_trip')
+        self.assertEqual(len(df), len(expected))
+        self.assertTrue(df.index.equals(expected.index))
+        self.assertTrue((df['Close'].to_numpy() == expected['Close'].to_numpy()).all())
+
+    @unittest.skipIf(pyarrow is None, 'pyarrow is not installed')
+    def testStreamingParquet(self):
+        expected=self._fetch(self._args('EUR_USD', '2020-01-01', '2020-01-01', '-g', 'S5'))
+
+        output=os.path.join(self._dir.name, 'out.parquet')
+        self._fetch(self._args('EUR_USD', '2020-01-01', '2020-01-01', '-g', 'S5', '-o', output))
+        df=pd.read_parquet(output)
+        self.assertTrue(df.equals(expected.rename_axis('Time')))
+
+    def testSeveralInstruments(self):
+        with self.assertRaises(ValueError):
+            self._args('EUR_USD', 'GBP_USD', '2020-01-01', '2020-01-02', '-o', 'out.csv').getJobs()
+
+        output=os.path.join(self._dir.name, '{instrument}.csv')
+        ctx=FakeContext()
+        self._fetch(self._args('EUR_USD', 'GBP_USD', 'USD_JPY', '2020-01-01', '2020-01-02', '-g', 'H1', '-o', output, '-w', '3'), ctx)
+        self.assertEqual(sorted(r['instrument'] for r in ctx.requests), ['EUR_USD', 'GBP_USD', 'USD_JPY'])
+        for instrument in ('EUR_USD', 'GBP_USD', 'USD_JPY'):
+            df=pd.read_csv(output.format(instrument=instrument), index_col='Time')
+            self.assertEqual(len(df), 48)
+
+    def testManifest(self):
+        manifest=[
+            '# instrument, granularity, from, to, price',
+            'EUR_USD,H1,2020-01-01,2020-01-02',
+            '',
+            'GBP_USD, M30, 2020-01-01, 2020-01-01, B',
+            ]
+        output=os.path.join(self._dir.name, '{instrument}_{granularity}_{price}.csv')
+        jobs=batch.readManifest(manifest, output)
+        self.assertEqual([(j.instrument, j.granularity, j.price) for j in jobs], [('EUR_USD', 'H1', 'M'), ('GBP_USD', 'M30', 'B')])
+        self.assertEqual(jobs[1].to_date, ins.isoStrToDate('2020-01-01'))
+        self.assertEqual(jobs[1].output, os.path.join(self._dir.name, 'GBP_USD_M30_B.csv'))
+
+        with self.assertRaises(ValueError):
+            batch.readManifest(['EUR_USD,H1,2020-01-01'])
+        with self.assertRaises(ValueError):
+            batch.readManifest(['EUR_USD,H7,2020-01-01,2020-01-02'])
+
+        manifest_file=os.path.join(self._dir.name, 'manifest')
+        with open(manifest_file, 'w') as f:
+            f.write('\n'.join(manifest))
+        args=batch.ArgumentWrapper(batch.createParser().parse_args([manifest_file, '-o', output, '-c', os.devnull, '-w', '2']))
+        self.addCleanup(args.manifest.close)
+        self.addCleanup(args.config_file.close)
+        with mock.patch.object(ins.Instrument, 'fromConfigFile', side_effect=lambda *a, **kw: ins.Instrument(FakeContext())):
+            fetcher.fetchJobs(args, args.getJobs())
+        self.assertEqual(len(pd.read_csv(jobs[0].output)), 48)
+        self.assertEqual(len(pd.read_csv(jobs[1].output)), 48)
+
+        # lines must not share an output file, unless told apart by their period
+        duplicates=['EUR_USD,H1,2020-01-01,2020-01-02', 'EUR_USD,H1,2020-02-01,2020-02-02']
+        with self.assertRaises(ValueError) as cm:
+            fetcher.fetchJobs(args, batch.readManifest(duplicates, output))
+        self.assertIn('"EUR_USD,H1,2020-01-01,2020-01-02,M" and "EUR_USD,H1,2020-02-01,2020-02-02,M"', str(cm.exception))
+        jobs=batch.readManifest(duplicates, os.path.join(self._dir.name, '{instrument}_{from}_{to}.csv'))
+        self.assertEqual(jobs[1].output, os.path.join(self._dir.name, 'EUR_USD_2020-02-01_2020-02-02.csv'))
+        fetcher.checkOutputs(jobs)
+
+    def testLightImport(self):
+        # parsing arguments imports neither pandas nor v20, see oandata.constants
+        code=('import sys, oandata.fetcher, oandata.batch;'
+              'oandata.fetcher.ArgumentWrapper(oandata.fetcher.createParser().parse_args(["EUR_USD", "2020-01-01", "2020-01-02", "-g", "M1", "-d", "H1", "-o", "{granularity}.csv"])).getJobs();'
+              'print(sorted(m for m in ("pandas", "numpy", "v20", "requests") if m in sys.modules))')
+        root=os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+        output=subprocess.run([sys.executable, '-c', code], cwd=root, capture_output=True, text=True, check=True).stdout
+        self.assertEqual(output.strip(), '[]')
+
+    def testIsoStrToDate(self):
+        self.assertEqual(ins.isoStrToDate('2020-01-05'), date(2020, 1, 5))
+        self.assertEqual(ins.isoStrToDate('2020-1-5'), date(2020, 1, 5))
+        with self.assertRaises(ValueError):
+            ins.isoStrToDate('2020-02-30')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,101 @@
+import unittest, tempfile, os
+from datetime import date, datetime, timezone
+from unittest import mock
+import pandas as pd
+from context import instrument as ins, follow, fetcher, storage
+from fake_context import FakeContext
+
+def _context(hour, minute=0):
+    # the candle stick of the current time is not complete yet
+    now=datetime(2020, 1, 8, hour, minute, tzinfo=timezone.utc)
+    return FakeContext(now=now, incomplete_after=now)
+
+class FollowTest(unittest.TestCase):
+    def setUp(self):
+        self._dir=tempfile.TemporaryDirectory()
+        self.addCleanup(self._dir.cleanup)
+
+    def _expected(self, hour):
+        return pd.concat(ins.Instrument(_context(hour)).iterCandles('EUR_USD', date(2020, 1, 8), date.today(), granularity='M5'))
+
+    def testCsvTail(self):
+        output=os.path.join(self._dir.name, 'out.csv')
+        df=self._expected(10)
+        sink=storage.CsvSink(output)
+        sink.write(df)
+        sink.close()
+        self.assertFalse(df['Complete'].iloc[-1])
+        with open(output, 'a') as f:
+            f.write('2020-01-08 10:05:00+00:00,1.1') # partially written
+        size=os.path.getsize(output)
+        with open(output, 'rb') as f:
+            offset=f.read().rindex(b'\n2020-01-08 10:00:00') + 1
+        with mock.patch.object(follow, 'TAIL_BLOCK', 16):
+            last, at=follow._csvTail(output)
+        self.assertEqual(last, df.index[-2])
+        self.assertEqual(at, offset)
+        self.assertLess(at, size)
+
+    def _follow(self, output, ctx):
+        job=fetcher.Job('EUR_USD', date(2020, 1, 8), date(2020, 1, 8), 'M5', 'M', output)
+        return follow.followJob(ins.Instrument(ctx), job, {'retry': 3, 'split': None, 'workers': 1})
+
+    def testFollowCsv(self):
+        output=os.path.join(self._dir.name, 'out.csv')
+        self.assertEqual(self._follow(output, _context(10)), len(self._expected(10)))
+
+        # the incomplete candle stick is replaced, and only newer ones are fetched
+        ctx=_context(12)
+        self.assertEqual(self._follow(output, ctx), 25)
+        self.assertEqual(len(ctx.requests), 1)
+        self.assertEqual(ctx.requests[0]['fromTime'], '2020-01-08T09:55:00.000000000Z')
+        self.assertFalse(ctx.requests[0]['includeFirst'])
+
+        df=storage.loadPriceData(output)
+        expected=self._expected(12)
+        self.assertTrue(df.index.equals(expected.index))
+        self.assertTrue((df['Close'].to_numpy() == expected['Close'].to_numpy()).all())
+        self.assertEqual(df['Complete'].tolist(), expected['Complete'].tolist())
+
+    def testFollowNpy(self):
+        output=os.path.join(self._dir.name, 'out')
+        os.makedirs(output)
+        self._follow(output, _context(10))
+        self._follow(output, _context(12))
+        self.assertTrue(storage.loadPriceData(output).equals(self._expected(12)))
+
+    def testPoll(self):
+        self.assertEqual(follow.secondsToNextPoll(60, now=125), 57)
+        self.assertEqual(follow.secondsToNextPoll(60, now=121), 1)
+        self.assertEqual(follow.secondsToNextPoll(300, now=302, delay=2), 300)
+
+        output=os.path.join(self._dir.name, 'out.csv')
+        job=fetcher.Job('EUR_USD', date(2020, 1, 8), date(2020, 1, 8), 'M5', 'M', output)
+        sleeps=[]
+        follow.followJobs(ins.Instrument(_context(10)), [job], {'retry': 3}, poll=0, sleep=sleeps.append, polls=3)
+        self.assertEqual(len(sleeps), 2)
+        self.assertTrue(all(0 < s <= 302 for s in sleeps))
+
+    def testFetcher(self):
+        output=os.path.join(self._dir.name, 'out.csv')
+        parser=fetcher.createParser()
+        args=fetcher.ArgumentWrapper(parser.parse_args(['EUR_USD', '2020-01-08', '2020-01-08', '-g', 'M5', '-o', output, '-c', os.devnull, '--follow']))
+        self.addCleanup(args.config_file.close)
+        self.assertTrue(args.follow)
+        self.assertIsNone(args.poll)
+        with mock.patch.object(ins.Instrument, 'fromConfigFile', side_effect=lambda *a, **kw: ins.Instrument(_context(10))):
+            self.assertIsNone(fetcher.fetch(args))
+        self.assertEqual(len(storage.loadPriceData(output)), len(self._expected(10)))
+
+        args=fetcher.ArgumentWrapper(parser.parse_args(['EUR_USD', '2020-01-08', '2020-01-08', '-o', output, '-c', os.devnull, '--poll']))
+        self.addCleanup(args.config_file.close)
+        self.assertTrue(args.follow)
+        self.assertEqual(args.poll, 0)
+
+        args=fetcher.ArgumentWrapper(parser.parse_args(['EUR_USD', '2020-01-08', '2020-01-08', '-g', 'M1', '-d', 'H1', '-o', '{granularity}.csv', '-c', os.devnull, '--follow']))
+        self.addCleanup(args.config_file.close)
+        with self.assertRaises(ValueError):
+            fetcher.fetch(args)
+
+if __name__ == '__main__':
+    unittest.main()
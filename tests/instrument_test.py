@@ -1,6 +1,9 @@
-import unittest, configparser
-from datetime import date, timedelta
+import unittest
+from datetime import date, datetime, timedelta, timezone
+import pandas as pd
 from context import instrument as ins
+from fake_context import FakeContext, makeCandle
+from mock_server import MockServer
 
 class InstrumentTest(unittest.TestCase):
     def testGet(self):
@@ -27,5 +30,138 @@ class InstrumentTest(unittest.TestCase):
         self.assertEqual(si[1][0], date(2020, 1, 2))
         self.assertEqual(si[1][1], date(2020, 1, 2))
 
+        with self.assertWarns(DeprecationWarning):
+            self.assertEqual(ins.computeIntervalNum(date(2020, 1, 1), date(2020, 1, 5), 'M1'), 3) # 7200 candle sticks
+        self.assertIn('M', ins.PRICE) # re-exported from oandata.constants
+
+    def testCandlesToDataFrame(self):
+        start=datetime(2020, 1, 1, tzinfo=timezone.utc)
+        candles=[makeCandle(start + timedelta(minutes=i), price='A', complete=i < 2) for i in range(3)]
+        df=ins.candlesToDataFrame(candles)
+        self.assertEqual(list(df.columns), ['Open', 'Close', 'Low', 'High', 'Volume', 'Complete'])
+        self.assertEqual(df.index[1], pd.Timestamp('2020-01-01T00:01:00Z'))
+        self.assertEqual(list(df['Open']), [cs.ask.o for cs in candles])
+        self.assertEqual(list(df['High']), [cs.ask.h for cs in candles])
+        self.assertEqual(list(df['Volume']), [cs.volume for cs in candles])
+        self.assertEqual(list(df['Complete']), [True, True, False])
+        self.assertEqual(df['Open'].dtype, 'float64')
+        self.assertEqual(df['Complete'].dtype, 'bool')
+
+        # prices are kept as strings if decimals are not converted to float
+        for cs in candles:
+            cs.ask.o, cs.ask.c, cs.ask.l, cs.ask.h=str(cs.ask.o), str(cs.ask.c), str(cs.ask.l), str(cs.ask.h)
+        df=ins.candlesToDataFrame(candles)
+        self.assertEqual(list(df['Close']), [cs.ask.c for cs in candles])
+
+        # several price types are stored in prefixed columns
+        candles=[makeCandle(start + timedelta(minutes=i), price='MB') for i in range(3)]
+        df=ins.candlesToDataFrame(candles)
+        self.assertEqual(list(df.columns), ['bid_o', 'bid_c', 'bid_l', 'bid_h', 'mid_o', 'mid_c', 'mid_l', 'mid_h', 'Volume', 'Complete'])
+        self.assertEqual(list(df['mid_l']), [cs.mid.l for cs in candles])
+        self.assertEqual(list(df['bid_c']), [cs.bid.c for cs in candles])
+
+    def testPrice(self):
+        for price in ('B', 'A', 'M', 'BA', 'MBA', 'AM'):
+            self.assertTrue(ins.isValidPrice(price))
+        for price in ('', 'X', 'BB', 'mba', None):
+            self.assertFalse(ins.isValidPrice(price))
+
+        ctx=FakeContext()
+        df=ins.Instrument(ctx).getCandles('EUR_USD', '2020-01-01', '2020-01-02', granularity='H1', price='MBA')
+        self.assertEqual(len(ctx.requests), 1)
+        self.assertEqual(ctx.requests[0]['price'], 'MBA')
+        self.assertEqual(len(df), 48)
+        self.assertIn('ask_c', df.columns)
+        with self.assertRaises(ValueError):
+            ins.Instrument(ctx).getCandles('EUR_USD', '2020-01-01', '2020-01-02', price='BX')
+
+    def testFastDecode(self):
+        with MockServer() as server:
+            fast=ins.Instrument.fromConfigDict(server.config())
+            self.assertTrue(fast._fast_decode)
+            slow=ins.Instrument.fromConfigDict(server.config(), fast_decode=False)
+            for price in ('M', 'BA'):
+                expected=slow.getCandles('EUR_USD', '2020-01-01', '2020-01-02', granularity='M1', price=price)
+                df=fast.getCandles('EUR_USD', '2020-01-01', '2020-01-02', granularity='M1', price=price)
+                self.assertTrue(df.equals(expected))
+                self.assertTrue((df.dtypes == expected.dtypes).all())
+                self.assertEqual(df.to_csv(), expected.to_csv())
+
+    def testPagination(self):
+        # a single day of S5 candles does not fit in one page
+        ctx=FakeContext()
+        df=ins.Instrument(ctx).getCandles('EUR_USD', '2020-01-01', '2020-01-01', granularity='S5')
+        self.assertEqual(len(df), 24 * 60 * 12)
+        self.assertEqual(len(ctx.requests), 7)
+        self.assertTrue(df.index.is_unique)
+        self.assertTrue(df.index.is_monotonic_increasing)
+        self.assertEqual(df.index[0], pd.Timestamp('2020-01-01T00:00:00Z'))
+        self.assertEqual(df.index[-1], pd.Timestamp('2020-01-01T23:59:55Z'))
+        # the next page starts right after the last candle of the previous one
+        self.assertEqual(ctx.requests[1]['fromTime'], '2020-01-01T03:28:15.000000000Z')
+        self.assertFalse(ctx.requests[1]['includeFirst'])
+
+        # a period fitting in one page is fetched by one bounded request
+        ctx=FakeContext()
+        df=ins.Instrument(ctx).getCandles('EUR_USD', '2020-01-01', '2020-01-05', granularity='H1')
+        self.assertEqual(len(df), 5 * 24)
+        self.assertEqual(len(ctx.requests), 1)
+        self.assertEqual(ctx.requests[0]['toTime'], date(2020, 1, 6))
+
+        # the period may end today
+        now=datetime.now(timezone.utc)
+        ctx=FakeContext(now=now)
+        df=ins.Instrument(ctx).getCandles('EUR_USD', now.date() - timedelta(days=1), now.date(), granularity='H1')
+        self.assertEqual(df.index[-1], pd.Timestamp(now).floor('h'))
+        self.assertIsNone(ctx.requests[0]['toTime'])
+
+        # splits are fetched concurrently, each page by page
+        ctx=FakeContext()
+        df=ins.Instrument(ctx).getCandles('EUR_USD', '2020-01-01', '2020-01-04', granularity='S5', workers=4)
+        self.assertEqual(len(df), 4 * 24 * 60 * 12)
+        self.assertTrue(df.index.is_unique)
+        self.assertTrue(df.index.is_monotonic_increasing)
+
+    def testIterCandles(self):
+        ctx=FakeContext()
+        instrument=ins.Instrument(ctx)
+        expected=instrument.getCandles('EUR_USD', '2020-01-01', '2020-01-02', granularity='S5')
+
+        for workers in (1, 3):
+            pages=list(instrument.iterCandles('EUR_USD', '2020-01-01', '2020-01-02', granularity='S5', workers=workers))
+            self.assertTrue(all(len(df) <= ins.Constants.MAX_CANDLE_STICKS for df in pages))
+            self.assertTrue(pd.concat(pages).equals(expected))
+
+        # arguments are verified on call
+        with self.assertRaises(ValueError):
+            instrument.iterCandles('EUR_USD', '2020-01-01', '2020-01-02', granularity='S1')
+
+        # closing the generator early stops fetching
+        ctx.requests.clear()
+        pages=instrument.iterCandles('EUR_USD', '2020-01-01', '2020-01-10', granularity='S5', workers=2)
+        next(pages)
+        pages.close()
+        self.assertLess(len(ctx.requests), 2 * (ins.Constants.PAGE_BUFFER + 2))
+
+    def testConcurrentFetch(self):
+        ctx=FakeContext(latency=0.1, hostname='concurrent.example.com')
+        instrument=ins.Instrument(ctx)
+
+        sequential=instrument.getCandles('EUR_USD', '2020-01-01', '2020-01-16', granularity='H1', split=8)
+        self.assertEqual(ctx.max_in_flight, 1)
+
+        ctx.max_in_flight=0
+        concurrent=instrument.getCandles('EUR_USD', '2020-01-01', '2020-01-16', granularity='H1', split=8, workers=8)
+
+        splits=ins.getSplits(date(2020, 1, 1), date(2020, 1, 16), splits=8)
+        self.assertEqual(len(ctx.requests), 2 * len(splits))
+        self.assertTrue(concurrent.equals(sequential))
+        self.assertTrue(concurrent.index.is_monotonic_increasing)
+        # requests of different splits overlap, instead of comparing wall-clock times
+        self.assertGreater(ctx.max_in_flight, 1)
+
+        with self.assertRaises(ValueError):
+            instrument.getCandles('EUR_USD', '2020-01-01', '2020-01-16', workers=0)
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,72 @@
+import unittest
+import numpy as np
+import pandas as pd
+from context import instrument as ins, merge, metrics
+from fake_context import FakeContext
+
+def makeFrame(times, complete=None):
+    index=pd.DatetimeIndex(times, tz='UTC')
+    close=np.arange(len(index), dtype=np.float64)
+    return pd.DataFrame({'Open': close, 'Close': close, 'Low': close, 'High': close,
+                         'Volume': np.arange(len(index)), 'Complete': np.ones(len(index), dtype=bool) if complete is None else complete},
+                        index=index)
+
+class PageMergerTest(unittest.TestCase):
+    def setUp(self):
+        self._df=makeFrame(pd.date_range('2020-01-06', periods=48, freq='h'))
+
+    def testOverlap(self):
+        # neighbouring pages share one or more candle sticks
+        pages=[self._df[:10], self._df[9:20], self._df[17:30], self._df[30:]]
+        df, gaps=merge.mergePages(pages, 'H1')
+        self.assertTrue(df.equals(self._df))
+        self.assertEqual(len(gaps), 0)
+
+        merger=merge.PageMerger('H1')
+        self.assertEqual(sum(len(p) for p in merge.iterMerged(pages, merger)), len(self._df))
+        self.assertEqual(merger.duplicates, 4)
+
+    def testPreferComplete(self):
+        incomplete=self._df[9:10].copy()
+        incomplete['Complete']=False
+        incomplete['Close']=-1.0
+        # the incomplete candle stick is replaced by the complete one of the next page
+        df, _=merge.mergePages([pd.concat([self._df[:9], incomplete]), self._df[9:]], 'H1')
+        self.assertTrue(df.equals(self._df))
+        # and a complete one is kept over an incomplete one fetched later
+        df, _=merge.mergePages([self._df[:10], pd.concat([incomplete, self._df[10:]])], 'H1')
+        self.assertTrue(df.equals(self._df))
+        # as well as within a page
+        df, _=merge.mergePages([pd.concat([self._df[:10], incomplete, self._df[10:]])], 'H1')
+        self.assertTrue(df.equals(self._df))
+
+    def testOrder(self):
+        with self.assertRaises(ValueError):
+            merge.mergePages([self._df[::-1]], 'H1')
+        with self.assertRaises(ValueError):
+            merge.mergePages([self._df[20:30], self._df[:10]], 'H1')
+        with self.assertRaises(ValueError):
+            merge.mergePages([self._df[:10], self._df[20:30], self._df[5:8]], 'H1')
+
+    def testGaps(self):
+        times=list(pd.date_range('2020-01-03 18:00', '2020-01-03 21:00', freq='h')) + \
+            list(pd.date_range('2020-01-05 22:00', '2020-01-06 02:00', freq='h'))
+        df=makeFrame(times).drop(pd.Timestamp('2020-01-06 00:00', tz='UTC'))
+        merged, gaps=merge.mergePages([df[:3], df[3:6], df[6:]], 'H1')
+        self.assertTrue(merged.equals(df))
+        self.assertEqual(list(gaps.columns), list(merge.GAP_COLUMNS))
+        self.assertEqual(gaps['From'].tolist(), [pd.Timestamp('2020-01-03 21:00', tz='UTC'), pd.Timestamp('2020-01-05 23:00', tz='UTC')])
+        self.assertEqual(gaps['To'].tolist(), [pd.Timestamp('2020-01-05 22:00', tz='UTC'), pd.Timestamp('2020-01-06 01:00', tz='UTC')])
+        self.assertEqual(gaps['Missing'].tolist(), [48, 1])
+
+    def testInstrument(self):
+        m=metrics.Metrics()
+        instrument=ins.Instrument(FakeContext(), metrics=m)
+        merger=merge.PageMerger('M5')
+        df=instrument.getCandles('EUR_USD', '2020-01-01', '2020-01-20', granularity='M5', split=3, merger=merger)
+        self.assertTrue(df.index.is_monotonic_increasing and df.index.is_unique)
+        self.assertTrue(df.equals(ins.Instrument(FakeContext()).getCandles('EUR_USD', '2020-01-01', '2020-01-20', granularity='M5')))
+        self.assertEqual(m.snapshot()['counters']['duplicates'], merger.duplicates)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+import unittest, os, io
+from contextlib import redirect_stderr
+from unittest import mock
+from context import instrument as ins, metrics, fetcher, retry
+from fake_context import FakeContext
+from mock_server import MockServer
+
+class MetricsTest(unittest.TestCase):
+    def testMetrics(self):
+        observed=[]
+        m=metrics.Metrics(callback=lambda kind, name, value: observed.append((kind, name)))
+        with m.timer('http'):
+            pass
+        m.observe('http', 0.5)
+        m.increment('requests')
+        m.increment('requests')
+        m.increment('candles', 10)
+        snapshot=m.snapshot()
+        self.assertEqual(snapshot['timings']['http']['count'], 2)
+        self.assertEqual(snapshot['timings']['http']['max'], 0.5)
+        self.assertEqual(snapshot['counters']['requests'], 2)
+        self.assertEqual(snapshot['candles_per_request'], 5)
+        self.assertEqual(observed, [('timing', 'http'), ('timing', 'http'), ('counter', 'requests'), ('counter', 'requests'), ('counter', 'candles')])
+
+        text=m.toPrometheus()
+        self.assertIn('oandata_stage_seconds_count{stage="http"} 2\n', text)
+        self.assertIn('oandata_requests_total 2\n', text)
+        self.assertIn('oandata_candles_per_request 5.0\n', text)
+        self.assertIn('http', m.report())
+
+        m.reset()
+        self.assertEqual(m.snapshot()['timings'], {})
+
+    def testInstrument(self):
+        m=metrics.Metrics()
+        with MockServer() as server:
+            df=ins.Instrument.fromConfigDict(server.config(), metrics=m).getCandles('EUR_USD', '2020-01-01', '2020-01-01', granularity='M1')
+        snapshot=m.snapshot()
+        for stage in ('request', 'http', 'deserialize', 'dataframe', 'concat'):
+            self.assertIn(stage, snapshot['timings'])
+        self.assertEqual(snapshot['counters']['requests'], 1)
+        self.assertEqual(snapshot['counters']['candles'], len(df))
+        self.assertGreater(snapshot['counters']['bytes_received'], 0)
+
+        # retries and failures are counted
+        m=metrics.Metrics()
+        ctx=FakeContext(fail=lambda request: retry.FetchError('injected', []) if len(ctx.requests) < 3 else None)
+        ins.Instrument(ctx, retry_policy=retry.RetryPolicy(base_delay=0.001), metrics=m).getCandles('EUR_USD', '2020-01-01', '2020-01-01', granularity='H1', retry=5)
+        self.assertEqual(m.snapshot()['counters']['retries'], 2)
+        self.assertEqual(m.snapshot()['counters']['failures'], 0)
+
+    def testProfile(self):
+        parser=fetcher.createParser()
+        args=fetcher.ArgumentWrapper(parser.parse_args(['EUR_USD', '2020-01-01', '2020-01-01', '-g', 'H1', '-o', os.devnull, '--profile', '-c', os.devnull]))
+        self.addCleanup(args.config_file.close)
+        ctx=FakeContext()
+        stderr=io.StringIO()
+        with mock.patch.object(ins.Instrument, 'fromConfigFile', side_effect=lambda *a, **kw: ins.Instrument(ctx)), redirect_stderr(stderr):
+            fetcher.fetch(args)
+        report=stderr.getvalue()
+        self.assertIn('dataframe', report)
+        self.assertIn('write', report)
+        self.assertIn('requests', report)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,186 @@
+import json, threading, time, random, argparse, bisect
+from datetime import datetime, timedelta, timezone
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+from context import instrument as ins
+
+def _parseTime(t):
+    if len(t) == 10:
+        return datetime.strptime(t, '%Y-%m-%d').replace(tzinfo=timezone.utc)
+    return datetime.strptime(t[:19], '%Y-%m-%dT%H:%M:%S').replace(tzinfo=timezone.utc)
+
+def candleDict(dt, price='M'):
+    """makes a deterministic candle starting at `dt` as sent by v20
+    """
+    v=(int(dt.timestamp()) % 1000) / 1000.0 + 1.0
+    candle={'time': dt.strftime('%Y-%m-%dT%H:%M:%S.000000000Z'), 'volume': int(dt.timestamp()) % 97, 'complete': True}
+    for p, name in (('B', 'bid'), ('A', 'ask'), ('M', 'mid')):
+        if p in price:
+            candle[name]={'o': '{:.5f}'.format(v), 'h': '{:.5f}'.format(v + 0.002), 'l': '{:.5f}'.format(v - 0.002), 'c': '{:.5f}'.format(v + 0.001)}
+    return candle
+
+def loadRecorded(filename):
+    """loads candles recorded from the v20 REST server
+
+    :param filename: a JSON file holding either a response of the
+    candles endpoint or a list of them, e.g. saved by
+    `curl .../v3/instruments/EUR_USD/candles?...`
+    :return: the candles sorted by time, without duplicates
+    :rtype: list of dict
+    """
+    with open(filename) as f:
+        recorded=json.load(f)
+    responses=recorded if isinstance(recorded, list) else [recorded]
+    candles={c['time']: c for r in responses for c in r['candles']}
+    return [candles[t] for t in sorted(candles, key=_parseTime)]
+
+class CandlesHandler(BaseHTTPRequestHandler):
+    """serves candles at /v3/instruments/{instrument}/candles
+
+    Candles are synthetic, or recorded ones if the server has any.
+    Before responding, the handler waits for the latency of the server
+    and fails with server error (503) or too many requests (429) at the
+    rates of the server.
+    """
+    protocol_version='HTTP/1.1' # keeps connections alive
+
+    def do_GET(self):
+        url=urlparse(self.path)
+        parts=url.path.split('/')
+        if len(parts) != 5 or parts[1:3] != ['v3', 'instruments'] or parts[4] != 'candles':
+            return self._send(404, {'errorMessage': 'Not found'})
+        query={k: v[0] for k, v in parse_qs(url.query).items()}
+        server=self.server
+        server.requests.append(query)
+
+        if server.latency:
+            time.sleep(server.latency)
+        with server.lock:
+            draw=server.random.random()
+        if draw < server.throttle_rate:
+            server.throttled+=1
+            return self._send(429, {'errorMessage': 'Requests are being throttled'}, {'Retry-After': str(server.retry_after)})
+        if draw < server.throttle_rate + server.error_rate:
+            server.errors+=1
+            return self._send(503, {'errorMessage': 'Service unavailable'})
+
+        granularity=query.get('granularity', 'S5')
+        price=query.get('price', 'M')
+        step=timedelta(seconds=ins.getGranularityInSec(granularity))
+        t=_parseTime(query['from'])
+        if query.get('includeFirst') == 'False':
+            t+=step
+        end=_parseTime(query['to']) if 'to' in query else None
+        count=int(query.get('count', 500))
+        if server.recorded is not None:
+            candles=self._recorded(t, end, count)
+        else:
+            now=datetime.now(timezone.utc)
+            candles=[]
+            while t <= now and (t < end if end is not None else len(candles) < count):
+                candles.append(candleDict(t, price))
+                t+=step
+        self._send(200, {'instrument': parts[3], 'granularity': granularity, 'candles': candles})
+
+    def _recorded(self, t, end, count):
+        times=self.server.recorded_times
+        i=bisect.bisect_left(times, t)
+        j=bisect.bisect_left(times, end) if end is not None else min(len(times), i + count)
+        return self.server.recorded[i:j]
+
+    def _send(self, status, body, headers={}):
+        data=json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+class MockServer:
+    """a local stand-in for the candles endpoint of the v20 REST server
+
+    It is used as a context manager, serving on a free port of
+    localhost, unless another port is given. All queries are recorded
+    in `requests`, and the numbers of injected failures in `errors`
+    and `throttled`.
+    """
+    def __init__(self, latency=0, error_rate=0, throttle_rate=0, retry_after=0, recorded=None, seed=None, port=0):
+        """
+        :param latency: the seconds waited before each response
+        :param error_rate: the probability of responding with server error (503)
+        :param throttle_rate: the probability of responding with too many requests (429)
+        :param retry_after: the seconds asked to wait via Retry-After on 429
+        :param recorded: the filename of recorded candles served instead of synthetic ones, see `loadRecorded`
+        :param seed: the seed of injected failures
+        :param port: the port to listen on
+        """
+        self._latency=latency
+        self._error_rate=error_rate
+        self._throttle_rate=throttle_rate
+        self._retry_after=retry_after
+        self._recorded=loadRecorded(recorded) if recorded is not None else None
+        self._seed=seed
+        self._port=port
+
+    @property
+    def errors(self):
+        return self._server.errors
+
+    @property
+    def throttled(self):
+        return self._server.throttled
+
+    def __enter__(self):
+        self._server=ThreadingHTTPServer(('127.0.0.1', self._port), CandlesHandler)
+        self._server.daemon_threads=True
+        self._server.requests=[]
+        self._server.latency=self._latency
+        self._server.error_rate=self._error_rate
+        self._server.throttle_rate=self._throttle_rate
+        self._server.retry_after=self._retry_after
+        self._server.recorded=self._recorded
+        self._server.recorded_times=[_parseTime(c['time']) for c in self._recorded] if self._recorded is not None else None
+        self._server.random=random.Random(self._seed)
+        self._server.lock=threading.Lock()
+        self._server.errors=0
+        self._server.throttled=0
+        self.requests=self._server.requests
+        self.port=self._server.server_port
+        self._thread=threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def config(self):
+        """gets the configuration of a v20 context connecting to the server
+        """
+        return {'hostname': '127.0.0.1', 'port': self.port, 'ssl': False, 'token': 'x'}
+
+    def __exit__(self, *args):
+        self._server.shutdown()
+        self._server.server_close()
+
+def main():
+    parser=argparse.ArgumentParser(description='Serve candles like the v20 REST server on localhost.')
+    parser.add_argument('--port', type=int, default=8080, help='the port to listen on')
+    parser.add_argument('--latency', type=float, default=0, help='the seconds waited before each response')
+    parser.add_argument('--error-rate', type=float, default=0, help='the probability of server errors (503)')
+    parser.add_argument('--throttle-rate', type=float, default=0, help='the probability of too many requests (429)')
+    parser.add_argument('--retry-after', type=float, default=1, help='the seconds asked to wait on 429')
+    parser.add_argument('--recorded', type=str, default=None, help='a JSON file of recorded candles to serve')
+    args=parser.parse_args()
+    with MockServer(args.latency, args.error_rate, args.throttle_rate, args.retry_after, args.recorded, port=args.port) as server:
+        print('Serving on http://127.0.0.1:{}, press Ctrl+C to stop'.format(server.port))
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            pass
+
+if __name__ == '__main__':
+    main()
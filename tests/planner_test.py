@@ -0,0 +1,97 @@
+import unittest, tempfile, os, io
+from datetime import date, timedelta
+from contextlib import redirect_stdout
+from unittest import mock
+import pandas as pd
+from context import instrument as ins, planner, fetcher, batch, cache
+from fake_context import FakeContext
+
+class PlannerTest(unittest.TestCase):
+    def setUp(self):
+        self._dir=tempfile.TemporaryDirectory()
+        self.addCleanup(self._dir.cleanup)
+
+    def testTradingSeconds(self):
+        # from Friday to Monday, markets close at 10pm UTC in winter and 9pm in summer
+        self.assertEqual((planner.tradingSeconds(date(2024, 1, 5), date(2024, 1, 8)) / 3600).tolist(), [22, 0, 2, 24])
+        self.assertEqual((planner.tradingSeconds(date(2024, 7, 5), date(2024, 7, 8)) / 3600).tolist(), [21, 0, 3, 24])
+        self.assertEqual((planner.tradingSeconds(date(2024, 1, 6), date(2024, 1, 6), all_week=True) / 3600).tolist(), [24])
+
+    def testPlanSplits(self):
+        # a period is fetched even if markets are closed all along
+        for skip_closed in (False, True):
+            self.assertEqual(planner.planSplits(date(2024, 1, 6), date(2024, 1, 6), 'M1', 4, skip_closed), [(date(2024, 1, 6), date(2024, 1, 6))])
+        # no more splits than pages, unless the number of splits is given
+        self.assertEqual(planner.planSplits(date(2024, 1, 1), date(2024, 1, 31), 'H1', 8), [(date(2024, 1, 1), date(2024, 1, 31))])
+        self.assertEqual(len(planner.planSplits(date(2024, 1, 1), date(2024, 1, 31), 'H1', 8, capped=False)), 8)
+        self.assertEqual(len(planner.planSplits(date(2024, 1, 1), date(2024, 1, 3), 'H1', 8, capped=False)), 3)
+
+        splits=planner.planSplits(date(2024, 1, 1), date(2024, 1, 14), 'M1', 7, skip_closed=True)
+        self.assertLessEqual(len(splits), 7)
+        self.assertEqual(splits[0][0], date(2024, 1, 1))
+        self.assertEqual(splits[-1][1], date(2024, 1, 14))
+        for (s, e), (s2, e2) in zip(splits, splits[1:]):
+            self.assertEqual(e + timedelta(days=1), s2)
+        for s, e in splits:
+            self.assertGreater(planner.tradingSeconds(s, e).sum(), 0)
+        self.assertLess(planner.countRequests(splits, 'M1', True), planner.countRequests(ins.getSplits(date(2024, 1, 1), date(2024, 1, 14), 7), 'M1', True))
+
+    def testDerive(self):
+        jobs=[fetcher.Job('EUR_USD', date(2020, 1, 1), date(2020, 1, 31), g, 'M', '{}.csv'.format(g)) for g in ('H1', 'M1', 'D')]
+        jobs.append(fetcher.Job('GBP_USD', date(2020, 1, 1), date(2020, 1, 31), 'H1', 'M', 'GBP_USD.csv'))
+        jobs.append(fetcher.Job('EUR_USD', date(2020, 1, 1), date(2020, 1, 31), 'H4', 'M', None))
+        plan=planner.makePlan(jobs)
+        self.assertEqual([step.job.granularity for step in plan.steps], ['M1', 'H1', 'H4'])
+        self.assertEqual(plan.steps[0].job.derive, [('H1', 'H1.csv'), ('D', 'D.csv')])
+        self.assertEqual(jobs[1].derive, []) # the jobs given are not changed
+        self.assertEqual(plan.results(['m1', 'gbp', 'h4']), [None, 'm1', None, 'gbp', 'h4'])
+        self.assertLess(plan.requests, plan.unplanned)
+
+        self.assertEqual(len(planner.makePlan(jobs, derive=False).steps), len(jobs))
+
+        # a given number of splits is not overridden
+        plan=planner.makePlan([jobs[0]], split=4, workers=1)
+        self.assertEqual(len(plan.steps[0].splits), 4)
+
+    def testCache(self):
+        candles=cache.CandleCache(self._dir.name)
+        candles.update('EUR_USD', 'M1', 'M', date(2020, 1, 1), date(2020, 1, 10), pd.DataFrame())
+        job=fetcher.Job('EUR_USD', date(2020, 1, 1), date(2020, 1, 31), 'M1', 'M', None)
+        plan=planner.makePlan([job], candles, workers=4)
+        self.assertEqual(plan.steps[0].ranges, [(date(2020, 1, 11), date(2020, 1, 31))])
+        self.assertGreaterEqual(plan.steps[0].splits[0][0], date(2020, 1, 11))
+        self.assertLess(plan.requests, planner.makePlan([job], workers=4).requests)
+
+    def testDryRun(self):
+        manifest=os.path.join(self._dir.name, 'manifest')
+        with open(manifest, 'w') as f:
+            f.write('EUR_USD,M1,2020-01-03,2020-01-06\nEUR_USD,H1,2020-01-03,2020-01-06\nEUR_USD,M1,2020-01-04,2020-01-04\n')
+        output=os.path.join(self._dir.name, '{instrument}_{granularity}_{price}_{from}.csv')
+        parser=batch.createParser()
+
+        # no config file is needed for a dry run
+        args=batch.ArgumentWrapper(parser.parse_args([manifest, '-o', output, '--dry-run']))
+        self.addCleanup(args.manifest.close)
+        out=io.StringIO()
+        with redirect_stdout(out):
+            fetcher.fetchJobs(args, args.getJobs())
+        self.assertIn('3 job(s) in 2 step(s)', out.getvalue())
+        self.assertFalse(os.path.exists(output.format(instrument='EUR_USD', granularity='M1', price='M', **{'from': '2020-01-03'})))
+
+        def run(*argv):
+            args=batch.ArgumentWrapper(parser.parse_args([manifest, '-o', output, '-c', os.devnull] + list(argv)))
+            self.addCleanup(args.manifest.close)
+            self.addCleanup(args.config_file.close)
+            ctx=FakeContext()
+            with mock.patch.object(ins.Instrument, 'fromConfigFile', side_effect=lambda *a, **kw: ins.Instrument(ctx)):
+                fetcher.fetchJobs(args, args.getJobs())
+            return sorted(r['granularity'] for r in ctx.requests)
+
+        # jobs are run as given unless planned
+        self.assertEqual(run(), ['H1', 'M1', 'M1', 'M1', 'M1'])
+        # the hours are derived from the minutes, the Saturday is fetched nevertheless
+        self.assertEqual(run('--plan', '--skip-closed'), ['M1'] * 4)
+        self.assertEqual(len(pd.read_csv(output.format(instrument='EUR_USD', granularity='H1', price='M', **{'from': '2020-01-03'}))), 96)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+import unittest, tempfile, os
+from unittest import mock
+import pandas as pd
+from context import instrument as ins, resample, fetcher
+from fake_context import FakeContext
+
+def ns(t):
+    return pd.Timestamp(t).value
+
+class ResampleTest(unittest.TestCase):
+    def testBucketStarts(self):
+        # minutes and hours are aligned in UTC
+        self.assertEqual(resample.bucketStarts([ns('2020-03-02T10:07:30Z')], 'M5')[0], ns('2020-03-02T10:05:00Z'))
+        self.assertEqual(resample.bucketStarts([ns('2020-03-02T10:07:30Z')], 'H1')[0], ns('2020-03-02T10:00:00Z'))
+
+        # trading days start at 5pm New York time, either EST or EDT
+        times=[ns('2020-03-06T21:59:00Z'), ns('2020-03-06T22:00:00Z'), ns('2020-03-10T20:59:00Z'), ns('2020-03-10T21:00:00Z')]
+        self.assertEqual(list(resample.bucketStarts(times, 'D')),
+                         [ns('2020-03-05T22:00:00Z'), ns('2020-03-06T22:00:00Z'), ns('2020-03-09T21:00:00Z'), ns('2020-03-10T21:00:00Z')])
+        self.assertEqual(resample.bucketStarts([ns('2020-03-02T03:00:00Z')], 'H4')[0], ns('2020-03-02T02:00:00Z'))
+
+        # weeks start on Friday and months on the evening before the first day
+        self.assertEqual(resample.bucketStarts([ns('2020-03-12T00:00:00Z')], 'W')[0], ns('2020-03-06T22:00:00Z'))
+        self.assertEqual(resample.bucketStarts([ns('2020-03-06T21:00:00Z')], 'W')[0], ns('2020-02-28T22:00:00Z'))
+        self.assertEqual(resample.bucketStarts([ns('2020-03-12T00:00:00Z')], 'M')[0], ns('2020-02-29T22:00:00Z'))
+
+        # another alignment
+        self.assertEqual(resample.bucketStarts([ns('2020-03-12T10:00:00Z')], 'D', daily_alignment=0, alignment_timezone='UTC')[0],
+                         ns('2020-03-12T00:00:00Z'))
+
+    def testCanResample(self):
+        for fine, coarse in (('M1', 'M5'), ('M1', 'D'), ('H4', 'D'), ('H3', 'H12'), ('D', 'W'), ('H8', 'M')):
+            self.assertTrue(resample.canResample(fine, coarse))
+        for fine, coarse in (('M5', 'M1'), ('M2', 'M5'), ('H8', 'H12'), ('W', 'M'), ('X', 'D')):
+            self.assertFalse(resample.canResample(fine, coarse))
+        with self.assertRaises(ValueError):
+            resample.Resampler('M5', 'M2')
+
+    def testResample(self):
+        fine=ins.Instrument(FakeContext()).getCandles('EUR_USD', '2020-03-02', '2020-03-04', granularity='M1', price='BA')
+        df=resample.resample(fine, 'M1', 'H1')
+        self.assertEqual(list(df.columns), list(fine.columns))
+        self.assertEqual(len(df), 72)
+        expected=fine.iloc[60:120]
+        row=df.iloc[1]
+        self.assertEqual(df.index[1], pd.Timestamp('2020-03-02T01:00:00Z'))
+        self.assertEqual(row['bid_o'], expected['bid_o'].iloc[0])
+        self.assertEqual(row['bid_c'], expected['bid_c'].iloc[-1])
+        self.assertEqual(row['ask_l'], expected['ask_l'].min())
+        self.assertEqual(row['ask_h'], expected['ask_h'].max())
+        self.assertEqual(row['Volume'], expected['Volume'].sum())
+        self.assertTrue(df['Complete'].all())
+
+        # trading days partially covered by the period are incomplete
+        df=resample.resample(fine, 'M1', 'D')
+        self.assertEqual(list(df.index), [pd.Timestamp(t) for t in ('2020-03-01T22:00Z', '2020-03-02T22:00Z', '2020-03-03T22:00Z', '2020-03-04T22:00Z')])
+        self.assertEqual(list(df['Complete']), [False, True, True, False])
+        self.assertEqual(df['Volume'].sum(), fine['Volume'].sum())
+
+        # an incomplete fine candle stick makes its bucket incomplete
+        fine.loc[fine.index[90], 'Complete']=False
+        self.assertFalse(resample.resample(fine, 'M1', 'H1')['Complete'].iloc[1])
+
+    def testPages(self):
+        fine=ins.Instrument(FakeContext()).getCandles('EUR_USD', '2020-03-02', '2020-03-10', granularity='M5')
+        expected=resample.resample(fine, 'M5', 'H4')
+        resampler=resample.Resampler('M5', 'H4')
+        pages=[resampler.update(fine.iloc[i:i + 77]) for i in range(0, len(fine), 77)] + [resampler.flush()]
+        df=pd.concat([page for page in pages if len(page) > 0])
+        self.assertTrue(df.equals(expected))
+
+    def testGetCandlesByGranularity(self):
+        ctx=FakeContext()
+        instrument=ins.Instrument(ctx)
+        result=instrument.getCandlesByGranularity('EUR_USD', '2020-03-02', '2020-03-03', ['H1', 'M15', 'D'])
+        self.assertEqual(set(r['granularity'] for r in ctx.requests), {'M15'})
+        self.assertEqual(len(result['M15']), 2 * 24 * 4)
+        self.assertEqual(len(result['H1']), 48)
+        self.assertTrue(result['H1'].equals(resample.resample(result['M15'], 'M15', 'H1')))
+        self.assertEqual(len(result['D']), 3)
+
+    def testDerive(self):
+        with tempfile.TemporaryDirectory() as d:
+            output=os.path.join(d, '{granularity}.csv')
+            parser=fetcher.createParser()
+            args=fetcher.ArgumentWrapper(parser.parse_args(['EUR_USD', '2020-03-02', '2020-03-03', '-g', 'M1', '-o', output, '-d', 'H1', 'D', '-c', os.devnull]))
+            self.addCleanup(args.config_file.close)
+            ctx=FakeContext()
+            with mock.patch.object(ins.Instrument, 'fromConfigFile', side_effect=lambda *a, **kw: ins.Instrument(ctx)):
+                fetcher.fetch(args)
+            self.assertEqual(set(r['granularity'] for r in ctx.requests), {'M1'})
+            self.assertEqual(len(pd.read_csv(output.format(granularity='M1'))), 2 * 24 * 60)
+            self.assertEqual(len(pd.read_csv(output.format(granularity='H1'))), 48)
+            self.assertEqual(len(pd.read_csv(output.format(granularity='D'))), 3)
+
+            args=fetcher.ArgumentWrapper(parser.parse_args(['EUR_USD', '2020-03-02', '2020-03-03', '-g', 'H1', '-o', output, '-d', 'M5', '-c', os.devnull]))
+            self.addCleanup(args.config_file.close)
+            with self.assertRaises(ValueError):
+                args.getJobs()
+
+if __name__ == '__main__':
+    unittest.main()
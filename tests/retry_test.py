@@ -0,0 +1,152 @@
+import unittest, os, tempfile, types, time, json
+from unittest import mock
+from datetime import date
+from email.utils import format_datetime
+from datetime import datetime, timedelta, timezone
+from v20.errors import ResponseUnexpectedStatus, V20Timeout
+from context import instrument as ins
+from context import retry, fetcher, batch, storage
+from fake_context import FakeContext
+from mock_server import MockServer, candleDict
+
+def statusError(status, headers=None):
+    """makes the exception v20 raises on an unexpected status
+    """
+    resp=types.SimpleNamespace(method='GET', path='/v3/instruments/EUR_USD/candles', status=status,
+                               reason='', body=None, headers=headers or {})
+    return ResponseUnexpectedStatus(resp, 200)
+
+class RetryTest(unittest.TestCase):
+    def testRetryable(self):
+        self.assertTrue(retry.isRetryable(statusError(429)))
+        self.assertTrue(retry.isRetryable(statusError(503)))
+        self.assertTrue(retry.isRetryable(V20Timeout('http://x', 'read')))
+        self.assertFalse(retry.isRetryable(statusError(400)))
+        self.assertFalse(retry.isRetryable(statusError(401)))
+
+    def testDelay(self):
+        policy=retry.RetryPolicy(base_delay=1, max_delay=5, jitter=False)
+        self.assertEqual([policy.delay(n, statusError(503)) for n in range(5)], [1, 2, 4, 5, 5])
+        policy=retry.RetryPolicy(base_delay=1, max_delay=60)
+        for n in range(4):
+            self.assertTrue(2 ** n / 2 <= policy.delay(n, statusError(503)) <= 2 ** n)
+
+        # the delay requested by the server takes precedence
+        self.assertEqual(policy.delay(0, statusError(429, {'Retry-After': '7'})), 7)
+        when=format_datetime(datetime.now(timezone.utc) + timedelta(seconds=30), usegmt=True)
+        self.assertTrue(25 < policy.delay(0, statusError(429, {'Retry-After': when})) <= 30)
+
+    def testFatal(self):
+        # a bad request is not retried
+        ctx=FakeContext(fail=lambda request: statusError(400))
+        instrument=ins.Instrument(ctx, retry_policy=retry.RetryPolicy(base_delay=0.001))
+        with self.assertRaises(ResponseUnexpectedStatus):
+            instrument.getCandles('EUR_USD', '2020-01-01', '2020-01-05', retry=5)
+        self.assertEqual(len(ctx.requests), 1)
+
+    def testTransient(self):
+        # the first two attempts of each request fail
+        attempts={}
+        def fail(request):
+            key=(request['fromTime'], request['includeFirst'])
+            attempts[key]=attempts.get(key, 0) + 1
+            return statusError(503) if attempts[key] <= 2 else None
+        ctx=FakeContext(fail=fail)
+        instrument=ins.Instrument(ctx, retry_policy=retry.RetryPolicy(base_delay=0.001))
+        df=instrument.getCandles('EUR_USD', '2020-01-01', '2020-01-03', granularity='H1', retry=3)
+        self.assertEqual(len(df), 72)
+        self.assertEqual(len(ctx.requests), 3)
+
+    def testThrottle(self):
+        # too many requests holds back the host for the requested delay
+        ctx=FakeContext(hostname='throttle.example.com', fail=lambda request: statusError(429, {'Retry-After': '0.3'}) if len(ctx.requests) == 1 else None)
+        instrument=ins.Instrument(ctx, retry_policy=retry.RetryPolicy(base_delay=0.001))
+        t=time.monotonic()
+        instrument.getCandles('EUR_USD', '2020-01-01', '2020-01-01', granularity='H1')
+        self.assertGreaterEqual(time.monotonic() - t, 0.3)
+        self.assertEqual(len(ctx.requests), 2)
+
+    def testPartialFailure(self):
+        # every request of the last split fails, the others are fetched
+        ctx=FakeContext(fail=lambda request: statusError(502) if str(request['fromTime']).startswith('2020-01-03') else None)
+        instrument=ins.Instrument(ctx, retry_policy=retry.RetryPolicy(base_delay=0.001))
+        with self.assertRaises(retry.FetchError) as cm:
+            instrument.getCandles('EUR_USD', '2020-01-01', '2020-01-03', granularity='H1', split=3, workers=2, retry=2)
+        self.assertEqual(cm.exception.failed_ranges, [(date(2020, 1, 3), date(2020, 1, 3))])
+        self.assertEqual(len(cm.exception.data), 48)
+        self.assertEqual(len(ctx.requests), 3)
+
+        # the fetcher lists failed ranges in a manifest the batch fetcher reads
+        with tempfile.TemporaryDirectory() as d:
+            output=os.path.join(d, 'EUR_USD.csv')
+            job=fetcher.Job('EUR_USD', date(2020, 1, 1), date(2020, 1, 3), 'H1', 'B', output)
+            with self.assertRaises(retry.FetchError):
+                fetcher.fetchJob(instrument, job, {'split': 3, 'retry': 2, 'workers': 1})
+            with open(fetcher.failedManifestOf(output)) as f:
+                jobs=batch.readManifest(f)
+            self.assertEqual(len(jobs), 1)
+            self.assertEqual((jobs[0].instrument, jobs[0].granularity, jobs[0].from_date, jobs[0].to_date, jobs[0].price, jobs[0].output),
+                             ('EUR_USD', 'H1', date(2020, 1, 3), date(2020, 1, 3), 'B', output))
+
+    def testResume(self):
+        # the first and last days fail, the manifest of failed ranges is fetched again into the output file
+        failing=lambda request: statusError(502) if str(request['fromTime'])[:10] in ('2020-01-01', '2020-01-03') else None
+        ctx=FakeContext(fail=failing)
+        instrument=ins.Instrument(ctx, retry_policy=retry.RetryPolicy(base_delay=0.001))
+        with tempfile.TemporaryDirectory() as d:
+            output=os.path.join(d, 'EUR_USD.csv')
+            job=fetcher.Job('EUR_USD', date(2020, 1, 1), date(2020, 1, 3), 'H1', 'B', output)
+            with self.assertRaises(retry.FetchError):
+                fetcher.fetchJob(instrument, job, {'split': [(date(2020, 1, d), date(2020, 1, d)) for d in (1, 2, 3)], 'retry': 1, 'workers': 1})
+            original=storage.loadPriceData(output)
+            self.assertEqual(len(original), 24)
+
+            manifest=fetcher.failedManifestOf(output)
+            def resume(days):
+                args=batch.ArgumentWrapper(batch.createParser().parse_args([manifest, '-c', os.devnull, '-w', '2', '-r', '1']))
+                self.addCleanup(args.manifest.close)
+                self.addCleanup(args.config_file.close)
+                jobs=args.getJobs()
+                # the ranges of an output file make a single job, so the file is written once
+                self.assertEqual([job.ranges for job in jobs], [[(date(2020, 1, d), date(2020, 1, d)) for d in days]])
+                with mock.patch.object(ins.Instrument, 'fromConfigFile', side_effect=lambda *a, **kw: instrument):
+                    fetcher.fetchJobs(args, jobs)
+
+            # the last day still fails, the first one is merged and listed no more
+            ctx.fail=lambda request: failing(request) if str(request['fromTime']).startswith('2020-01-03') else None
+            with self.assertRaises(retry.FetchError):
+                resume([1, 3])
+            self.assertEqual(len(storage.loadPriceData(output)), 48)
+            ctx.fail=None
+            resume([3])
+            df=storage.loadPriceData(output)
+            self.assertEqual(len(df), 72)
+            self.assertTrue(df.index.is_monotonic_increasing)
+            self.assertTrue(df.loc[original.index].equals(original))
+            # only the failed days were fetched again
+            self.assertEqual([str(r['fromTime'])[:10] for r in ctx.requests[3:]], ['2020-01-01', '2020-01-03', '2020-01-03'])
+
+    def testMockServer(self):
+        # failures injected by the server are retried end to end
+        with MockServer(error_rate=0.3, throttle_rate=0.2, retry_after=0.01, seed=1) as server:
+            instrument=ins.Instrument.fromConfigDict(server.config(), retry_policy=retry.RetryPolicy(base_delay=0.001))
+            df=instrument.getCandles('EUR_USD', '2020-01-01', '2020-01-10', granularity='M5', split=5, retry=20)
+            self.assertEqual(len(df), 10 * 24 * 12)
+            self.assertGreater(server.errors, 0)
+            self.assertGreater(server.throttled, 0)
+            splits=ins.getSplits(date(2020, 1, 1), date(2020, 1, 10), splits=5)
+            self.assertEqual(len(server.requests), len(splits) + server.errors + server.throttled)
+
+    def testRecorded(self):
+        start=datetime(2020, 1, 1, tzinfo=timezone.utc)
+        candles=[candleDict(start + timedelta(hours=h)) for h in range(48) if h % 5 != 0]
+        with tempfile.TemporaryDirectory() as d:
+            filename=os.path.join(d, 'recorded.json')
+            with open(filename, 'w') as f:
+                json.dump({'instrument': 'EUR_USD', 'granularity': 'H1', 'candles': candles}, f)
+            with MockServer(recorded=filename) as server:
+                df=ins.Instrument.fromConfigDict(server.config()).getCandles('EUR_USD', '2020-01-01', '2020-01-02', granularity='H1')
+        self.assertEqual([t.strftime('%Y-%m-%dT%H:%M:%S.000000000Z') for t in df.index], [c['time'] for c in candles])
+
+if __name__ == '__main__':
+    unittest.main()
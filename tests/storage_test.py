@@ -0,0 +1,93 @@
+import unittest, tempfile, os
+from datetime import datetime, timedelta, timezone
+import numpy as np
+import pandas as pd
+from context import instrument as ins, storage, columnar
+from fake_context import makeCandle
+
+try:
+    import pyarrow
+except ImportError:
+    pyarrow=None
+
+def makePages(pages=3, size=100, price='M'):
+    start=datetime(2020, 1, 1, tzinfo=timezone.utc)
+    return [ins.candlesToDataFrame([makeCandle(start + timedelta(minutes=p * size + i), price) for i in range(size)])
+            for p in range(pages)]
+
+class StorageTest(unittest.TestCase):
+    def setUp(self):
+        self._dir=tempfile.TemporaryDirectory()
+        self.addCleanup(self._dir.cleanup)
+
+    def _roundTrip(self, fmt, filename, dtype=None, price='M'):
+        pages=makePages(price=price)
+        path=os.path.join(self._dir.name, filename)
+        sink=storage.createSink(path, fmt=fmt, dtype=dtype)
+        for df in pages:
+            sink.write(df)
+        sink.close()
+        loaded=storage.loadPriceData(path)
+        expected=pd.concat(pages)
+        self.assertTrue(loaded.index.equals(expected.index))
+        self.assertEqual(list(loaded.columns), list(expected.columns))
+        return loaded, expected
+
+    def testCsv(self):
+        loaded, expected=self._roundTrip('csv', 'out.csv')
+        self.assertTrue(np.array_equal(loaded.to_numpy(), expected.to_numpy()))
+
+    def testNpy(self):
+        loaded, expected=self._roundTrip('npy', 'out', price='BA')
+        self.assertTrue(loaded.equals(expected))
+
+        loaded, expected=self._roundTrip('npy', 'out', dtype='float32')
+        self.assertEqual(loaded['Close'].dtype, 'float32')
+        self.assertEqual(loaded['Volume'].dtype, 'int64')
+        self.assertTrue(np.array_equal(loaded['Close'].to_numpy(), expected['Close'].to_numpy(dtype='float32')))
+
+        # the format is guessed from the .npy suffix of a new directory
+        loaded, expected=self._roundTrip(None, 'out.npy')
+        self.assertTrue(os.path.isdir(os.path.join(self._dir.name, 'out.npy')))
+        self.assertTrue(loaded.equals(expected))
+
+        # columns are mapped without copying
+        index, columns=columnar.openColumns(os.path.join(self._dir.name, 'out'))
+        self.assertIsInstance(index, np.memmap)
+        self.assertIsInstance(columns['Open'], np.memmap)
+        self.assertTrue(np.array_equal(index, expected.index.asi8))
+
+    @unittest.skipIf(pyarrow is None, 'pyarrow is not installed')
+    def testParquet(self):
+        loaded, expected=self._roundTrip(None, 'out.parquet')
+        self.assertTrue(loaded.equals(expected.rename_axis('Time')))
+
+    @unittest.skipIf(pyarrow is None, 'pyarrow is not installed')
+    def testFeather(self):
+        loaded, expected=self._roundTrip(None, 'out.feather', dtype='float32')
+        self.assertEqual(loaded['Open'].dtype, 'float32')
+        self.assertTrue(np.array_equal(loaded['Open'].to_numpy(), expected['Open'].to_numpy(dtype='float32')))
+
+    def testMerge(self):
+        first, second, third=makePages()
+        for fmt, filename in [('csv', 'out.csv'), ('npy', 'npy')] + ([('parquet', 'out.parquet')] if pyarrow is not None else []):
+            path=os.path.join(self._dir.name, filename)
+            storage.mergePriceData(path, pd.concat([first, third]), fmt=fmt)
+            # rows are merged in time order, stored rows of the same time are replaced
+            storage.mergePriceData(path, pd.concat([second, third.iloc[:10].assign(Volume=0)]), fmt=fmt)
+            loaded=storage.loadPriceData(path, fmt)
+            self.assertTrue(loaded.index.equals(pd.concat([first, second, third]).index))
+            self.assertEqual(loaded['Volume'].iloc[200:210].tolist(), [0] * 10)
+            self.assertFalse(os.path.exists(path + '.merging'))
+
+    def testFormatOf(self):
+        self.assertEqual(storage.formatOf('a.parquet'), 'parquet')
+        self.assertEqual(storage.formatOf('a.arrow'), 'feather')
+        self.assertEqual(storage.formatOf('a.csv'), 'csv')
+        self.assertEqual(storage.formatOf(self._dir.name), 'npy')
+        self.assertEqual(storage.formatOf(os.path.join(self._dir.name, 'out.npy')), 'npy')
+        with self.assertRaises(ValueError):
+            storage.createSink('a', fmt='xls')
+
+if __name__ == '__main__':
+    unittest.main()
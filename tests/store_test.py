@@ -0,0 +1,70 @@
+import unittest, tempfile
+from datetime import date, datetime
+import numpy as np
+import pandas as pd
+from context import instrument as ins, store, cache
+from fake_context import FakeContext
+
+class CandleStoreTest(unittest.TestCase):
+    def setUp(self):
+        self._dir=tempfile.TemporaryDirectory()
+        self.addCleanup(self._dir.cleanup)
+        self._df=ins.Instrument(FakeContext()).getCandles('EUR_USD', '2020-01-01', '2020-01-10', granularity='H1')
+
+    def testSlice(self):
+        s=store.CandleStore(self._dir.name)
+        self.assertIsNone(s.load('EUR_USD', 'H1', 'M', date(2020, 1, 1), date(2020, 1, 2)))
+        s.write('EUR_USD', 'H1', 'M', date(2020, 1, 1), date(2020, 1, 10), self._df)
+
+        df=s.slice('EUR_USD', 'H1', 'M', datetime(2020, 1, 3, 5), pd.Timestamp('2020-01-04 07:00', tz='UTC'))
+        self.assertTrue(df.equals(self._df['2020-01-03 05:00':'2020-01-04 07:00']))
+        df=s.load('EUR_USD', 'H1', 'M', date(2020, 1, 5), date(2020, 1, 6))
+        self.assertTrue(df.equals(self._df['2020-01-05':'2020-01-06']))
+        self.assertEqual(len(s.load('EUR_USD', 'H1', 'M', date(2019, 12, 1), date(2019, 12, 31))), 0)
+
+        # the frame is a view on the memory mapped columns
+        index, columns=s.open('EUR_USD', 'H1', 'M')
+        self.assertTrue(np.shares_memory(df['Close'].to_numpy(), columns['Close']))
+        self.assertTrue(np.shares_memory(df.index.asi8, index))
+        self.assertEqual(str(df.index.tz), 'UTC')
+
+    def testWrite(self):
+        s=store.CandleStore(self._dir.name)
+        s.write('EUR_USD', 'H1', 'M', date(2020, 1, 1), date(2020, 1, 4), self._df[:'2020-01-04'])
+        s.write('EUR_USD', 'H1', 'M', date(2020, 1, 7), date(2020, 1, 10), self._df['2020-01-07':])
+        self.assertEqual(s.coverage('EUR_USD', 'H1', 'M'), [(date(2020, 1, 1), date(2020, 1, 4)), (date(2020, 1, 7), date(2020, 1, 10))])
+        self.assertTrue(s.covers('EUR_USD', 'H1', 'M', date(2020, 1, 2), date(2020, 1, 4)))
+        self.assertFalse(s.covers('EUR_USD', 'H1', 'M', date(2020, 1, 2), date(2020, 1, 7)))
+
+        # the maps are reopened once the files are replaced
+        s.write('EUR_USD', 'H1', 'M', date(2020, 1, 5), date(2020, 1, 6), self._df['2020-01-05':'2020-01-06'])
+        self.assertTrue(s.covers('EUR_USD', 'H1', 'M', date(2020, 1, 1), date(2020, 1, 10)))
+        self.assertTrue(s.load('EUR_USD', 'H1', 'M', date(2020, 1, 1), date(2020, 1, 10)).equals(self._df))
+
+        # a range written again is replaced
+        s.write('EUR_USD', 'H1', 'M', date(2020, 1, 1), date(2020, 1, 10), pd.DataFrame())
+        self.assertEqual(len(s.load('EUR_USD', 'H1', 'M', date(2020, 1, 1), date(2020, 1, 10))), 0)
+
+    def testInstrument(self):
+        s=store.CandleStore(self._dir.name)
+        s.write('EUR_USD', 'H1', 'M', date(2020, 1, 1), date(2020, 1, 10), self._df)
+
+        ctx=FakeContext()
+        instrument=ins.Instrument(ctx, store=s)
+        df=instrument.getCandles('EUR_USD', '2020-01-03', '2020-01-07', granularity='H1')
+        self.assertEqual(len(ctx.requests), 0)
+        self.assertTrue(df.equals(self._df['2020-01-03':'2020-01-07']))
+
+        # ranges not fully covered are fetched
+        df=instrument.getCandles('EUR_USD', '2020-01-08', '2020-01-12', granularity='H1')
+        self.assertGreater(len(ctx.requests), 0)
+        self.assertTrue(df.equals(ins.Instrument(FakeContext()).getCandles('EUR_USD', '2020-01-08', '2020-01-12', granularity='H1')))
+
+    def testCacheDirectory(self):
+        ins.Instrument(FakeContext(), cache=cache.CandleCache(self._dir.name)).getCandles('EUR_USD', '2020-01-01', '2020-01-10', granularity='H1')
+        s=store.CandleStore(self._dir.name)
+        self.assertTrue(s.covers('EUR_USD', 'H1', 'M', date(2020, 1, 1), date(2020, 1, 10)))
+        self.assertTrue(s.load('EUR_USD', 'H1', 'M', date(2020, 1, 1), date(2020, 1, 10)).equals(self._df))
+
+if __name__ == '__main__':
+    unittest.main()
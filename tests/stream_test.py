@@ -0,0 +1,122 @@
+import unittest, threading, json
+from http.server import HTTPServer, BaseHTTPRequestHandler
+import numpy as np
+import pandas as pd
+import v20
+from context import stream, resample, factory as fc
+
+# recorded ticks of EUR_USD as sent by the pricing stream
+TICKS=[
+    ('2020-01-02T10:00:01.250000000Z', 1.10010, 1.10020),
+    ('2020-01-02T10:00:02.500000000Z', 1.10030, 1.10040),
+    ('2020-01-02T10:00:04.000000000Z', 1.10000, 1.10010),
+    ('2020-01-02T10:00:05.000000000Z', 1.10050, 1.10060), # starts a new S5 bar
+    ('2020-01-02T10:00:09.999999999Z', 1.10040, 1.10050),
+    ('2020-01-02T10:01:00.000000000Z', 1.10070, 1.10080), # starts a new M1 bar
+]
+
+def recordedLines():
+    lines=[]
+    for t, bid, ask in TICKS:
+        lines.append({'type': 'PRICE', 'instrument': 'EUR_USD', 'time': t, 'tradeable': True,
+                      'bids': [{'price': str(bid), 'liquidity': 1000000}],
+                      'asks': [{'price': str(ask), 'liquidity': 1000000}]})
+    lines.append({'type': 'HEARTBEAT', 'time': '2020-01-02T10:02:00.000000000Z'})
+    return [json.dumps(line).encode() + b'\n' for line in lines]
+
+class ReplayHandler(BaseHTTPRequestHandler):
+    """replays recorded lines of the pricing stream, then closes the connection
+    """
+    def do_GET(self):
+        self.server.paths.append(self.path)
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.end_headers()
+        for line in recordedLines():
+            self.wfile.write(line)
+            self.wfile.flush()
+
+    def log_message(self, *args):
+        pass
+
+class StreamTest(unittest.TestCase):
+    def testParseTime(self):
+        self.assertEqual(stream.parseTime('2020-01-02T10:00:01.250000000Z'), pd.Timestamp('2020-01-02T10:00:01.25Z').value)
+        self.assertEqual(stream.parseTime('2020-01-02T10:00:01Z'), pd.Timestamp('2020-01-02T10:00:01Z').value)
+        self.assertEqual(stream.parseTime('2020-01-02T10:00:01.000000001Z') % 10**9, 1)
+
+    def testBarStart(self):
+        t=stream.parseTime('2020-01-02T10:47:13.5Z') # a Thursday
+        self.assertEqual(stream.barStart(t, 'S5'), pd.Timestamp('2020-01-02T10:47:10Z').value)
+        self.assertEqual(stream.barStart(t, 'M15'), pd.Timestamp('2020-01-02T10:45:00Z').value)
+        # bars from H2 on are aligned to trading days starting at 5pm New York time (10pm UTC in winter)
+        self.assertEqual(stream.barStart(t, 'H4'), pd.Timestamp('2020-01-02T10:00:00Z').value)
+        self.assertEqual(stream.barStart(t, 'D'), pd.Timestamp('2020-01-01T22:00:00Z').value)
+        self.assertEqual(stream.barStart(t, 'W'), pd.Timestamp('2019-12-27T22:00:00Z').value)
+        self.assertEqual(stream.barStart(t, 'M'), pd.Timestamp('2019-12-31T22:00:00Z').value)
+        self.assertEqual(stream.barStart(stream.parseTime('2020-07-02T10:47:13Z'), 'D'), pd.Timestamp('2020-07-01T21:00:00Z').value)
+        self.assertEqual(stream.barStart(t, 'D', daily_alignment=0, alignment_timezone='UTC'), pd.Timestamp('2020-01-02T00:00:00Z').value)
+
+        # live bars are those derived from candle sticks
+        times=np.array([pd.Timestamp(s).value for s in ('2020-03-06T21:59:59Z', '2020-03-08T21:00:00Z', '2020-03-31T21:00:00Z')])
+        for g in ('H2', 'H8', 'D', 'W', 'M'):
+            self.assertEqual([stream.barStart(int(t), g) for t in times], resample.bucketStarts(times, g).tolist())
+
+    def testTickBuffer(self):
+        ticks=stream.TickBuffer(3)
+        self.assertIsNone(ticks.latest())
+        for i in range(5):
+            ticks.append(i, 1.0 + i, 2.0 + i)
+        self.assertEqual(len(ticks), 3)
+        self.assertEqual(ticks.latest(), (4, 5.0, 6.0))
+        self.assertEqual(list(ticks.toDataFrame()['Bid']), [3.0, 4.0, 5.0])
+
+    def testBarAggregator(self):
+        bars=stream.BarAggregator('S5', price='B', capacity=1)
+        for t, bid, ask in TICKS:
+            bars.update(stream.parseTime(t), bid, ask)
+        df=bars.toDataFrame()
+        # the last complete bar and the current one
+        self.assertEqual(list(df.index), [pd.Timestamp('2020-01-02T10:00:05Z'), pd.Timestamp('2020-01-02T10:01:00Z')])
+        first=df.iloc[0]
+        self.assertEqual((first['Open'], first['Close'], first['Low'], first['High'], first['Volume']), (1.10050, 1.10040, 1.10040, 1.10050, 2))
+        self.assertEqual(list(df['Complete']), [True, False])
+        self.assertEqual(bars.latest()['Open'], 1.10070)
+
+        bars.advance(stream.parseTime('2020-01-02T10:01:05Z'))
+        self.assertIsNone(bars.latest())
+        self.assertTrue(bars.toDataFrame()['Complete'].all())
+
+        # daily bars end at the close of the trading day
+        bars=stream.BarAggregator('D')
+        for t in ('2020-01-02T21:00:00Z', '2020-01-02T21:59:59Z', '2020-01-02T22:00:00Z'):
+            bars.update(stream.parseTime(t), 1.1, 1.1)
+        self.assertEqual(list(bars.toDataFrame().index), [pd.Timestamp('2020-01-01T22:00:00Z'), pd.Timestamp('2020-01-02T22:00:00Z')])
+
+    def testReplay(self):
+        server=HTTPServer(('127.0.0.1', 0), ReplayHandler)
+        server.paths=[]
+        thread=threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+
+        factory=fc.Factory({'hostname': 'unused', 'stream_hostname': '127.0.0.1', 'port': server.server_port, 'ssl': False, 'token': 'x'})
+        ctx=factory.createStreamContext()
+        self.assertIsInstance(ctx, v20.Context)
+        prices=stream.PriceStream(ctx, '101-001-1-001', ['EUR_USD'], granularities=['S5', 'M1'])
+        prices.run()
+
+        self.assertIn('/v3/accounts/101-001-1-001/pricing/stream', server.paths[0])
+        self.assertEqual(len(prices.ticks['EUR_USD']), len(TICKS))
+        s5=prices.bars['EUR_USD']['S5'].toDataFrame()
+        self.assertEqual(len(s5), 3)
+        self.assertTrue(s5['Complete'].all()) # completed by the heartbeat
+        self.assertAlmostEqual(s5.iloc[0]['Open'], (1.10010 + 1.10020) / 2)
+        self.assertAlmostEqual(s5.iloc[0]['High'], (1.10030 + 1.10040) / 2)
+        self.assertEqual(s5.iloc[0]['Volume'], 3)
+        m1=prices.bars['EUR_USD']['M1'].toDataFrame()
+        self.assertEqual(list(m1['Volume']), [5, 1])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,12 +2,42 @@ import unittest
 
 import factory_test
 import instrument_test
+import cache_test
+import fetcher_test
+import storage_test
+import stream_test
+import retry_test
+import checkpoint_test
+import resample_test
+import metrics_test
+import asyncinstrument_test
+import compact_test
+import backfill_test
+import store_test
+import merge_test
+import follow_test
+import planner_test
 
 loader=unittest.TestLoader()
 suite=unittest.TestSuite()
 
 suite.addTest(loader.loadTestsFromModule(factory_test))
 suite.addTest(loader.loadTestsFromModule(instrument_test))
+suite.addTest(loader.loadTestsFromModule(cache_test))
+suite.addTest(loader.loadTestsFromModule(fetcher_test))
+suite.addTest(loader.loadTestsFromModule(storage_test))
+suite.addTest(loader.loadTestsFromModule(stream_test))
+suite.addTest(loader.loadTestsFromModule(retry_test))
+suite.addTest(loader.loadTestsFromModule(checkpoint_test))
+suite.addTest(loader.loadTestsFromModule(resample_test))
+suite.addTest(loader.loadTestsFromModule(metrics_test))
+suite.addTest(loader.loadTestsFromModule(asyncinstrument_test))
+suite.addTest(loader.loadTestsFromModule(compact_test))
+suite.addTest(loader.loadTestsFromModule(backfill_test))
+suite.addTest(loader.loadTestsFromModule(store_test))
+suite.addTest(loader.loadTestsFromModule(merge_test))
+suite.addTest(loader.loadTestsFromModule(follow_test))
+suite.addTest(loader.loadTestsFromModule(planner_test))
 
 runner=unittest.TextTestRunner(verbosity=3)
 result=runner.run(suite)